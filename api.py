@@ -0,0 +1,364 @@
+import hashlib
+import io
+import json
+import logging
+import os
+
+import flask
+import numpy as np
+import pandas as pd
+
+import cube
+import data
+import distinct
+import grouping
+import metrics
+from cache import memoize
+from data import DATE_COLUMN
+from filters import filter_chunks
+
+logger = logging.getLogger(__name__)
+
+# Наибольшее число запросов в одном пакете POST /api/aggregate
+MAX_QUERIES = int(os.environ.get('DASHBOARD_API_MAX_QUERIES', 32))
+
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+
+# Измерения, по которым можно группировать, и колонки датасета за ними
+DIMENSIONS = {
+    'day': DATE_COLUMN,
+    'gender': 'Gender',
+    'age': 'Age',
+    'category': 'Product Category',
+    'payment': 'Payment Method',
+}
+
+# Меры куба и число уникальных клиентов, которое из куба не складывается
+MEASURES = cube.MEASURES + ('customers',)
+
+# Измерения, которые есть в кубе (см. cube.DailyCube), в порядке его осей после дня
+_CUBE_DIMENSIONS = ('gender', 'age', 'category')
+
+_FIELDS = {'start_date', 'end_date', 'gender', 'age', 'categories', 'by', 'measures'}
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [item for item in value.split(',') if item]
+    if not isinstance(value, list):
+        raise ValueError(f'expected a list, got {value!r}')
+    for item in value:
+        if not isinstance(item, str):
+            raise ValueError(f'expected a list of strings, got {value!r}')
+    return value
+
+
+# Запрос приводится к одному виду: даты — к дням, пустые фильтры — к None, категории
+# сортируются. Так эквивалентные запросы получают один ETag и одну запись кэша
+def normalize(query):
+    if not isinstance(query, dict):
+        raise ValueError('query must be an object')
+    unknown = set(query) - _FIELDS
+    if unknown:
+        raise ValueError(f'unknown fields: {", ".join(sorted(unknown))}')
+    by = _as_list(query.get('by'))
+    for name in by:
+        if name not in DIMENSIONS:
+            raise ValueError(f'unknown dimension {name!r}, expected one of {", ".join(DIMENSIONS)}')
+    if len(set(by)) != len(by):
+        raise ValueError('dimensions in by must not repeat')
+    measures = _as_list(query.get('measures')) or list(MEASURES)
+    for name in measures:
+        if name not in MEASURES:
+            raise ValueError(f'unknown measure {name!r}, expected one of {", ".join(MEASURES)}')
+    gender = query.get('gender') or None
+    if gender is not None and not isinstance(gender, str):
+        raise ValueError(f'gender must be a string, got {gender!r}')
+    age = query.get('age')
+    try:
+        if isinstance(age, bool) or isinstance(age, float) and not age.is_integer():
+            raise TypeError
+        age = int(age) if age not in (None, '') else None
+    except (TypeError, ValueError):
+        raise ValueError(f'age must be an integer, got {age!r}') from None
+    # Возраст 0, как и в фильтрах страниц (filters.apply_predicates), означает «без фильтра»
+    age = age or None
+    dates = {}
+    for field in ('start_date', 'end_date'):
+        value = query.get(field)
+        try:
+            # Числа pd.Timestamp принял бы как наносекунды от эпохи, поэтому дата — только строка
+            if value is not None and not isinstance(value, str):
+                raise TypeError
+            dates[field] = pd.Timestamp(value).date().isoformat() if value else None
+        except (TypeError, ValueError):
+            raise ValueError(f'{field} must be a date, got {value!r}') from None
+    categories = _as_list(query.get('categories'))
+    return {
+        'start_date': dates['start_date'],
+        'end_date': dates['end_date'],
+        'gender': gender,
+        'age': age,
+        'categories': sorted(set(categories)) if categories else None,
+        'by': by,
+        'measures': list(dict.fromkeys(measures)),
+    }
+
+
+def _filters(query):
+    return query['start_date'], query['end_date'], query['gender'], query['age'], query['categories']
+
+
+# Ключи группировки порции строк; дата приводится к дню
+def _keys(rows, by):
+    columns = {}
+    for name in by:
+        values = rows[DIMENSIONS[name]]
+        if name == 'day':
+            values = values.to_numpy().astype('datetime64[D]')
+        columns[name] = values
+    return pd.DataFrame(columns, index=rows.index)
+
+
+def _row_measures(rows, measures):
+    returns = rows['Returns'].to_numpy()
+    columns = {
+        'revenue': lambda: rows['Total Purchase Amount'].to_numpy(dtype=np.float64),
+        'churn': lambda: rows['Churn'].to_numpy(),
+        'returned': lambda: returns == 1,
+        'not_returned': lambda: returns == 0,
+    }
+    return {name: columns[name]() for name in measures if name in columns}
+
+
+def _empty(by, measures):
+    index = pd.MultiIndex.from_arrays([[] for _ in by], names=by) if len(by) > 1 else pd.Index([], name=by[0])
+    return pd.DataFrame({name: np.zeros(0, dtype=np.float64 if name == 'revenue' else np.int64) for name in measures}, index=index)
+
+
+# Группировка по строкам: порции окна дат группируются ядром grouping.group и складываются.
+# Уникальные клиенты считаются по парам (ключи, клиент), без повторов внутри и между порциями
+def _from_rows(snapshot, query, measures):
+    by = query['by']
+    totals = None
+    pairs = []
+    for rows in filter_chunks(snapshot.df, *_filters(query)):
+        keys = _keys(rows, by)
+        with metrics.phase('aggregate'):
+            part = grouping.group(keys, by, _row_measures(rows, measures), dropna=False)
+            totals = part if totals is None else totals.add(part, fill_value=0).astype(part.dtypes.to_dict())
+            if 'customers' in measures:
+                pairs.append(keys.assign(customer=rows['Customer ID'].to_numpy()).drop_duplicates())
+    if totals is None:
+        return _empty(by, measures)
+    result = totals.rename(columns={'size': 'count'})
+    if 'customers' in measures:
+        with metrics.phase('aggregate'):
+            unique = pd.concat(pairs).drop_duplicates()
+            result['customers'] = grouping.group(unique, by, dropna=False)['size'].reindex(result.index, fill_value=0)
+    return result[measures]
+
+
+# Группировка по кубу: дневные значения за диапазон (или разность префиксных сумм, если день
+# не запрошен), выбор значений фильтров и свёртка осей, которых нет в by. Как и у группировки
+# по строкам, в результат попадают только сочетания, в которых были покупки
+def _from_cube(snapshot, query, measures):
+    by = query['by']
+    start_date, end_date, gender, age, categories = _filters(query)
+    daily = cube.get_cube(snapshot)
+    d0, d1 = daily._day_range(start_date, end_date)
+    selection = daily._selection(gender, age, categories)
+    labels = {'day': np.datetime64(daily.first_day.date(), 'D') + np.arange(d0, d1)}
+    for name, values, index in zip(_CUBE_DIMENSIONS, (daily.genders, daily.ages, daily.categories), selection):
+        labels[name] = values if index is None else [values[i] for i in index]
+    axes = (['day'] if 'day' in by else []) + [name for name in _CUBE_DIMENSIONS if name in by]
+    order = [axes.index(name) for name in by]
+
+    blocks = {}
+    with metrics.phase('aggregate'):
+        for name in dict.fromkeys(['count'] + measures):
+            prefix = daily.prefix[name]
+            block = np.diff(prefix[d0:d1 + 1], axis=0) if 'day' in by else prefix[d1] - prefix[d0]
+            # Оси свёртываются с конца, поэтому номера оставшихся осей не сдвигаются
+            first_axis = block.ndim - len(_CUBE_DIMENSIONS)
+            for offset in reversed(range(len(_CUBE_DIMENSIONS))):
+                axis = first_axis + offset
+                if selection[offset] is not None:
+                    block = np.take(block, selection[offset], axis=axis)
+                if _CUBE_DIMENSIONS[offset] not in by:
+                    block = block.sum(axis=axis)
+            blocks[name] = np.transpose(block, order).reshape(-1)
+
+    observed = np.flatnonzero(blocks['count'])
+    index = pd.MultiIndex.from_product([labels[name] for name in by], names=by)[observed]
+    if len(by) == 1:
+        # Как у grouping.group: по одному ключу — обычный индекс
+        index = index.get_level_values(0)
+    result = pd.DataFrame({name: blocks[name][observed] for name in measures}, index=index)
+    # Значения, дописанные в куб при обновлении данных, стоят в конце его осей
+    return result if index.is_monotonic_increasing else result.sort_index()
+
+
+def _totals(snapshot, query, measures):
+    start_date, end_date, gender, age, categories = _filters(query)
+    result = {}
+    cube_measures = [name for name in measures if name != 'customers']
+    with metrics.phase('aggregate'):
+        if cube_measures and cube.ENABLED:
+            totals = cube.get_cube(snapshot).totals(start_date, end_date, gender, age, categories)
+            result.update((name, totals[name]) for name in cube_measures)
+        # Индекс уникальных клиентов не различает категории: с фильтром по ним клиенты считаются по строкам
+        if 'customers' in measures and not categories and distinct.MODE != 'rows':
+            result['customers'] = distinct.count_customers(snapshot, start_date, end_date, gender, age)
+    missing = [name for name in measures if name not in result]
+    if missing:
+        sums = dict.fromkeys(cube.MEASURES, 0)
+        customers = []
+        for rows in filter_chunks(snapshot.df, *_filters(query)):
+            with metrics.phase('aggregate'):
+                for name, value in cube.totals_from_rows(rows).items():
+                    sums[name] += value
+                if 'customers' in missing:
+                    customers.append(rows['Customer ID'].unique())
+        sums['customers'] = len(pd.unique(np.concatenate(customers))) if customers else 0
+        result.update((name, sums[name]) for name in missing)
+    return pd.DataFrame({name: [result[name]] for name in measures})
+
+
+# Результат одного запроса: без группировки — итоги по кубу и индексу клиентов, с группировкой
+# по измерениям куба — куб, по методу оплаты или при отключённом кубе — строки
+def aggregate(snapshot, query):
+    measures = query['measures']
+    if not query['by']:
+        return _totals(snapshot, query, measures)
+    if not cube.ENABLED or not set(query['by']) <= set(_CUBE_DIMENSIONS) | {'day'}:
+        return _from_rows(snapshot, query, measures)
+    cube_measures = [name for name in measures if name != 'customers']
+    result = _from_cube(snapshot, query, cube_measures)
+    if 'customers' in measures:
+        customers = _from_rows(snapshot, query, ['customers'])['customers']
+        result['customers'] = customers.reindex(result.index, fill_value=0)
+    return result[measures]
+
+
+# Колонка для JSON: дни — строками ISO, пропуски — null, числа numpy — числами Python
+def _json_column(values):
+    if values.dtype.kind == 'M':
+        return [None if pd.isna(value) else value.date().isoformat() for value in values]
+    if values.dtype.kind in 'iub':
+        return values.tolist()
+    return [None if pd.isna(value) else value.item() if isinstance(value, np.generic) else value for value in values]
+
+
+def _json_body(version, results):
+    payload = {'version': version, 'results': []}
+    for result in results:
+        frame = result.reset_index() if result.index.names != [None] else result
+        payload['results'].append({
+            'rows': len(frame),
+            'columns': {name: _json_column(frame[name]) for name in frame.columns},
+        })
+    return json.dumps(payload, separators=(',', ':')).encode('utf-8'), 'application/json'
+
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+# Пакет в Arrow: таблицы запросов склеиваются в одну с колонкой query (номер запроса в пакете),
+# колонки, которых нет в таблице запроса, заполняются null
+def _arrow_body(version, results):
+    tables = []
+    for number, result in enumerate(results):
+        frame = result.reset_index() if result.index.names != [None] else result
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        tables.append(table.add_column(0, 'query', pa.array(np.full(len(frame), number, dtype=np.int32))))
+    table = pa.concat_tables(tables, promote_options='default')
+    table = table.replace_schema_metadata({'version': version})
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue(), ARROW_MIMETYPE
+
+
+def _queries_key(queries_json, fmt):
+    return queries_json, fmt
+
+
+# Тело ответа кэшируется по версии датасета и нормализованному пакету: повторный запрос
+# без If-None-Match отдаётся из кэша результатов без пересчёта
+@metrics.instrument
+@memoize(key=_queries_key)
+def render(queries_json, fmt):
+    snapshot = data.current()
+    results = [aggregate(snapshot, query) for query in json.loads(queries_json)]
+    if fmt == 'arrow':
+        return _arrow_body(snapshot.version, results)
+    return _json_body(snapshot.version, results)
+
+
+def _parse_request(request):
+    if request.method == 'POST':
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict):
+            raise ValueError('request body must be a JSON object')
+        fmt = payload.get('format')
+        queries = payload['queries'] if 'queries' in payload else [{k: v for k, v in payload.items() if k != 'format'}]
+        if not isinstance(queries, list) or not queries:
+            raise ValueError('queries must be a non-empty list')
+    else:
+        args = request.args
+        fmt = args.get('format')
+        query = {field: args.get(field) for field in ('start_date', 'end_date', 'gender', 'age') if args.get(field)}
+        for field in ('categories', 'by', 'measures'):
+            values = [item for value in args.getlist(field) for item in value.split(',') if item]
+            if values:
+                query[field] = values
+        unknown = set(args) - _FIELDS - {'format'}
+        if unknown:
+            raise ValueError(f'unknown parameters: {", ".join(sorted(unknown))}')
+        queries = [query]
+    if len(queries) > MAX_QUERIES:
+        raise ValueError(f'at most {MAX_QUERIES} queries per request')
+    if fmt is None:
+        fmt = 'arrow' if request.accept_mimetypes.best_match(['application/json', ARROW_MIMETYPE]) == ARROW_MIMETYPE else 'json'
+    if fmt not in ('json', 'arrow'):
+        raise ValueError(f'unknown format {fmt!r}, expected json or arrow')
+    return [normalize(query) for query in queries], fmt
+
+
+# GET /api/aggregate?start_date=...&gender=...&by=day,category&measures=count,revenue — один запрос,
+# POST {"queries": [...], "format": "json" | "arrow"} — пакет запросов в одном ответе.
+# ETag — хэш версии датасета и нормализованного пакета: на повторный запрос с If-None-Match
+# сервер отвечает 304, не считая и не сериализуя результат
+def handle():
+    request = flask.request
+    try:
+        queries, fmt = _parse_request(request)
+    except ValueError as error:
+        return flask.jsonify({'error': str(error)}), 400
+    if fmt == 'arrow' and pa is None:
+        logger.warning('pyarrow is not installed, Arrow responses are unavailable')
+        return flask.jsonify({'error': 'Arrow format requires pyarrow'}), 406
+
+    queries_json = json.dumps(queries, sort_keys=True)
+    with data.pinned() as snapshot:
+        etag = hashlib.sha1(json.dumps([snapshot.version, queries_json, fmt]).encode('utf-8')).hexdigest()
+        if request.if_none_match.contains(etag):
+            response = flask.Response(status=304)
+        else:
+            body, mimetype = render(queries_json, fmt)
+            response = flask.Response(body, mimetype=mimetype)
+    response.set_etag(etag)
+    # Клиент может хранить ответ, но перед использованием должен сверить ETag
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept')
+    return response
+
+
+def register(server):
+    server.add_url_rule('/api/aggregate', 'api_aggregate', handle, methods=['GET', 'POST'])
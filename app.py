@@ -1,6 +1,23 @@
+import logging
+import threading
+import time
+
+# Время запуска отсчитывается до импорта dash, pandas и страниц
+STARTED = time.perf_counter()
+
 import dash_bootstrap_components as dbc
 from dash import Dash, Input, Output, dcc, html
 from pages import home, clients, purchase, about
+import clientside
+import data
+import ingest
+import api
+import metrics
+import precompute
+
+logger = logging.getLogger(__name__)
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
 
 external_stylesheets = [dbc.themes.ZEPHYR]  
 app = Dash(__name__, external_stylesheets=external_stylesheets,  use_pages=True)
@@ -46,7 +63,17 @@ sidebar = html.Div(
 
 content = html.Div(id="page-content", style=CONTENT_STYLE)
 
-app.layout = html.Div([dcc.Location(id="url"), sidebar, content])
+# В режиме клиентских вычислений в макет добавляются хранилища агрегатов (см. clientside.py)
+app.layout = html.Div([dcc.Location(id="url"), sidebar, content] + clientside.stores())
+
+# WSGI-приложение для запуска под сервером приложений (см. serve.py)
+server = app.server
+
+# Гистограммы времени коллбэков и статистика кэша в формате Prometheus на /metrics
+metrics.register(server)
+
+# JSON/Arrow API агрегатов с теми же фильтрами, что на страницах (см. api.py)
+api.register(server)
 
 @app.callback(
     Output("page-content", "children"),
@@ -54,11 +81,11 @@ app.layout = html.Div([dcc.Location(id="url"), sidebar, content])
 
 def render_page_content(pathname):
     if pathname == "/":
-        return home.layout
+        return home.layout()
     elif pathname == "/clients":
-        return clients.layout
+        return clients.layout()
     elif pathname == "/purchase":
-        return purchase.layout
+        return purchase.layout()
     elif pathname == "/about":
         return about.layout
     
@@ -72,5 +99,28 @@ def render_page_content(pathname):
     )
 
 
+def _startup_stage(stage):
+    seconds = time.perf_counter() - STARTED
+    metrics.startup[stage] = seconds
+    logger.info('startup: %s after %.2f s', stage, seconds)
+
+
+# Датасет загружается, а состояние страниц по умолчанию считается в фоне: сервер отвечает
+# сразу, макеты строятся из метаданных кэша, а коллбэки ждут окончания загрузки
+def _finish_startup():
+    data.current()
+    _startup_stage('dataset_loaded')
+    precompute.warm_up()
+    _startup_stage('warmed_up')
+
+
+data.start_loading()
+startup = threading.Thread(target=_finish_startup, name='startup', daemon=True)
+startup.start()
+_startup_stage('app_ready')
+
+
 if __name__ == '__main__':
-        app.run_server(debug=True)
\ No newline at end of file
+        # Строки, дописанные в CSV, подхватываются без перезапуска
+        ingest.start_watcher()
+        app.run_server(debug=True)
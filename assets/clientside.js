@@ -0,0 +1,391 @@
+// Клиентские вычисления для режима DASHBOARD_CLIENTSIDE=1 (см. clientside.py).
+// Агрегаты приходят в dcc.Store массивами base64; фигуры собираются из серверных
+// шаблонов заменой данных, поэтому оформление совпадает с серверным режимом
+(function () {
+    var DAY_MS = 86400000;
+    var TYPES = {uint8: Uint8Array, uint16: Uint16Array, uint32: Uint32Array, float64: Float64Array};
+    var decoded = new WeakMap();
+
+    function decode(measure) {
+        var values = decoded.get(measure);
+        if (!values) {
+            var binary = atob(measure.data);
+            var bytes = new Uint8Array(binary.length);
+            for (var i = 0; i < binary.length; i++) {
+                bytes[i] = binary.charCodeAt(i);
+            }
+            values = new TYPES[measure.dtype](bytes.buffer);
+            decoded.set(measure, values);
+        }
+        return values;
+    }
+
+    function clone(value) {
+        return JSON.parse(JSON.stringify(value));
+    }
+
+    // Номер дня от эпохи для строки 'YYYY-MM-DD...' (время отбрасывается, как в filters.day_bounds)
+    function dayNumber(value) {
+        return Date.UTC(+value.slice(0, 4), +value.slice(5, 7) - 1, +value.slice(8, 10)) / DAY_MS;
+    }
+
+    function isoDay(day) {
+        return new Date(day * DAY_MS).toISOString().slice(0, 10);
+    }
+
+    function timestamp(value) {
+        var text = value.length >= 19 ? value.slice(0, 19).replace(' ', 'T') : value.slice(0, 10) + 'T00:00:00';
+        return Date.parse(text + 'Z');
+    }
+
+    // Индексы подписей оси, попадающих под фильтр; null выбирает всю ось
+    function pick(labels, values) {
+        var wanted = values === null ? null : [].concat(values);
+        var selected = [];
+        for (var i = 0; i < labels.length; i++) {
+            if (wanted === null || wanted.indexOf(labels[i]) !== -1) {
+                selected.push(i);
+            }
+        }
+        return selected;
+    }
+
+    // Диапазон дней [d0, d1) куба: конечная дата включается целиком
+    function dayRange(firstDay, days, start, last) {
+        var d0 = start === null ? 0 : start - firstDay;
+        var d1 = last === null ? days : last + 1 - firstDay;
+        d0 = Math.min(Math.max(d0, 0), days);
+        d1 = Math.min(Math.max(d1, d0), days);
+        return [d0, d1];
+    }
+
+    // Суммы меры по выбранным ячейкам осей 1 и 2 для каждого дня диапазона
+    function dailySums(measure, d0, d1, first, second) {
+        var values = decode(measure);
+        var n1 = measure.shape[1], n2 = measure.shape[2];
+        var result = new Float64Array(d1 - d0);
+        for (var d = d0; d < d1; d++) {
+            var total = 0;
+            for (var i = 0; i < first.length; i++) {
+                var base = (d * n1 + first[i]) * n2;
+                for (var j = 0; j < second.length; j++) {
+                    total += values[base + second[j]];
+                }
+            }
+            result[d - d0] = total;
+        }
+        return result;
+    }
+
+    function sum(values) {
+        var total = 0;
+        for (var i = 0; i < values.length; i++) {
+            total += values[i];
+        }
+        return total;
+    }
+
+    // Скользящие суммы за window дней для последних days дней ряда префиксных сумм
+    // (как timeseries.rolling_sums); окна, начинающиеся раньше ряда, — NaN
+    function rollingSums(cumulative, days, window) {
+        var result = new Array(days);
+        var offset = cumulative.length - days;
+        for (var i = 0; i < days; i++) {
+            var end = offset + i, start = end - window;
+            result[i] = start < 0 ? NaN : cumulative[end] - cumulative[start];
+        }
+        return result;
+    }
+
+    function prefixSums(values) {
+        var cumulative = new Float64Array(values.length + 1);
+        for (var i = 0; i < values.length; i++) {
+            cumulative[i + 1] = cumulative[i] + values[i];
+        }
+        return cumulative;
+    }
+
+    // Прореживание LTTB, как timeseries.lttb: x — номера дней, площади считаются в наносекундах,
+    // наибольшее и наименьшее значения добавляются к выбранным точкам
+    function lttb(x, y, threshold) {
+        var n = y.length;
+        if (threshold >= n || threshold < 3) {
+            return [x, y];
+        }
+        var xs = x.map(function (day) { return day * DAY_MS * 1e6; });
+        var every = (n - 2) / (threshold - 2);
+        var selected = [0], a = 0;
+        for (var i = 0; i < threshold - 2; i++) {
+            var avgStart = Math.floor((i + 1) * every) + 1;
+            var avgEnd = Math.min(Math.floor((i + 2) * every) + 1, n);
+            var avgX = 0, avgY = 0;
+            for (var j = avgStart; j < avgEnd; j++) {
+                avgX += xs[j];
+                avgY += y[j];
+            }
+            avgX /= avgEnd - avgStart;
+            avgY /= avgEnd - avgStart;
+            var rangeStart = Math.floor(i * every) + 1, rangeEnd = Math.floor((i + 1) * every) + 1;
+            var best = -1, next = rangeStart;
+            for (var k = rangeStart; k < rangeEnd; k++) {
+                var area = Math.abs((xs[a] - avgX) * (y[k] - y[a]) - (xs[a] - xs[k]) * (avgY - y[a]));
+                if (area > best) {
+                    best = area;
+                    next = k;
+                }
+            }
+            a = next;
+            selected.push(a);
+        }
+        selected.push(n - 1);
+        var max = 0, min = 0;
+        for (var m = 1; m < n; m++) {
+            if (y[m] > y[max]) {
+                max = m;
+            }
+            if (y[m] < y[min]) {
+                min = m;
+            }
+        }
+        selected = selected.concat([max, min]).sort(function (p, q) { return p - q; }).filter(function (value, position, sorted) {
+            return position === 0 || value !== sorted[position - 1];
+        });
+        return [selected.map(function (k) { return x[k]; }), selected.map(function (k) { return y[k]; })];
+    }
+
+    // Номера дней ряда с равным шагом, как timeseries.even_positions
+    function evenPositions(n, threshold) {
+        var positions = [];
+        if (n <= threshold || threshold < 2) {
+            for (var i = 0; i < n; i++) {
+                positions.push(i);
+            }
+            return positions;
+        }
+        for (var k = 0; k < threshold; k++) {
+            positions.push(Math.floor(k * (n - 1) / (threshold - 1)));
+        }
+        return positions;
+    }
+
+    // Дневной ряд выручки прореживается LTTB, скользящие средние — равным шагом (см. home.revenue_by_date_figure)
+    function revenueFigure(payload, startDate, endDate, genders, ages, visible, uirevision) {
+        var firstDay = dayNumber(payload.first_day);
+        var days = payload.measures.revenue.shape[0];
+        var start = startDate ? dayNumber(startDate) : null;
+        var last = endDate ? dayNumber(endDate) : null;
+        if (visible[0]) {
+            start = start === null ? dayNumber(visible[0]) : Math.max(start, dayNumber(visible[0]));
+        }
+        if (visible[1]) {
+            last = last === null ? dayNumber(visible[1]) : Math.min(last, dayNumber(visible[1]));
+        }
+
+        var range = dayRange(firstDay, days, start, last);
+        var revenue = dailySums(payload.measures.revenue, range[0], range[1], genders, ages);
+        var counts = dailySums(payload.measures.count, range[0], range[1], genders, ages);
+        var x = [], y = [];
+        for (var i = 0; i < revenue.length; i++) {
+            if (counts[i] > 0) {
+                x.push(firstDay + range[0] + i);
+                y.push(revenue[i]);
+            }
+        }
+        var thinned = lttb(x, y, payload.target_points);
+
+        // Скользящие средние выручки и оттока по префиксным суммам с запасом дней перед диапазоном
+        var windows = payload.rolling_windows;
+        var lo = Math.max(range[0] - (Math.max.apply(null, windows) - 1), 0);
+        var cumulative = {};
+        ['revenue', 'churn', 'count'].forEach(function (name) {
+            cumulative[name] = prefixSums(dailySums(payload.measures[name], lo, range[1], genders, ages));
+        });
+        var n = range[1] - range[0];
+        var positions = evenPositions(n, payload.target_points);
+        var rollingX = positions.map(function (d) { return isoDay(firstDay + range[0] + d); });
+
+        var figure = clone(payload.figures['revenue-by-date']);
+        figure.data[0].x = thinned[0].map(isoDay);
+        figure.data[0].y = thinned[1];
+        windows.forEach(function (window, position) {
+            var revenueSums = rollingSums(cumulative.revenue, n, window);
+            var counts = rollingSums(cumulative.count, n, window);
+            var churned = rollingSums(cumulative.churn, n, window);
+            var revenueTrace = figure.data[1 + position], churnTrace = figure.data[1 + windows.length + position];
+            revenueTrace.x = rollingX;
+            revenueTrace.y = positions.map(function (d) { return revenueSums[d] / window; });
+            churnTrace.x = rollingX;
+            churnTrace.y = positions.map(function (d) { return counts[d] > 0 ? churned[d] / counts[d] * 100 : NaN; });
+        });
+        figure.layout.uirevision = uirevision;
+        return figure;
+    }
+
+    // Дельта индикатора относительно предыдущего периода, как home.delta_indicator
+    function setDelta(indicator, delta, reference) {
+        indicator.mode = 'number+delta';
+        indicator.delta = Object.assign(clone(delta), {reference: reference});
+    }
+
+    function visibleWindow(relayoutData) {
+        if (!relayoutData) {
+            return [null, null];
+        }
+        var range = relayoutData['xaxis.range[0]'] !== undefined
+            ? [relayoutData['xaxis.range[0]'], relayoutData['xaxis.range[1]']]
+            : relayoutData['xaxis.range'];
+        if (!range) {
+            return [null, null];
+        }
+        return [String(range[0]).slice(0, 10), String(range[1]).slice(0, 10)];
+    }
+
+    function triggeredBy(propId) {
+        var triggered = window.dash_clientside.callback_context.triggered || [];
+        return triggered.some(function (item) { return item.prop_id === propId; });
+    }
+
+    // Трассы px с color= строятся по одной на значение в порядке появления, цвета идут
+    // по палитре по позиции. Шаблон трассы берётся по имени, цвет — по позиции
+    function colorTraces(template, labels, fill) {
+        return labels.map(function (label, position) {
+            var source = template.data.filter(function (trace) { return trace.name === label; })[0];
+            var trace = clone(source || template.data[position % template.data.length]);
+            trace.name = label;
+            trace.marker.color = template.data[position % template.data.length].marker.color;
+            fill(trace, position);
+            return trace;
+        });
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        dashboard: {
+            homeFigures: function (startDate, endDate, gender, age, relayoutData, payloads) {
+                var noUpdate = window.dash_clientside.no_update;
+                if (!payloads || !payloads.home) {
+                    return [noUpdate, noUpdate, noUpdate, noUpdate];
+                }
+                var payload = payloads.home;
+                var genders = pick(payload.genders, gender || null);
+                var ages = pick(payload.ages, age || null);
+                var uirevision = JSON.stringify([startDate, endDate, gender || null, age || null]);
+
+                // Изменение масштаба графика выручки пересчитывает только этот график
+                if (triggeredBy('revenue-by-date.relayoutData')) {
+                    return [noUpdate, noUpdate,
+                        revenueFigure(payload, startDate, endDate, genders, ages, visibleWindow(relayoutData), uirevision),
+                        noUpdate];
+                }
+
+                var days = payload.measures.count.shape[0];
+                var range = dayRange(dayNumber(payload.first_day), days,
+                    startDate ? dayNumber(startDate) : null, endDate ? dayNumber(endDate) : null);
+                var totals = {};
+                Object.keys(payload.measures).forEach(function (name) {
+                    totals[name] = sum(dailySums(payload.measures[name], range[0], range[1], genders, ages));
+                });
+
+                // Итоги за предыдущий период той же длины, если он не начинается раньше данных
+                var length = range[1] - range[0];
+                var previous = null;
+                if (length > 0 && range[0] - length >= 0) {
+                    previous = {};
+                    Object.keys(payload.measures).forEach(function (name) {
+                        previous[name] = sum(dailySums(payload.measures[name], range[0] - length, range[0], genders, ages));
+                    });
+                }
+
+                var revenueIndicator = clone(payload.figures['total-revenue']);
+                revenueIndicator.data[0].value = totals.revenue;
+                if (previous && previous.revenue !== 0) {
+                    setDelta(revenueIndicator.data[0], payload.deltas.revenue, previous.revenue);
+                }
+                var churnIndicator = clone(payload.figures['churn-rate']);
+                churnIndicator.data[0].value = totals.count > 0 ? totals.churn / totals.count * 100 : 0;
+                if (previous && previous.count > 0) {
+                    setDelta(churnIndicator.data[0], payload.deltas.churn, previous.churn / previous.count * 100);
+                }
+
+                var returns = [[payload.returns_labels[0], totals.not_returned], [payload.returns_labels[1], totals.returned]]
+                    .filter(function (item) { return item[1] > 0; })
+                    .sort(function (a, b) { return b[1] - a[1]; });
+                var returnsPie = clone(payload.figures['returns-pie-chart']);
+                returnsPie.data[0].labels = returns.map(function (item) { return item[0]; });
+                returnsPie.data[0].values = returns.map(function (item) { return item[1]; });
+
+                return [revenueIndicator, churnIndicator,
+                    revenueFigure(payload, startDate, endDate, genders, ages, [null, null], uirevision),
+                    returnsPie];
+            },
+
+            purchaseFigures: function (startDate, endDate, categories, payloads) {
+                var noUpdate = window.dash_clientside.no_update;
+                if (!payloads || !payloads.purchase) {
+                    return [noUpdate, noUpdate, noUpdate, noUpdate];
+                }
+                var payload = payloads.purchase;
+                var countMeasure = payload.measures.count, sumMeasure = payload.measures.sum;
+                var range = dayRange(dayNumber(payload.first_day), countMeasure.shape[0],
+                    startDate ? dayNumber(startDate) : null, endDate ? dayNumber(endDate) : null);
+                var selected = pick(payload.categories, categories && categories.length ? categories : null);
+                var counts = decode(countMeasure), sums = decode(sumMeasure);
+                var nCategories = countMeasure.shape[1], nPayments = countMeasure.shape[2];
+
+                var byCategory = {}, byPayment = new Float64Array(nPayments);
+                selected.forEach(function (c) {
+                    var size = 0, total = 0;
+                    for (var d = range[0]; d < range[1]; d++) {
+                        var base = (d * nCategories + c) * nPayments;
+                        for (var p = 0; p < nPayments; p++) {
+                            size += counts[base + p];
+                            total += sums[base + p];
+                            byPayment[p] += counts[base + p];
+                        }
+                    }
+                    if (size > 0) {
+                        byCategory[c] = {size: size, sum: total, mean: total / size};
+                    }
+                });
+                var present = selected.filter(function (c) { return byCategory[c] !== undefined; });
+                var labels = present.map(function (c) { return payload.category_labels[c]; });
+
+                var totalCount = sum(byPayment);
+                var shares = [];
+                for (var p = 0; p < nPayments; p++) {
+                    if (byPayment[p] > 0) {
+                        shares.push([payload.payment_labels[p], byPayment[p] / totalCount]);
+                    }
+                }
+                shares.sort(function (a, b) { return b[1] - a[1]; });
+                var pie = clone(payload.figures['payment-method-pie-chart']);
+                pie.data[0].labels = shares.map(function (item) { return item[0]; });
+                pie.data[0].values = shares.map(function (item) { return item[1]; });
+
+                function bars(name, measure) {
+                    var figure = clone(payload.figures[name]);
+                    figure.data = colorTraces(payload.figures[name], labels, function (trace, position) {
+                        trace.x = [labels[position]];
+                        trace.y = [byCategory[present[position]][measure]];
+                    });
+                    if (figure.layout.xaxis && figure.layout.xaxis.categoryarray) {
+                        figure.layout.xaxis.categoryarray = labels;
+                    }
+                    return figure;
+                }
+
+                // Размер маркеров как в px.scatter: sizeref = max(size) / size_max ** 2, size_max = 20
+                var largest = Math.max.apply(null, present.map(function (c) { return byCategory[c].size; }).concat([0]));
+                var scatter = clone(payload.figures['scatter-plot']);
+                scatter.data = colorTraces(payload.figures['scatter-plot'], labels, function (trace, position) {
+                    var stats = byCategory[present[position]];
+                    trace.x = [stats.size];
+                    trace.y = [stats.mean];
+                    trace.marker.size = [stats.size];
+                    trace.marker.sizeref = largest / (20 * 20);
+                });
+
+                return [pie, bars('sales-bar-chart', 'size'), bars('profit-bar-chart', 'sum'), scatter];
+            }
+        }
+    });
+})();
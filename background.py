@@ -0,0 +1,98 @@
+import logging
+import os
+
+from dash import DiskcacheManager, Input
+
+import data
+
+logger = logging.getLogger(__name__)
+
+# Фоновое выполнение тяжёлых коллбэков страниц (DASHBOARD_BACKGROUND=1): расчёт идёт в отдельном
+# процессе, результат складывается в diskcache в BACKGROUND_DIR, а браузер опрашивает сервер
+# каждые POLL_MS миллисекунд. Запрос, устаревший из-за новых значений фильтров или перехода
+# на другую страницу, отменяется, и его процесс завершается
+ENABLED = os.environ.get('DASHBOARD_BACKGROUND', '0') == '1'
+BACKGROUND_DIR = os.environ.get('DASHBOARD_BACKGROUND_DIR', 'background_cache')
+# Результаты хранятся по версии датасета; не запрошенные столько секунд удаляются
+EXPIRE_SECONDS = int(os.environ.get('DASHBOARD_BACKGROUND_EXPIRE', 3600))
+POLL_MS = int(os.environ.get('DASHBOARD_BACKGROUND_POLL_MS', 250))
+
+# Поле возраста отправляет значение, когда ввод затих на столько секунд, а не на каждое нажатие
+INPUT_DEBOUNCE = float(os.environ.get('DASHBOARD_INPUT_DEBOUNCE', 0.5))
+
+
+def _running_key(key):
+    return f'{key}-running'
+
+
+def _job_key(job):
+    return f'job-{int(job)}'
+
+
+# DiskcacheManager, который не запускает повторный расчёт одного и того же запроса: готовый
+# результат отдаётся из кэша без нового процесса, а к ещё идущему расчёту с тем же ключом
+# подключаются все, кто его запросил (в том числе из других воркеров gunicorn — кэш общий).
+# Процесс завершается, только когда его отменили все ожидающие
+class CoalescingManager(DiskcacheManager):
+    def call_job_fn(self, key, job_fn, args, context):
+        # Дочерний процесс не должен ждать загрузки датасета: потока загрузчика в нём нет
+        data.current()
+        with diskcache.Lock(self.handle, f'{key}-lock', expire=30):
+            if self.handle.get(key) is not None:
+                return None
+            running = self.handle.get(_running_key(key))
+            if running is not None and self.job_running(running['pid']):
+                running['waiters'] += 1
+                self.handle.set(_running_key(key), running, expire=self.expire)
+                return running['pid']
+            pid = super().call_job_fn(key, job_fn, args, context)
+            self.handle.set(_running_key(key), {'pid': pid, 'waiters': 1}, expire=self.expire)
+            self.handle.set(_job_key(pid), key, expire=self.expire)
+            return pid
+
+    def terminate_job(self, job):
+        if job is None:
+            return
+        key = self.handle.get(_job_key(job))
+        # Пока результата нет, отмена только снимает одного ожидающего
+        if key is not None and self.handle.get(key) is None:
+            with diskcache.Lock(self.handle, f'{key}-lock', expire=30):
+                running = self.handle.get(_running_key(key))
+                if running is not None and running['pid'] == int(job):
+                    running['waiters'] -= 1
+                    if running['waiters'] > 0:
+                        self.handle.set(_running_key(key), running, expire=self.expire)
+                        return
+                    self.handle.delete(_running_key(key))
+        super().terminate_job(job)
+
+    # Для результата из кэша процесс не запускался
+    def job_running(self, job):
+        if job is None:
+            return False
+        return super().job_running(job)
+
+
+manager = None
+if ENABLED:
+    try:
+        import diskcache
+        manager = CoalescingManager(
+            diskcache.Cache(BACKGROUND_DIR),
+            cache_by=[lambda: data.current().version],
+            expire=EXPIRE_SECONDS,
+        )
+    except ImportError:
+        logger.warning('diskcache, multiprocess or psutil is not installed, callbacks run synchronously')
+
+
+# Параметры регистрации для тяжёлых коллбэков страниц; без менеджера коллбэк выполняется как обычно
+def options():
+    if manager is None:
+        return {}
+    return {
+        'background': True,
+        'manager': manager,
+        'interval': POLL_MS,
+        'cancel': [Input('url', 'pathname')],
+    }
@@ -0,0 +1,294 @@
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from synthetic import generate_csv
+
+# Нагрузочный стенд для коллбэков страниц: для каждого размера датасета генерируется
+# синтетический CSV, затем в отдельном процессе (чтобы загрузка и пиковая память не
+# смешивались между размерами) коллбэки вызываются на одинаковом наборе фильтров.
+# Результаты сохраняются в JSON и сравниваются с предыдущим прогоном через --compare
+
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+WINDOWS = (7, 30, 90, 365, None)
+
+
+# Набор фильтров, похожий на реальные запросы: чаще последние недели и месяцы, иногда весь период,
+# пол и возраст выбраны не всегда, категории — подмножество из одной-трёх
+def filter_mix(snapshot, count, seed):
+    rng = random.Random(seed)
+    first, last = snapshot.date_bounds
+    first, last = np.datetime64(first, 'D'), np.datetime64(last, 'D')
+    genders = sorted(snapshot.df['Gender'].dropna().unique())
+    categories = sorted(snapshot.df['Product Category'].dropna().unique())
+    scenarios = []
+    for _ in range(count):
+        window = rng.choice(WINDOWS)
+        start = first if window is None else max(first, last - np.timedelta64(rng.randrange(0, 365) + window, 'D'))
+        end = last if window is None else min(last, start + np.timedelta64(window, 'D'))
+        scenarios.append({
+            'start_date': str(start),
+            'end_date': str(end),
+            'gender': rng.choice([None, None] + genders),
+            'age': rng.randint(18, 70) if rng.random() < 0.3 else None,
+            'categories': rng.sample(categories, rng.randint(1, min(3, len(categories)))) if rng.random() < 0.5 else None,
+        })
+    return scenarios
+
+
+def _callbacks():
+    from pages import home, clients, purchase
+
+    # update_indicators_and_graph читает ctx запроса, поэтому вызывается его вычислительная часть
+    return {
+        'home.update_indicators_and_graph': lambda f: home.home_figures(f['start_date'], f['end_date'], f['gender'], f['age']),
+        'home.revenue_by_date_zoom': lambda f: home.revenue_by_date_figure(f['start_date'], f['end_date'], f['gender'], f['age'], f['start_date'], f['end_date']),
+        'clients.update_graphs': lambda f: clients.update_graphs(f['start_date'], f['end_date'], f['gender'], f['age']),
+        'purchase.update_pie_chart': lambda f: purchase.update_pie_chart(f['start_date'], f['end_date'], f['categories']),
+        'purchase.update_graphs_and_table': lambda f: purchase.update_graphs_and_table(f['start_date'], f['end_date'], f['categories']),
+    }
+
+
+# Группировки страниц для сравнения движков grouping.group: bincount и эталонного pandas
+def _groupings(frame):
+    import pandas as pd
+
+    days = pd.Series(frame['Purchase Date'].to_numpy().astype('datetime64[D]'), index=frame.index, name='Day')
+    return {
+        'age_gender.size': (['Age', 'Gender'], {}),
+        'age_gender.churn': (['Age', 'Gender'], {'churned': frame['Churn'].to_numpy() == 1}),
+        'category_payment.sum': (['Product Category', 'Payment Method'], {'sum': 'Total Purchase Amount'}),
+        'category.measures': (['Product Category'], {'sum': 'Total Purchase Amount', 'churn': 'Churn', 'returns': 'Returns'}),
+        'day_category_payment.sum': ([days, 'Product Category', 'Payment Method'], {'sum': 'Total Purchase Amount'}),
+    }
+
+
+def run_groupings(frame, repeat):
+    import grouping
+
+    results = {}
+    for name, (by, measures) in _groupings(frame).items():
+        results[name] = {}
+        for engine in ('pandas', 'bincount'):
+            latencies = []
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                grouping.group(frame, by, measures, engine=engine)
+                latencies.append((time.perf_counter() - t0) * 1000)
+            results[name][engine] = _summary(latencies)
+    return results
+
+
+# Фигуры страниц на данных для входов по умолчанию: каждая строится тем же вызовом, что
+# и в коллбэке, и сериализуется в JSON, как ответ Dash
+def _figures(snapshot):
+    import cube
+    import data
+    import figures
+    import grouping
+    import timeseries
+    from pages import clients, home, purchase
+
+    summary = purchase.purchase_summary(*purchase.default_inputs())
+    by_category = data.localize(summary['by_category'])
+    sales = by_category['size'].rename('Count').reset_index()
+    profit = by_category['sum'].rename('Total Purchase Amount').reset_index()
+    scatter = by_category[['mean', 'size']].reset_index()
+    scatter.columns = ['Product Category', 'Total Purchase Amount', 'Purchase Count']
+    payment = data.localize(summary['payment_share']).reset_index()
+    payment.columns = ['Payment Method', 'Percentage']
+    churned = snapshot.df[snapshot.df['Churn'].to_numpy() == 1]
+    churn = data.localize(grouping.group_sizes(churned, ['Age', 'Gender'])).reset_index(name='Count')
+
+    days, revenue = cube.get_cube(snapshot).daily('revenue', None, None)
+    days, revenue = timeseries.lttb(days, revenue)
+    points = [(days.date, revenue)] * (1 + 2 * len(home.ROLLING_WINDOWS))
+    totals = cube.get_cube(snapshot).totals(None, None)
+
+    return {
+        'purchase.payment_pie_chart': lambda: figures.pie(
+            'purchase.payment_pie_chart', purchase.build_payment_pie_chart, payment, 'Payment Method', 'Percentage'),
+        'purchase.sales_bar_chart': lambda: figures.grouped(
+            'purchase.sales_bar_chart', purchase.build_sales_bar_chart, sales, 'Product Category', 'Product Category', 'Count'),
+        'purchase.profit_bar_chart': lambda: figures.grouped(
+            'purchase.profit_bar_chart', purchase.build_profit_bar_chart, profit,
+            'Product Category', 'Product Category', 'Total Purchase Amount'),
+        'purchase.scatter_plot': lambda: figures.grouped(
+            'purchase.scatter_plot', purchase.build_scatter_plot, scatter,
+            'Product Category', 'Purchase Count', 'Total Purchase Amount', size='Purchase Count'),
+        'clients.churn_bar_chart': lambda: figures.grouped(
+            'clients.churn_bar_chart', clients.build_churn_bar_chart, churn, 'Gender', 'Age', 'Count'),
+        'home.revenue_indicator': lambda: home.delta_indicator(
+            totals['revenue'], 'Выручка', totals['revenue'] / 2, home.REVENUE_DELTA),
+        'home.revenue_by_date': lambda: figures.series(
+            'home.revenue_by_date', home.build_revenue_chart, points, title={'text': home.REVENUE_TITLE}, uirevision=''),
+    }
+
+
+# Построение фигур через plotly и из шаблонов figures.py (вместе с сериализацией в JSON)
+def run_figures(snapshot, repeat):
+    import figures
+    from plotly.io.json import to_json_plotly
+
+    results = {}
+    for name, build in _figures(snapshot).items():
+        results[name] = {}
+        for engine, enabled in (('plotly', False), ('templates', True)):
+            figures.ENABLED = enabled
+            to_json_plotly(build())
+            latencies = []
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                to_json_plotly(build())
+                latencies.append((time.perf_counter() - t0) * 1000)
+            results[name][engine] = _summary(latencies)
+    figures.ENABLED = True
+    return results
+
+
+def _summary(values):
+    return {
+        'p50': float(np.percentile(values, 50)),
+        'p95': float(np.percentile(values, 95)),
+        'mean': float(np.mean(values)),
+    }
+
+
+# Выполняется в дочернем процессе с DASHBOARD_CSV, указывающим на сгенерированный файл
+def run_worker(queries, repeat, seed):
+    from plotly.io.json import to_json_plotly
+
+    started = time.perf_counter()
+    import app  # noqa: F401
+    import data
+    load_seconds = time.perf_counter() - started
+
+    snapshot = data.current()
+    scenarios = filter_mix(snapshot, queries, seed)
+    results = {}
+    for name, call in _callbacks().items():
+        # Первый вызов отдельно: в него входит построение агрегатов снимка
+        t0 = time.perf_counter()
+        call({'start_date': None, 'end_date': None, 'gender': None, 'age': None, 'categories': None})
+        first_call = time.perf_counter() - t0
+
+        latencies, payloads = [], []
+        for _ in range(repeat):
+            for scenario in scenarios:
+                t0 = time.perf_counter()
+                output = call(scenario)
+                latencies.append((time.perf_counter() - t0) * 1000)
+                payloads.append(len(to_json_plotly(output)))
+        results[name] = {
+            'calls': len(latencies),
+            'first_call_ms': first_call * 1000,
+            'latency_ms': _summary(latencies),
+            'payload_bytes': _summary(payloads),
+        }
+    return {
+        'rows': len(snapshot.df),
+        'load_seconds': load_seconds,
+        # ru_maxrss в Linux — килобайты, в macOS — байты
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024),
+        'callbacks': results,
+        'groupby': run_groupings(snapshot.df, max(repeat, 3)),
+        'figures': run_figures(snapshot, max(repeat, 3) * 10),
+    }
+
+
+def run_size(rows, args):
+    csv_path = os.path.join(os.path.abspath(args.workdir), f'synthetic-{rows}-{args.seed}.csv')
+    if not os.path.exists(csv_path):
+        print(f'Генерация {rows} строк → {csv_path}', file=sys.stderr)
+        generate_csv(csv_path, rows, seed=args.seed)
+    env = dict(os.environ,
+               DASHBOARD_CSV=csv_path,
+               DASHBOARD_WARMUP='0',
+               DASHBOARD_CACHE_BYTES=str(args.cache_bytes))
+    command = [sys.executable, os.path.abspath(__file__), '--worker',
+               '--queries', str(args.queries), '--repeat', str(args.repeat), '--seed', str(args.seed)]
+    completed = subprocess.run(command, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.PIPE, check=True)
+    return json.loads(completed.stdout)
+
+
+def compare(previous, current_run):
+    baseline = {entry['rows']: entry for entry in previous['results']}
+    for entry in current_run['results']:
+        before = baseline.get(entry['rows'])
+        if before is None:
+            continue
+        for name, stats in entry['callbacks'].items():
+            old = before['callbacks'].get(name)
+            if old is None:
+                continue
+            ratio = stats['latency_ms']['p95'] / max(old['latency_ms']['p95'], 1e-9)
+            print(f"{entry['rows']:>12} {name:<36} p95 {old['latency_ms']['p95']:9.2f} → "
+                  f"{stats['latency_ms']['p95']:9.2f} мс ({ratio:.2f}x)")
+
+
+def print_table(run):
+    for entry in run['results']:
+        print(f"{entry['rows']} строк: загрузка {entry['load_seconds']:.2f} с, пиковая память {entry['peak_rss_mb']:.0f} МБ")
+        for name, stats in entry['callbacks'].items():
+            print(f"  {name:<36} p50 {stats['latency_ms']['p50']:9.2f} мс  p95 {stats['latency_ms']['p95']:9.2f} мс  "
+                  f"ответ {stats['payload_bytes']['p50'] / 1024:8.1f} КБ")
+        for name, engines in entry.get('groupby', {}).items():
+            pandas_ms, bincount_ms = engines['pandas']['p50'], engines['bincount']['p50']
+            print(f"  groupby {name:<28} pandas {pandas_ms:9.2f} мс  bincount {bincount_ms:9.2f} мс  "
+                  f"({pandas_ms / max(bincount_ms, 1e-9):.1f}x)")
+        for name, engines in entry.get('figures', {}).items():
+            plotly_ms, templates_ms = engines['plotly']['p50'], engines['templates']['p50']
+            print(f"  figure {name:<29} plotly {plotly_ms:9.2f} мс  шаблон {templates_ms:9.2f} мс  "
+                  f"({plotly_ms / max(templates_ms, 1e-9):.1f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Замер задержек коллбэков на синтетических данных')
+    parser.add_argument('--rows', type=int, nargs='+', default=list(DEFAULT_SIZES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--queries', type=int, default=20, help='число различных наборов фильтров')
+    parser.add_argument('--repeat', type=int, default=3, help='сколько раз прогнать каждый набор')
+    parser.add_argument('--cache-bytes', type=int, default=0,
+                        help='размер кэша результатов; 0 — каждый вызов считается заново')
+    parser.add_argument('--workdir', default='bench_data')
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', help='JSON предыдущего прогона для сравнения')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        # stdout занят результатом, вывод приложения уходит в stderr
+        output, sys.stdout = sys.stdout, sys.stderr
+        json.dump(run_worker(args.queries, args.repeat, args.seed), output)
+        return
+
+    os.makedirs(args.workdir, exist_ok=True)
+    run = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'queries': args.queries,
+        'repeat': args.repeat,
+        'cache_bytes': args.cache_bytes,
+        'results': [run_size(rows, args) for rows in args.rows],
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(run, f, ensure_ascii=False, indent=2)
+    print_table(run)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(json.load(f), run)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+import data
+from filters import day_bounds
+
+MAX_BYTES = int(os.environ.get('DASHBOARD_CACHE_BYTES', 256 * 1024 * 1024))
+
+
+class _Pending:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.failed = False
+
+
+# LRU-кэш результатов коллбэков с ограничением по суммарному размеру в байтах.
+# Размер записи оценивается по длине её pickle-представления
+class ResultCache:
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, value):
+        size = len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    # Одинаковые запросы, пришедшие одновременно, вычисляются один раз:
+    # первый поток считает значение, остальные ждут его результата
+    def get_or_compute(self, key, compute):
+        entry = self.get(key)
+        if entry is not None:
+            return entry[0]
+        with self._lock:
+            pending = self._inflight.get(key)
+            owner = pending is None
+            if owner:
+                pending = self._inflight[key] = _Pending()
+        if not owner:
+            pending.done.wait()
+            if pending.failed:
+                return compute()
+            return pending.value
+        try:
+            pending.value = compute()
+            self.put(key, pending.value)
+        except BaseException:
+            pending.failed = True
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            pending.done.set()
+        return pending.value
+
+    def discard(self, predicate):
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                _, size = self._entries.pop(key)
+                self.bytes -= size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+results = ResultCache()
+
+
+# Процесс, созданный fork (фоновые коллбэки, воркеры gunicorn), наследует блокировку и незавершённые
+# расчёты родителя, но не потоки, которые их ведут: в дочернем процессе они начинаются заново
+def _reset_after_fork():
+    results._lock = threading.Lock()
+    results._inflight = {}
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+# Нормализованный ключ фильтров: даты приводятся к дням, пустые значения — к None,
+# категории — к отсортированному кортежу, поэтому эквивалентные запросы совпадают. Возраст
+# остаётся тем значением, с которым сравнивают фильтры: дробный возраст не совпадает с целым
+def filter_key(start_date, end_date, gender=None, age=None, categories=None):
+    start, end = day_bounds(start_date, end_date)
+    return (
+        start.isoformat() if start is not None else None,
+        end.isoformat() if end is not None else None,
+        gender or None,
+        age if age else None,
+        tuple(sorted(set(categories))) if categories else None,
+    )
+
+
+# Декоратор для коллбэков и общих этапов вычислений: key(*args) строит ключ из входов, к нему добавляются
+# имя функции и версия датасета
+def memoize(key):
+    def decorator(func):
+        name = f'{func.__module__}.{func.__qualname__}'
+
+        @wraps(func)
+        def wrapper(*args):
+            with data.pinned() as snapshot:
+                cache_key = (name, snapshot.version, key(*args))
+                return results.get_or_compute(cache_key, lambda: func(*args))
+
+        return wrapper
+
+    return decorator
+
+
+# После публикации нового снимка записи старых версий больше не нужны
+def drop_stale(version):
+    results.discard(lambda key: key[1] != version)
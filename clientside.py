@@ -0,0 +1,83 @@
+import base64
+import json
+import os
+
+import numpy as np
+import plotly.io as pio
+from dash import Input, Output, State, callback, dcc, no_update
+
+import data
+
+# Режим клиентских вычислений (DASHBOARD_CLIENTSIDE=1): страницы получают компактные агрегаты
+# один раз на версию датасета, и фильтры пересчитываются в браузере (assets/clientside.js).
+# На сервере остаются только показатели, которые нельзя сложить из агрегатов: число уникальных
+# клиентов и построчные таблицы страницы клиентов
+ENABLED = os.environ.get('DASHBOARD_CLIENTSIDE', '0') == '1'
+
+STORE = 'clientside-payloads'
+VERSION_STORE = 'clientside-version'
+
+_builders = {}
+
+
+# Массив кодируется в base64 в самом узком типе, который вмещает значения без потерь;
+# в браузере он читается соответствующим TypedArray
+def encode(values):
+    values = np.ascontiguousarray(values)
+    if values.size and np.array_equal(values, np.round(values)) and values.min() >= 0:
+        top = values.max()
+        dtype = next(t for t in (np.uint8, np.uint16, np.uint32, np.float64)
+                     if t is np.float64 or top <= np.iinfo(t).max)
+    else:
+        dtype = np.float64
+    if values.size == 0:
+        dtype = np.uint8
+    encoded = values.astype(np.dtype(dtype).newbyteorder('<'))
+    return {
+        'dtype': np.dtype(dtype).name,
+        'shape': list(values.shape),
+        'data': base64.b64encode(encoded.tobytes()).decode('ascii'),
+    }
+
+
+# Готовые серверные фигуры служат шаблонами: браузер заменяет в них только данные,
+# поэтому оформление совпадает с тем, что строит plotly express
+def figure_json(figure):
+    if isinstance(figure, dict):
+        return figure
+    return json.loads(pio.to_json(figure, validate=False))
+
+
+# Страница регистрирует функцию, которая по снимку строит её агрегаты и шаблоны фигур
+def register(name, build):
+    _builders[name] = build
+
+
+def payloads(snapshot):
+    return {
+        name: snapshot.aggregate(f'clientside.{name}', lambda frame, build=build: build(snapshot))
+        for name, build in _builders.items()
+    }
+
+
+def stores():
+    if not ENABLED:
+        return []
+    return [dcc.Store(id=STORE), dcc.Store(id=VERSION_STORE)]
+
+
+# Агрегаты отправляются при первом открытии любой страницы и повторно — только после
+# обновления датасета; при переходах между страницами сервер возвращает no_update
+def load_payloads(pathname, loaded_version):
+    with data.pinned() as snapshot:
+        if loaded_version == snapshot.version:
+            return no_update, no_update
+        return payloads(snapshot), snapshot.version
+
+
+if ENABLED:
+    callback(
+        [Output(STORE, 'data'), Output(VERSION_STORE, 'data')],
+        Input('url', 'pathname'),
+        State(VERSION_STORE, 'data'),
+    )(load_payloads)
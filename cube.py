@@ -0,0 +1,189 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import data
+from data import DATE_COLUMN
+from filters import day_bounds
+
+# Куб можно отключить (DASHBOARD_CUBE=0): тогда страницы считают показатели по строкам
+ENABLED = os.environ.get('DASHBOARD_CUBE', '1') != '0'
+
+MEASURES = ('count', 'revenue', 'churn', 'returned', 'not_returned')
+
+
+# Предагрегированный куб день × пол × возраст × категория.
+# Для каждой меры хранятся префиксные суммы по оси дней: prefix[k] — сумма за дни < k,
+# поэтому итог за любой диапазон дат — разность двух срезов, а ряд по дням — np.diff
+class DailyCube:
+    def __init__(self, first_day, genders, ages, categories, prefix):
+        self.first_day = first_day
+        self.genders = genders
+        self.ages = ages
+        self.categories = categories
+        self.prefix = prefix
+        self.days = next(iter(prefix.values())).shape[0] - 1
+
+    def _day_range(self, start_date, end_date):
+        start, end = day_bounds(start_date, end_date)
+        d0 = 0 if start is None else (start - self.first_day).days
+        d1 = self.days if end is None else (end - self.first_day).days
+        d0 = min(max(d0, 0), self.days)
+        d1 = min(max(d1, d0), self.days)
+        return d0, d1
+
+    def _selection(self, gender, age, categories):
+        # Возвращает индексы по осям пол/возраст/категория; None — ось не фильтруется
+        def pick(labels, values):
+            return [i for i, label in enumerate(labels) if label in values]
+
+        return (
+            pick(self.genders, (gender,)) if gender else None,
+            pick(self.ages, (age,)) if age else None,
+            pick(self.categories, categories) if categories else None,
+        )
+
+    @staticmethod
+    def _reduce(block, selection):
+        # block имеет оси (..., пол, возраст, категория); они сворачиваются с учётом фильтра
+        for index in reversed(selection):
+            if index is not None:
+                block = np.take(block, index, axis=-1)
+            block = block.sum(axis=-1)
+        return block
+
+    def totals(self, start_date, end_date, gender=None, age=None, categories=None):
+        d0, d1 = self._day_range(start_date, end_date)
+        selection = self._selection(gender, age, categories)
+        return {
+            name: self._reduce(prefix[d1] - prefix[d0], selection).item()
+            for name, prefix in self.prefix.items()
+        }
+
+    # Префиксные суммы мер с фильтром для дней диапазона и до lookback дней перед ним (в пределах
+    # данных): дни диапазона и для каждой меры массив на один элемент длиннее числа взятых дней.
+    # Суммы за любые окна внутри него — разности двух элементов (см. timeseries.rolling_sums)
+    def cumulative(self, measures, start_date, end_date, gender=None, age=None, categories=None, lookback=0):
+        d0, d1 = self._day_range(start_date, end_date)
+        lo = max(d0 - lookback, 0)
+        selection = self._selection(gender, age, categories)
+        days = self.first_day + pd.to_timedelta(np.arange(d0, d1), unit='D')
+        return days, {name: self._reduce(self.prefix[name][lo:d1 + 1], selection) for name in measures}
+
+    # Итог меры за диапазон дат по ячейкам возраст × пол с фильтром по полу и возрасту. Как и
+    # группировка по строкам, ячейки с пропущенным полом или возрастом в результат не входят
+    def by_age_gender(self, measure, start_date, end_date, gender=None, age=None):
+        d0, d1 = self._day_range(start_date, end_date)
+        gender_index, age_index, _ = self._selection(gender, age, None)
+        genders = [i for i in (range(len(self.genders)) if gender_index is None else gender_index) if pd.notna(self.genders[i])]
+        ages = [i for i in (range(len(self.ages)) if age_index is None else age_index) if pd.notna(self.ages[i])]
+        block = (self.prefix[measure][d1] - self.prefix[measure][d0]).sum(axis=-1)[np.ix_(genders, ages)]
+        index = pd.MultiIndex.from_product(
+            [pd.Index(self.ages).take(ages), pd.Index(self.genders).take(genders)], names=['Age', 'Gender'])
+        return pd.Series(block.T.ravel(), index=index, name=measure)
+
+    def daily(self, measure, start_date, end_date, gender=None, age=None, categories=None):
+        d0, d1 = self._day_range(start_date, end_date)
+        selection = self._selection(gender, age, categories)
+        cumulative = self._reduce(self.prefix[measure][d0:d1 + 1], selection)
+        counts = self._reduce(self.prefix['count'][d0:d1 + 1], selection)
+        days = self.first_day + pd.to_timedelta(np.arange(d0, d1), unit='D')
+        # Как и groupby по строкам, в ряд попадают только дни с покупками
+        present = np.diff(counts) > 0
+        return days[present], np.diff(cumulative)[present]
+
+
+def build_cube(frame):
+    dates = frame[DATE_COLUMN].to_numpy()
+    # Строки без даты не попадают ни в один диапазон дат, поэтому в куб не входят
+    dated = ~np.isnat(dates)
+    if not dated.all():
+        frame, dates = frame[dated], dates[dated]
+    if len(dates) == 0:
+        first_day = pd.Timestamp(0)
+        day_index = np.zeros(0, dtype=np.int64)
+        days = 0
+    else:
+        first_day = pd.Timestamp(dates[0]).normalize()
+        day_index = (dates - first_day.to_datetime64()) // np.timedelta64(1, 'D')
+        days = int(day_index[-1]) + 1
+
+    gender_codes, genders = pd.factorize(frame['Gender'], sort=True, use_na_sentinel=False)
+    age_codes, ages = pd.factorize(frame['Age'], sort=True, use_na_sentinel=False)
+    category_codes, categories = pd.factorize(frame['Product Category'], sort=True, use_na_sentinel=False)
+    shape = (days, len(genders), len(ages), len(categories))
+    cells = np.ravel_multi_index((day_index, gender_codes, age_codes, category_codes), shape)
+    size = int(np.prod(shape))
+
+    returns = frame['Returns'].to_numpy()
+    weights = {
+        'count': None,
+        'revenue': frame['Total Purchase Amount'].to_numpy(dtype=np.float64),
+        'churn': frame['Churn'].to_numpy(dtype=np.float64),
+        'returned': (returns == 1).astype(np.float64),
+        'not_returned': (returns == 0).astype(np.float64),
+    }
+    prefix = {}
+    for name in MEASURES:
+        daily = np.bincount(cells, weights=weights[name], minlength=size).reshape(shape)
+        if name != 'revenue':
+            daily = daily.astype(np.int64)
+        cumulative = np.zeros((days + 1,) + shape[1:], dtype=daily.dtype)
+        np.cumsum(daily, axis=0, out=cumulative[1:])
+        prefix[name] = cumulative
+    return DailyCube(first_day, list(genders), list(ages), list(categories), prefix)
+
+
+# Те же меры, посчитанные напрямую по строкам: запасной путь и эталон для проверки куба
+def totals_from_rows(rows):
+    returns = rows['Returns']
+    return {
+        'count': len(rows),
+        'revenue': rows['Total Purchase Amount'].sum(),
+        'churn': rows['Churn'].sum(),
+        'returned': int((returns == 1).sum()),
+        'not_returned': int((returns == 0).sum()),
+    }
+
+
+# Слияние двух кубов: оси объединяются, дневные значения складываются,
+# префиксные суммы пересчитываются. Стоимость зависит от размера куба, а не от числа строк
+def merge_cubes(left, right):
+    if right.days == 0:
+        return left
+    if left.days == 0:
+        return right
+    first_day = min(left.first_day, right.first_day)
+    days = max((c.first_day - first_day).days + c.days for c in (left, right))
+    genders = pd.Index(left.genders).append(pd.Index(right.genders)).unique()
+    ages = pd.Index(left.ages).append(pd.Index(right.ages)).unique()
+    categories = pd.Index(left.categories).append(pd.Index(right.categories)).unique()
+    shape = (days, len(genders), len(ages), len(categories))
+
+    prefix = {}
+    for name in MEASURES:
+        dtype = left.prefix[name].dtype
+        daily = np.zeros(shape, dtype=dtype)
+        for part in (left, right):
+            offset = (part.first_day - first_day).days
+            index = np.ix_(
+                np.arange(offset, offset + part.days),
+                genders.get_indexer(part.genders),
+                ages.get_indexer(part.ages),
+                categories.get_indexer(part.categories),
+            )
+            daily[index] += np.diff(part.prefix[name], axis=0)
+        cumulative = np.zeros((days + 1,) + shape[1:], dtype=dtype)
+        np.cumsum(daily, axis=0, out=cumulative[1:])
+        prefix[name] = cumulative
+    return DailyCube(first_day, list(genders), list(ages), list(categories), prefix)
+
+
+# В режиме out-of-core куб собирается по порциям строк и сливается через merge_cubes
+def get_cube(snapshot):
+    return snapshot.aggregate('cube', lambda frame: data.reduce_chunks(frame, build_cube, merge_cubes))
+
+
+# Дописанные в CSV строки добавляются в куб без полного пересчёта
+data.register_incremental('cube', lambda value, rows, snapshot: merge_cubes(value, build_cube(rows)))
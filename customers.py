@@ -0,0 +1,171 @@
+import numpy as np
+import pandas as pd
+
+import data
+
+
+# Измерение клиентов: Customer ID → плотный код → имя. Строится один раз на снимок
+# и заменяет groupby по паре (ID, имя) и drop_duplicates по всему датасету
+class CustomerDimension:
+    def __init__(self, ids, names):
+        self.ids = ids
+        self.names = names
+
+    def __len__(self):
+        return len(self.ids)
+
+    def codes(self, customer_ids):
+        return self.ids.get_indexer(customer_ids)
+
+    # Новые клиенты получают коды в конце, коды существующих не меняются
+    def extend(self, rows):
+        ids, first = np.unique(rows['Customer ID'].to_numpy(), return_index=True)
+        new = self.ids.get_indexer(ids) < 0
+        if not new.any():
+            return self
+        names = rows['Customer Name'].to_numpy()[first[new]]
+        return CustomerDimension(self.ids.append(pd.Index(ids[new])), np.concatenate([self.names, names]))
+
+
+def build_dimension(frame):
+    ids, first = np.unique(frame['Customer ID'].to_numpy(), return_index=True)
+    return CustomerDimension(pd.Index(ids), frame['Customer Name'].to_numpy()[first])
+
+
+# Объединение измерений соседних порций строк: ID остаются отсортированными,
+# имя берётся из более ранней порции, как при построении по всем строкам сразу
+def merge_dimensions(left, right):
+    ids, first = np.unique(np.concatenate([left.ids.to_numpy(), right.ids.to_numpy()]), return_index=True)
+    return CustomerDimension(pd.Index(ids), np.concatenate([left.names, right.names])[first])
+
+
+def get_dimension(snapshot):
+    return snapshot.aggregate('customers', lambda frame: data.reduce_chunks(frame, build_dimension, merge_dimensions))
+
+
+# Коды клиентов, выровненные по строкам снимка
+def row_codes(snapshot):
+    dimension = get_dimension(snapshot)
+    return snapshot.aggregate('customer_codes', lambda frame: dimension.codes(frame['Customer ID']))
+
+
+# Коды клиентов для строк снимка. Индекс отфильтрованного фрейма — позиции строк в снимке,
+# поэтому коды берутся из row_codes без повторного поиска. В режиме out-of-core массив кодов
+# на все строки не строится, и коды ищутся по ID только для переданных строк
+def customer_codes(snapshot, rows):
+    if data.OUT_OF_CORE:
+        return get_dimension(snapshot).codes(rows['Customer ID'])
+    return row_codes(snapshot)[rows.index.to_numpy()]
+
+
+data.register_incremental('customers', lambda value, rows, snapshot: value.extend(rows))
+
+
+# Суммы колонок по клиентам, накопленные по порциям отфильтрованных строк. Для одной порции
+# группировка идёт только по клиентам из окна, и стоимость не зависит от общего числа клиентов;
+# со второй порции суммы копятся в плотных массивах на всех клиентов, так что память
+# ограничена числом клиентов, а не строк
+class CustomerTotals:
+    def __init__(self, snapshot, columns):
+        self.snapshot = snapshot
+        self.columns = columns
+        self._customers = np.zeros(0, dtype=np.int64)
+        self._totals = {column: np.zeros(0) for column in columns}
+        self._present = None
+        self._parts = 0
+
+    def add(self, rows):
+        self._add(customer_codes(self.snapshot, rows), rows)
+
+    def _add(self, codes, rows):
+        values = {column: np.nan_to_num(rows[column].to_numpy(dtype=np.float64)) for column in self.columns}
+        self._parts += 1
+        if self._parts == 1 and self._present is None:
+            self._customers, inverse = np.unique(codes, return_inverse=True)
+            for column in self.columns:
+                self._totals[column] = np.bincount(inverse, weights=values[column], minlength=len(self._customers))
+            return
+        if self._present is None:
+            self._densify(len(get_dimension(self.snapshot)))
+        self._present[codes] = True
+        for column in self.columns:
+            self._totals[column] += np.bincount(codes, weights=values[column], minlength=len(self._present))
+
+    # Плотные массивы на size клиентов; суммы копируются, поэтому копия объекта их не разделяет
+    def _densify(self, size):
+        present = np.zeros(size, dtype=bool)
+        customers, _ = self.totals(self.columns[0])
+        present[customers] = True
+        for column in self.columns:
+            dense = np.zeros(size)
+            dense[customers] = self.totals(column)[1]
+            self._totals[column] = dense
+        self._present = present
+
+    # Суммы для снимка с дописанными строками: текущие суммы копируются, и к ним
+    # добавляются только новые строки
+    def extend(self, rows, snapshot):
+        extended = CustomerTotals(snapshot, self.columns)
+        extended._customers, extended._totals, extended._present = self._customers, dict(self._totals), self._present
+        extended._parts = self._parts
+        extended._densify(len(get_dimension(snapshot)))
+        extended._add(get_dimension(snapshot).codes(rows['Customer ID']), rows)
+        return extended
+
+    def totals(self, column):
+        if self._present is None:
+            return self._customers, self._totals[column]
+        customers = np.flatnonzero(self._present)
+        return customers, self._totals[column][customers]
+
+    # Топ клиентов по сумме колонки: Customer ID, Customer Name и значение
+    def top(self, column, k=5, offset=0):
+        dimension = get_dimension(self.snapshot)
+        customers, totals = self.totals(column)
+        selected = top_k(totals, customers, k, offset)
+        codes = customers[selected]
+        return pd.DataFrame({
+            'Customer ID': dimension.ids[codes],
+            'Customer Name': dimension.names[codes],
+            column: totals[selected],
+        })
+
+
+# Суммы по клиентам за все строки с датой — то же, что CustomerTotals по окну дат, которое
+# покрывает весь снимок (см. filters.covers_dated). Переносятся в снимок с дописанными строками
+TOTAL_COLUMNS = ['Total Purchase Amount', 'Returns']
+
+def _build_totals(snapshot, frame):
+    totals = CustomerTotals(snapshot, TOTAL_COLUMNS)
+    dates = frame[data.DATE_COLUMN].to_numpy()
+    for part in data.chunks(frame.iloc[:int(np.searchsorted(dates, np.datetime64('NaT'), side='left'))]):
+        totals.add(part)
+    return totals
+
+
+def get_totals(snapshot):
+    return snapshot.aggregate('customers.totals', lambda frame: _build_totals(snapshot, frame))
+
+
+data.register_incremental('customers.totals', lambda value, rows, snapshot: value.extend(
+    rows[rows[data.DATE_COLUMN].notna().to_numpy()], snapshot))
+
+
+# Позиции k наибольших значений начиная с offset (страница выдачи): частичный отбор
+# через partition, затем сортировка только отобранных. При равенстве выше меньший ключ
+def top_k(values, keys, k, offset=0):
+    limit = min(offset + k, len(values))
+    if limit <= 0:
+        return np.zeros(0, dtype=np.intp)
+    if limit < len(values):
+        threshold = -np.partition(-values, limit - 1)[limit - 1]
+        above = np.flatnonzero(values > threshold)
+        tied = np.flatnonzero(values == threshold)
+        needed = limit - len(above)
+        if needed < len(tied):
+            tied = tied[np.argpartition(keys[tied], needed - 1)[:needed]]
+        candidates = np.concatenate([above, tied])
+    else:
+        candidates = np.arange(len(values))
+    order = candidates[np.lexsort((keys[candidates], -values[candidates]))]
+    return order[offset:limit]
@@ -1,2 +1,873 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+
+import numpy as np
 import pandas as pd
-df = pd.read_csv('ecommerce_customer_data_custom_ratios.csv', sep=',')
+
+CSV_PATH = os.environ.get('DASHBOARD_CSV', 'ecommerce_customer_data_custom_ratios.csv')
+DATE_COLUMN = 'Purchase Date'
+
+# Перевод значений колонок для отображения. Данные, фильтры и агрегаты работают с исходными
+# значениями; перевод применяется только к подписям фигур и списков выбора (см. label, localize)
+TRANSLATIONS = {
+    'Gender': {'Male': 'Мужчина', 'Female': 'Женщина'},
+    'Product Category': {'Books': 'Книги', 'Clothing': 'Одежда', 'Home': 'Дом', 'Electronics': 'Электроника'},
+}
+
+# Измерения: колонки хранятся как Categorical — коды из mmap-кэша и словарь исходных значений;
+# список значений сохраняется в метаданных кэша для построения макетов
+DIMENSIONS = ('Gender', 'Product Category', 'Payment Method')
+
+# Режим для датасетов больше памяти (DASHBOARD_OUT_OF_CORE=1): строковые колонки остаются
+# кодами на страницах mmap, а агрегаты строятся порциями по CHUNK_ROWS строк,
+# так что полный набор строк в памяти процесса не собирается
+OUT_OF_CORE = os.environ.get('DASHBOARD_OUT_OF_CORE', '0') == '1'
+
+# Размер порции строк при разборе CSV и при поблочном построении агрегатов
+CHUNK_ROWS = int(os.environ.get('DASHBOARD_CHUNK_ROWS', 1_000_000))
+
+# Версия формата кэша: при изменении раскладки файлов старый кэш пересобирается
+CACHE_FORMAT = 7
+_HASH_BLOCK = 1 << 24
+
+# Сколько последних байт прочитанной части CSV хэшируется (см. tail_hash)
+TAIL_BYTES = 1 << 16
+
+logger = logging.getLogger(__name__)
+
+
+def _cache_root(csv_path):
+    return csv_path + '.cache'
+
+
+def _file_hash(csv_path):
+    digest = hashlib.sha1()
+    with open(csv_path, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Хэш последних TAIL_BYTES байт перед offset. Хранится в метаданных версии: пока он совпадает,
+# файл до offset считается неизменным и после offset его только дописывали
+def tail_hash(csv_path, offset):
+    start = max(offset - TAIL_BYTES, 0)
+    with open(csv_path, 'rb') as f:
+        f.seek(start)
+        return hashlib.sha1(f.read(offset - start)).hexdigest()
+
+
+def _read_meta(root):
+    try:
+        with open(os.path.join(root, 'current.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('format') != CACHE_FORMAT:
+        return None
+    return meta
+
+
+def _write_json(path, payload):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _is_fresh(meta, root, csv_path):
+    # Быстрая проверка по размеру и mtime; хэш считается только если mtime изменился,
+    # например после копирования файла с тем же содержимым
+    if meta is None or not os.path.isdir(os.path.join(root, meta['version'])):
+        return False
+    st = os.stat(csv_path)
+    if meta['size'] != st.st_size:
+        return False
+    if meta['mtime_ns'] == st.st_mtime_ns:
+        return True
+    if meta['sha1'] != _file_hash(csv_path):
+        return False
+    meta['mtime_ns'] = st.st_mtime_ns
+    _write_json(os.path.join(root, 'current.json'), meta)
+    return True
+
+
+def _code_dtype(labels):
+    return next(t for t in (np.int8, np.int16, np.int32) if len(labels) < np.iinfo(t).max)
+
+
+def _is_numeric(values):
+    return pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values)
+
+
+def _column_kind(values):
+    return 'array' if pd.api.types.is_datetime64_any_dtype(values) or _is_numeric(values) else 'strings'
+
+
+# Первый проход: CSV читается порциями, колонки каждой порции сбрасываются во временные .npy,
+# строки подсчитываются по дням. Строковые значения получают глобальные номера в порядке появления
+def _spill_chunks(csv_path, spill):
+    columns, kinds, dtypes, labels = None, {}, {}, {}
+    day_counts = {}
+    chunks = []
+    for index, chunk in enumerate(pd.read_csv(csv_path, sep=',', chunksize=CHUNK_ROWS)):
+        if columns is None:
+            columns = list(chunk.columns)
+            labels = {name: {} for name in columns}
+        chunk[DATE_COLUMN] = pd.to_datetime(chunk[DATE_COLUMN])
+        kinds_in_chunk = {}
+        for i, name in enumerate(columns):
+            values = chunk[name]
+            path = os.path.join(spill, f'{index}-{i}.npy')
+            kinds_in_chunk[name] = _column_kind(values)
+            if kinds_in_chunk[name] == 'array':
+                np.save(path, values.to_numpy())
+            else:
+                codes, uniques = pd.factorize(values, use_na_sentinel=True)
+                known = labels[name]
+                mapping = np.array([known.setdefault(label, len(known)) for label in uniques], dtype=np.int64)
+                np.save(path, np.where(codes >= 0, mapping[codes] if len(mapping) else -1, -1))
+        for name, kind in kinds_in_chunk.items():
+            values = chunk[name]
+            if kind == 'array':
+                dtypes[name] = np.result_type(dtypes.get(name, values.dtype), values.dtype)
+            # Колонка, пустая во всей порции, читается как float с NaN и не определяет тип
+            if kind == 'array' and values.isna().all() and name != DATE_COLUMN:
+                continue
+            if kinds.setdefault(name, kind) != kind:
+                raise ValueError(f'column {name!r} mixes numbers and strings')
+        days = _day_keys(chunk[DATE_COLUMN].to_numpy())
+        keys, counts = np.unique(days, return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            day_counts[key] = day_counts.get(key, 0) + count
+        chunks.append(len(chunk))
+    if columns is None:
+        frame = pd.read_csv(csv_path, sep=',')
+        columns = list(frame.columns)
+        labels = {name: {} for name in columns}
+    dtypes.setdefault(DATE_COLUMN, np.dtype('datetime64[ns]'))
+    for name in columns:
+        kinds.setdefault(name, 'array')
+        dtypes.setdefault(name, np.dtype(np.float64))
+    return columns, kinds, dtypes, labels, day_counts, chunks
+
+
+# Номер дня строки; строки без даты (NaT) получают ключ после всех дней, как при сортировке
+def _day_keys(dates):
+    days = dates.astype('datetime64[D]').astype(np.int64)
+    days[np.isnat(dates)] = np.iinfo(np.int64).max
+    return days
+
+
+# Разбор CSV в колоночный кэш без загрузки всего файла в память. Строки раскладываются
+# по дням сортировкой подсчётом прямо в файлы колонок (mmap), затем каждый блок дней
+# досортировывается по времени; результат совпадает со стабильной сортировкой по дате
+def _build_cache(csv_path, directory):
+    spill = os.path.join(directory, 'spill')
+    os.makedirs(spill, exist_ok=True)
+    columns, kinds, dtypes, labels, day_counts, chunks = _spill_chunks(csv_path, spill)
+    rows = sum(chunks)
+
+    # Словарь строковых значений хранится отсортированным; коды — в самом узком целом типе
+    remaps, outputs = {}, []
+    for i, name in enumerate(columns):
+        path = os.path.join(directory, f'{i}.npy')
+        if kinds[name] == 'strings':
+            values = np.array(list(labels[name]), dtype=str)
+            order = np.argsort(values, kind='stable')
+            remap = np.empty(len(values), dtype=np.int64)
+            remap[order] = np.arange(len(values))
+            remaps[name] = remap
+            np.save(os.path.join(directory, f'{i}.labels.npy'), values[order])
+            dtype = _code_dtype(values)
+        else:
+            dtype = dtypes[name]
+        outputs.append(np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(rows,)))
+
+    keys = np.array(sorted(day_counts), dtype=np.int64)
+    counts = np.array([day_counts[key] for key in keys.tolist()], dtype=np.int64)
+    starts = np.concatenate([[0], np.cumsum(counts)])
+    cursor = starts[:-1].copy()
+    date_index = columns.index(DATE_COLUMN)
+
+    for index, size in enumerate(chunks):
+        dates = np.load(os.path.join(spill, f'{index}-{date_index}.npy'))
+        day = np.searchsorted(keys, _day_keys(dates))
+        order = np.argsort(day, kind='stable')
+        sorted_day = day[order]
+        first = np.searchsorted(sorted_day, sorted_day, side='left')
+        positions = np.empty(size, dtype=np.int64)
+        positions[order] = cursor[sorted_day] + np.arange(size) - first
+        cursor += np.bincount(day, minlength=len(keys))
+        for i, name in enumerate(columns):
+            path = os.path.join(spill, f'{index}-{i}.npy')
+            values = np.load(path)
+            if kinds[name] == 'strings':
+                if values.dtype.kind != 'i':
+                    values = np.full(size, -1, dtype=np.int64)
+                values = np.where(values >= 0, remaps[name][np.maximum(values, 0)], -1)
+            outputs[i][positions] = values
+            os.remove(path)
+
+    # Внутри дня строки упорядочиваются по времени стабильно, блоками не меньше CHUNK_ROWS строк;
+    # строки без даты остаются в конце в исходном порядке
+    dated = len(keys) - (len(keys) > 0 and keys[-1] == np.iinfo(np.int64).max)
+    lo = 0
+    while lo < starts[dated]:
+        hi = starts[min(np.searchsorted(starts, lo + CHUNK_ROWS, side='left'), dated)]
+        timestamps = outputs[date_index][lo:hi]
+        if np.any(timestamps[1:] < timestamps[:-1]):
+            order = np.argsort(timestamps, kind='stable')
+            for output in outputs:
+                output[lo:hi] = output[lo:hi][order]
+        lo = hi
+
+    for output in outputs:
+        output.flush()
+    dates = outputs[date_index]
+    numeric = {name: outputs[i] for i, name in enumerate(columns) if kinds[name] == 'array' and name != DATE_COLUMN}
+    meta = {
+        'rows': rows,
+        # Для строковых колонок — число значений словаря: после дописывания на месте файл словаря
+        # может быть длиннее, чем нужно этой версии (см. _append_in_place)
+        'columns': [
+            {'name': name, 'kind': kinds[name], 'labels': len(labels[name])} if kinds[name] == 'strings'
+            else {'name': name, 'kind': kinds[name]}
+            for name in columns
+        ],
+        # Границы дат и значения измерений нужны макетам страниц до загрузки самих данных
+        'first_date': pd.Timestamp(dates[0]).isoformat() if rows and not np.isnat(dates[0]) else None,
+        'last_date': pd.Timestamp(dates[starts[dated] - 1]).isoformat() if starts[dated] else None,
+        'dimensions': {
+            name: sorted(labels[name]) if kinds[name] == 'strings'
+            else sorted(pd.Series(outputs[columns.index(name)]).dropna().unique().tolist())
+            for name in DIMENSIONS
+        },
+        'partitions': month_partitions(dates, numeric),
+    }
+    del outputs, dates, numeric
+    shutil.rmtree(spill, ignore_errors=True)
+    return meta
+
+
+def _write_cache(root, csv_path):
+    st = os.stat(csv_path)
+    sha1 = _file_hash(csv_path)
+    version = sha1[:16]
+    target = os.path.join(root, version)
+    tmp_target = f'{target}.{os.getpid()}.tmp'
+    os.makedirs(tmp_target, exist_ok=True)
+
+    # Каждая колонка хранится отдельным .npy, который открывается через mmap.
+    # Строковые колонки кодируются словарём: коды + массив уникальных значений
+    built = _build_cache(csv_path, tmp_target)
+
+    if os.path.isdir(target):
+        shutil.rmtree(target, ignore_errors=True)
+    os.replace(tmp_target, target)
+
+    meta = {
+        'format': CACHE_FORMAT,
+        'version': version,
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'sha1': sha1,
+        'tail': tail_hash(csv_path, st.st_size),
+    }
+    meta.update(built)
+    _write_json(os.path.join(root, 'current.json'), meta)
+
+    # Старые версии удаляются: уже открытые mmap у работающих процессов остаются валидными
+    for entry in os.listdir(root):
+        path = os.path.join(root, entry)
+        if entry != version and os.path.isdir(path) and not entry.endswith('.tmp'):
+            shutil.rmtree(path, ignore_errors=True)
+        elif '+' in entry and entry.endswith('.json'):
+            os.remove(path)
+    return meta
+
+
+# Версия кэша с дописанными строками называется «<версия>+<смещение в CSV>», её метаданные лежат
+# в <версия>.json рядом с current.json. Колонки хранятся в каталоге meta['directory']: обычно это
+# каталог исходной версии, в конец файлов которого строки дописываются на месте (_append_in_place),
+# а если строки нужно вставить между существующими — новый каталог с копией (_copy_extended).
+# Версия однозначно задаётся смещением, поэтому воркер, который дописывает те же строки позже,
+# берёт готовые метаданные, а блокировка каталога не даёт двум воркерам дописывать одновременно
+def _extend_cache(root, meta, rows, version, offset, tail):
+    path = os.path.join(root, f'{version}.json')
+    extended = _read_json(path)
+    if extended is not None:
+        return extended
+    with _locked(os.path.join(root, meta.get('directory', meta['version']))):
+        extended = _read_json(path)
+        if extended is None:
+            _check_kinds(meta, rows)
+            extended = _append_in_place(root, meta, rows) or _copy_extended(root, meta, rows, version)
+            extended = dict(extended, version=version, size=offset, tail=tail)
+            extended.pop('sha1', None)
+            extended.pop('mtime_ns', None)
+            _write_json(path, extended)
+
+    # Предыдущие дописанные версии больше не нужны; их открытые mmap остаются валидными
+    base_version = version.split('+')[0]
+    for entry in os.listdir(root):
+        prefix, _, end = entry.partition('+')
+        name, suffix = os.path.splitext(end)
+        if prefix != base_version or entry == extended['directory']:
+            continue
+        if end.isdigit() and int(end) < offset:
+            shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+        elif suffix == '.json' and name.isdigit() and int(name) < offset:
+            os.remove(os.path.join(root, entry))
+    return extended
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# Межпроцессная блокировка каталога кэша на время дописывания
+@contextmanager
+def _locked(directory):
+    with open(os.path.join(directory, '.lock'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _check_kinds(meta, rows):
+    for column in meta['columns']:
+        values = rows[column['name']]
+        if column['kind'] != _column_kind(values) and not values.isna().all():
+            raise ValueError(f"column {column['name']!r} mixes numbers and strings")
+
+
+# Заголовок .npy: форма, dtype и смещение данных
+def _read_header(f):
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+    else:
+        shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+    return shape, dtype, f.tell()
+
+
+# Строки, которые по дате идут не раньше всех строк снимка, дописываются в конец файлов колонок
+# его каталога. Уже открытые mmap видят прежнюю длину файла, а _open_cache читает только
+# meta['rows'] строк, поэтому прежние снимки не меняются. Новые строковые значения добавляются
+# в конец словаря, коды существующих не меняются. Возвращает None, если дописать на месте нельзя:
+# в снимке есть строки без даты, строки нужно вставить раньше, не хватает типа колонки или кодов,
+# или файлы уже дописаны дальше этого снимка
+def _append_in_place(root, meta, rows):
+    directory = os.path.join(root, meta.get('directory', meta['version']))
+    base_rows = meta['rows']
+    partitions = meta['partitions']
+    if partitions and partitions[-1]['key'] is None:
+        return None
+    dates = rows[DATE_COLUMN].to_numpy()
+    if len(rows) and meta['last_date'] and dates[0] < np.datetime64(pd.Timestamp(meta['last_date'])):
+        return None
+
+    columns, headers, labels, dimensions = [], [], {}, {}
+    for i, column in enumerate(meta['columns']):
+        name = column['name']
+        with open(os.path.join(directory, f'{i}.npy'), 'rb') as f:
+            shape, dtype, offset = _read_header(f)
+        if shape != (base_rows,):
+            return None
+        values = rows[name]
+        if column['kind'] == 'strings':
+            known = np.load(os.path.join(directory, f'{i}.labels.npy'))[:column['labels']]
+            valid = values.notna().to_numpy()
+            strings = values.to_numpy()[valid].astype(str)
+            new = np.setdiff1d(strings, known)
+            merged = np.concatenate([known, new]) if len(new) else known
+            if np.dtype(_code_dtype(merged)) != dtype:
+                return None
+            codes = np.full(len(values), -1, dtype=dtype)
+            codes[valid] = pd.Index(merged).get_indexer(strings)
+            values = codes
+            labels[i] = merged
+            if name in DIMENSIONS:
+                dimensions[name] = sorted(set(meta['dimensions'][name]) | set(new.tolist()))
+        else:
+            values = values.to_numpy()
+            if name == DATE_COLUMN:
+                values = values.astype(dtype)
+            if np.result_type(dtype, values.dtype) != dtype:
+                return None
+            if name in DIMENSIONS:
+                dimensions[name] = sorted(set(meta['dimensions'][name]) | set(pd.Series(values).dropna().unique().tolist()))
+        columns.append(values.astype(dtype, copy=False))
+        headers.append((dtype, offset))
+
+    # Сначала данные, затем заголовки: после сбоя на середине заголовки не совпадут с meta['rows'],
+    # и следующее дописывание пойдёт через копию
+    total = base_rows + len(rows)
+    for i, (values, (dtype, offset)) in enumerate(zip(columns, headers)):
+        with open(os.path.join(directory, f'{i}.npy'), 'r+b') as f:
+            f.seek(offset + base_rows * dtype.itemsize)
+            f.truncate()
+            f.write(values.tobytes())
+            f.seek(0)
+            np.lib.format.write_array_header_1_0(f, {
+                'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (total,),
+            })
+            if f.tell() != offset:
+                raise ValueError(f'header of column {i} changed its size')
+    for i, merged in labels.items():
+        if len(merged) != meta['columns'][i]['labels']:
+            path = os.path.join(directory, f'{i}.labels.npy')
+            tmp_path = f'{path}.{os.getpid()}.tmp.npy'
+            np.save(tmp_path, merged)
+            os.replace(tmp_path, path)
+
+    # Месячные разделы пересчитываются с начала последнего раздела снимка
+    start = partitions[-1]['start'] if partitions else 0
+    outputs = {
+        column['name']: np.load(os.path.join(directory, f'{i}.npy'), mmap_mode='r')[start:total]
+        for i, column in enumerate(meta['columns'])
+        if column['kind'] == 'array'
+    }
+    tail = month_partitions(outputs.pop(DATE_COLUMN), outputs)
+    for partition in tail:
+        partition['start'] += start
+        partition['stop'] += start
+    dated = dates[~np.isnat(dates)]
+    return dict(
+        meta,
+        directory=meta.get('directory', meta['version']),
+        rows=total,
+        columns=[
+            dict(column, labels=len(labels[i])) if i in labels else column
+            for i, column in enumerate(meta['columns'])
+        ],
+        first_date=meta['first_date'] or (pd.Timestamp(dated[0]).isoformat() if len(dated) else None),
+        last_date=pd.Timestamp(dated[-1]).isoformat() if len(dated) else meta['last_date'],
+        dimensions={name: dimensions[name] for name in DIMENSIONS},
+        partitions=partitions[:-1] + tail,
+    )
+
+
+# Копия колонок снимка в новый каталог <версия>: строки снимка переносятся блоками, дописанные
+# вставляются по дате после строк с той же датой, словари строковых колонок снова сортируются
+def _copy_extended(root, meta, rows, version):
+    source = os.path.join(root, meta.get('directory', meta['version']))
+    target = os.path.join(root, version)
+    tmp_target = f'{target}.{os.getpid()}.tmp'
+    os.makedirs(tmp_target, exist_ok=True)
+
+    base_rows = meta['rows']
+    total = base_rows + len(rows)
+    date_index = next(i for i, column in enumerate(meta['columns']) if column['name'] == DATE_COLUMN)
+    base_dates = np.load(os.path.join(source, f'{date_index}.npy'), mmap_mode='r')[:base_rows]
+    # Строка встаёт после строк снимка с той же датой; строки без даты — в самый конец
+    insert = np.searchsorted(base_dates, rows[DATE_COLUMN].to_numpy().astype(base_dates.dtype), side='right')
+    appended = not len(rows) or insert[0] == base_rows
+
+    columns, numeric, dimensions, counts = {}, {}, {}, {}
+    for i, column in enumerate(meta['columns']):
+        name, kind = column['name'], column['kind']
+        values = rows[name]
+        base = np.load(os.path.join(source, f'{i}.npy'), mmap_mode='r')[:base_rows]
+        remap = None
+        if kind == 'strings':
+            labels = np.load(os.path.join(source, f'{i}.labels.npy'))[:column['labels']]
+            valid = values.notna().to_numpy()
+            strings = values.to_numpy()[valid].astype(str)
+            merged = np.unique(np.concatenate([labels, strings]))
+            if not np.array_equal(merged, labels):
+                remap = np.searchsorted(merged, labels)
+            np.save(os.path.join(tmp_target, f'{i}.labels.npy'), merged)
+            dtype = _code_dtype(merged)
+            values = np.full(len(values), -1, dtype=dtype)
+            values[valid] = np.searchsorted(merged, strings)
+            dimensions[name] = merged.tolist()
+            counts[i] = len(merged)
+        else:
+            values = values.to_numpy()
+            dtype = np.result_type(base.dtype, values.dtype)
+            if name in DIMENSIONS:
+                dimensions[name] = sorted(set(meta['dimensions'][name]) | set(pd.Series(values).dropna().unique().tolist()))
+        output = np.lib.format.open_memmap(os.path.join(tmp_target, f'{i}.npy'), mode='w+', dtype=dtype, shape=(total,))
+        for start in range(0, base_rows, CHUNK_ROWS):
+            stop = min(start + CHUNK_ROWS, base_rows)
+            block = base[start:stop]
+            if remap is not None:
+                block = np.where(block >= 0, remap[np.maximum(block, 0)], -1)
+            if appended:
+                output[start:stop] = block
+            else:
+                positions = np.arange(start, stop)
+                output[positions + np.searchsorted(insert, positions, side='right')] = block
+        output[insert + np.arange(len(rows))] = values
+        output.flush()
+        columns[name] = output
+        if kind == 'array' and name != DATE_COLUMN:
+            numeric[name] = output
+
+    dates = columns[DATE_COLUMN]
+    dated = int(np.searchsorted(dates, np.datetime64('NaT'), side='left'))
+    extended = dict(
+        meta,
+        directory=version,
+        rows=total,
+        columns=[dict(column, labels=counts[i]) if i in counts else column for i, column in enumerate(meta['columns'])],
+        first_date=pd.Timestamp(dates[0]).isoformat() if dated else None,
+        last_date=pd.Timestamp(dates[dated - 1]).isoformat() if dated else None,
+        dimensions={name: dimensions[name] for name in DIMENSIONS},
+        partitions=month_partitions(dates, numeric),
+    )
+    del columns, numeric, dates
+    try:
+        os.rename(tmp_target, target)
+    except OSError:
+        # Тот же каталог успел собрать другой воркер
+        shutil.rmtree(tmp_target, ignore_errors=True)
+    return extended
+
+
+# Диапазон строк [start, stop) колонки .npy через mmap только этого участка файла
+def _map_rows(path, start, stop):
+    with open(path, 'rb') as f:
+        _, dtype, offset = _read_header(f)
+    if stop == start:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset + start * dtype.itemsize, shape=(stop - start,))
+
+
+# Весь кэш или, если задан rows = (start, stop), только этот диапазон строк с исходными номерами в индексе.
+# Файлы колонок могут быть длиннее версии (см. _append_in_place), читаются только её meta['rows'] строк
+def _open_cache(root, meta, rows=None):
+    directory = os.path.join(root, meta.get('directory', meta['version']))
+    data = {}
+    for i, column in enumerate(meta['columns']):
+        path = os.path.join(directory, f'{i}.npy')
+        values = np.asarray(_map_rows(path, *(rows or (0, meta['rows']))))
+        if column['kind'] == 'strings':
+            labels = np.load(os.path.join(directory, f'{i}.labels.npy'))[:column['labels']].astype(object)
+        if column['kind'] == 'strings' and (OUT_OF_CORE or column['name'] in DIMENSIONS):
+            # Categorical поверх кодов из mmap: значения не раскодируются в объекты Python
+            values = pd.Categorical.from_codes(values, dtype=pd.CategoricalDtype(pd.Index(labels)), validate=False)
+        elif column['kind'] == 'strings':
+            strings = np.empty(len(values), dtype=object)
+            valid = values >= 0
+            strings[valid] = labels[values[valid]]
+            strings[~valid] = np.nan
+            values = strings
+        data[column['name']] = values
+    # copy=False оставляет числовые колонки и даты на страницах mmap,
+    # поэтому несколько процессов разделяют одну копию в page cache
+    return pd.DataFrame(data, index=None if rows is None else pd.RangeIndex(*rows), copy=False)
+
+
+# Строки [start, stop) кэша, из которого загружен снимок (Snapshot.source)
+def open_rows(source, start, stop):
+    root, meta = source
+    return _open_cache(root, meta, rows=(start, stop))
+
+
+def _stat(value):
+    if pd.isna(value):
+        return None
+    if isinstance(value, np.datetime64):
+        return pd.Timestamp(value).isoformat()
+    return value.item() if isinstance(value, np.generic) else value
+
+
+# Месячные разделы отсортированного по дате набора строк: ключ месяца, диапазон строк
+# и min/max каждой числовой колонки. Строки без даты (они в конце) образуют раздел без ключа.
+# Границы месяцев находятся бинарным поиском, статистика считается по одному разделу за раз
+def month_partitions(dates, columns):
+    dated = int(np.searchsorted(dates, np.datetime64('NaT'), side='left'))
+    partitions = []
+    if dated:
+        months = np.arange(dates[0].astype('datetime64[M]'), dates[dated - 1].astype('datetime64[M]') + 1)
+        bounds = np.searchsorted(dates[:dated], months.astype(dates.dtype), side='left').tolist() + [dated]
+        for month, start, stop in zip(months, bounds[:-1], bounds[1:]):
+            if stop == start:
+                continue
+            stats = {DATE_COLUMN: [_stat(dates[start]), _stat(dates[stop - 1])]}
+            for name, values in columns.items():
+                block = values[start:stop]
+                stats[name] = [_stat(np.fmin.reduce(block)), _stat(np.fmax.reduce(block))]
+            partitions.append({'key': str(month), 'start': start, 'stop': stop, 'stats': stats})
+    if dated < len(dates):
+        partitions.append({'key': None, 'start': dated, 'stop': len(dates), 'stats': {}})
+    return partitions
+
+
+# Значения измерения для списков выбора в порядке словаря перевода, остальные — по алфавиту
+def _ordered_values(name, values):
+    translation = TRANSLATIONS.get(name, {})
+    return [raw for raw in translation if raw in values] + sorted(value for value in values if value not in translation)
+
+
+# Подпись значения измерения для фигур и списков выбора
+def label(name, value):
+    return TRANSLATIONS.get(name, {}).get(value, value)
+
+
+# Варианты dcc.Dropdown: значение — исходное, подпись — переведённая
+def dimension_options(name, values):
+    return [{'label': label(name, value), 'value': value} for value in values]
+
+
+def _load(csv_path):
+    root = _cache_root(csv_path)
+    meta = _read_meta(root)
+    if not _is_fresh(meta, root, csv_path):
+        os.makedirs(root, exist_ok=True)
+        meta = _write_cache(root, csv_path)
+    return _open_cache(root, meta), meta
+
+
+def load_dataset(csv_path=CSV_PATH):
+    return _load(csv_path)[0]
+
+
+# Порции строк фрейма для поблочной обработки: срезы iloc без копирования.
+# В обычном режиме фрейм обрабатывается целиком одной порцией
+def chunks(frame):
+    if not OUT_OF_CORE or len(frame) <= CHUNK_ROWS:
+        yield frame
+        return
+    for start in range(0, len(frame), CHUNK_ROWS):
+        yield frame.iloc[start:start + CHUNK_ROWS]
+
+
+# Агрегат, собранный по порциям: build строит его по одной порции, merge объединяет два.
+# Слияние идёт попарно, как в двоичном счётчике, поэтому каждый элемент копируется
+# O(log числа порций) раз, а в памяти одновременно не больше O(log) промежуточных агрегатов
+def reduce_chunks(frame, build, merge):
+    stack = []
+    for part in chunks(frame):
+        value, level = build(part), 0
+        while stack and stack[-1][1] == level:
+            value, level = merge(stack.pop()[0], value), level + 1
+        stack.append((value, level))
+    value = stack.pop()[0]
+    while stack:
+        value = merge(stack.pop()[0], value)
+    return value
+
+
+# Результат группировки по Categorical-колонкам с обычными значениями вместо категорий
+# и в порядке значений: такие результаты порций складываются и сливаются между собой,
+# даже если набор категорий у них разный
+def with_labels(result):
+    index = result.index
+    if isinstance(index, pd.MultiIndex):
+        if not any(isinstance(level, pd.CategoricalIndex) for level in index.levels):
+            return result
+        index = index.set_levels([
+            level.astype(object) if isinstance(level, pd.CategoricalIndex) else level for level in index.levels
+        ])
+    elif isinstance(index, pd.CategoricalIndex):
+        index = index.astype(object)
+    else:
+        return result
+    return result.set_axis(index).sort_index()
+
+
+# Перевод значений измерений в индексе результата — последний шаг перед построением фигуры.
+# Строки упорядочиваются по подписям, как при группировке по переведённым строкам
+def localize(result):
+    result = with_labels(result)
+    index = result.index
+    if not any(name in TRANSLATIONS for name in index.names):
+        return result
+    if isinstance(index, pd.MultiIndex):
+        index = index.set_levels([
+            level.map(lambda value, name=level.name: label(name, value)) if level.name in TRANSLATIONS else level
+            for level in index.levels
+        ])
+    else:
+        index = index.map(lambda value: label(index.name, value))
+    return result.set_axis(index).sort_index()
+
+
+_incremental = {}
+
+
+# Агрегат с функцией update(value, rows, snapshot) переносится в новый снимок инкрементально;
+# остальные агрегаты после дописывания строк строятся заново при первом обращении
+def register_incremental(name, update):
+    _incremental[name] = update
+
+
+# Дописанные строки в Categorical-колонках кодируются словарями нового снимка, в которые
+# их значения уже вошли при дописывании кэша
+def _align_categories(frame, rows):
+    for name in frame.columns:
+        dtype = frame[name].dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            rows[name] = pd.Categorical(rows[name].astype(object), dtype=dtype)
+    return rows
+
+
+# Неизменяемый снимок датасета: строки, отсортированные по дате, версия и число байт CSV,
+# из которых он собран. Производные структуры (куб и т.п.) кэшируются внутри снимка
+class Snapshot:
+    def __init__(self, frame, version, offset, source=None):
+        self.df = frame
+        self.version = version
+        self.offset = offset
+        # Каталог и метаданные кэша, строки которого совпадают с frame
+        self.source = source
+        self._aggregates = {}
+        # Блокировка на каждый агрегат: построение одного агрегата может запрашивать другие
+        # и ждать результатов коллбэков, которые в других потоках строят свои агрегаты
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    @property
+    def date_bounds(self):
+        # Строки без даты отсортированы в конец (см. month_partitions) и в границы не входят
+        dates = self.df[DATE_COLUMN].to_numpy()
+        dated = int(np.searchsorted(dates, np.datetime64('NaT'), side='left'))
+        if dated == 0:
+            return None, None
+        return pd.Timestamp(dates[0]), pd.Timestamp(dates[dated - 1])
+
+    def aggregate(self, name, build):
+        value = self._aggregates.get(name)
+        if value is None:
+            with self._lock:
+                lock = self._locks.setdefault(name, threading.Lock())
+            with lock:
+                value = self._aggregates.get(name)
+                if value is None:
+                    value = self._aggregates[name] = build(self.df)
+        return value
+
+    # Новый снимок с дописанными строками; текущий при этом не меняется. Строки дописываются
+    # в новую версию кэша (см. _extend_cache), и колонки снимка остаются на страницах mmap.
+    # tail — tail_hash CSV на новом смещении
+    def extend(self, rows, offset, tail):
+        rows = rows.sort_values(DATE_COLUMN, kind='stable', ignore_index=True)
+        root, meta = self.source
+        meta = _extend_cache(root, meta, rows, f"{self.version.split('+')[0]}+{offset}", offset, tail)
+        snapshot = Snapshot(_open_cache(root, meta), meta['version'], offset, source=(root, meta))
+        rows = _align_categories(snapshot.df, rows)
+        for name, value in list(self._aggregates.items()):
+            update = _incremental.get(name)
+            if update is not None:
+                snapshot._aggregates[name] = update(value, rows, snapshot)
+        return snapshot
+
+
+def load_snapshot(csv_path=CSV_PATH):
+    frame, meta = _load(csv_path)
+    return Snapshot(frame, meta['version'], meta['size'], source=(_cache_root(csv_path), meta))
+
+
+_current = None
+_loaded = threading.Event()
+_loader = None
+_loader_lock = threading.Lock()
+_load_error = None
+_pinned = threading.local()
+
+
+def _load_in_background(csv_path):
+    global _current, _load_error
+    try:
+        _current = load_snapshot(csv_path)
+    except BaseException as error:
+        _load_error = error
+        logger.exception('failed to load dataset from %s', csv_path)
+    finally:
+        _loaded.set()
+
+
+# Датасет загружается в фоновом потоке: сервер начинает принимать запросы сразу,
+# а коллбэки, которым нужны данные, ждут окончания загрузки в current()
+def start_loading(csv_path=CSV_PATH):
+    global _loader
+    with _loader_lock:
+        if _loader is None:
+            _loader = threading.Thread(target=_load_in_background, args=(csv_path,), name='dataset-loader', daemon=True)
+            _loader.start()
+    return _loader
+
+
+def ready():
+    return _loaded.is_set()
+
+
+def current():
+    snapshot = getattr(_pinned, 'snapshot', None)
+    if snapshot is not None:
+        return snapshot
+    if not _loaded.is_set():
+        start_loading()
+        _loaded.wait()
+    if _load_error is not None:
+        raise RuntimeError('dataset failed to load') from _load_error
+    return _current
+
+
+# Данные для макетов страниц: границы дат и значения измерений. Пока датасет грузится,
+# они берутся из метаданных актуального кэша, после загрузки — из текущего снимка
+def layout_metadata(csv_path=CSV_PATH):
+    if not _loaded.is_set():
+        root = _cache_root(csv_path)
+        meta = _read_meta(root)
+        if meta is not None and os.path.exists(csv_path) and _is_fresh(meta, root, csv_path):
+            return {
+                'first_date': pd.Timestamp(meta['first_date']) if meta['first_date'] else None,
+                'last_date': pd.Timestamp(meta['last_date']) if meta['last_date'] else None,
+                'dimensions': {name: _ordered_values(name, values) for name, values in meta['dimensions'].items()},
+            }
+    snapshot = current()
+    first_date, last_date = snapshot.date_bounds
+    return {
+        'first_date': first_date,
+        'last_date': last_date,
+        'dimensions': snapshot.aggregate('dimensions', lambda frame: {
+            name: _ordered_values(name, frame[name].dropna().unique().tolist()) for name in DIMENSIONS
+        }),
+    }
+
+
+# Закрепляет текущий снимок за потоком: коллбэк видит одни и те же данные от начала
+# до конца, даже если во время расчёта был опубликован новый снимок. Потоки пула, выполняющие
+# части коллбэка, закрепляют снимок вызвавшего их потока
+@contextmanager
+def pinned(snapshot=None):
+    previous = getattr(_pinned, 'snapshot', None)
+    snapshot = current() if snapshot is None else snapshot
+    _pinned.snapshot = snapshot
+    try:
+        yield snapshot
+    finally:
+        _pinned.snapshot = previous
+
+
+# Агрегаты, которые потоки родителя строили в момент fork, в дочернем процессе строятся заново
+def _reset_after_fork():
+    if _current is not None:
+        _current._lock = threading.Lock()
+        _current._locks = {}
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+# Подмена ссылки атомарна: новые запросы сразу видят новый снимок, начатые дорабатывают со старым
+def publish(snapshot):
+    global _current
+    _current = snapshot
@@ -0,0 +1,351 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import data
+from customers import customer_codes, get_dimension
+from data import DATE_COLUMN
+from filters import day_bounds
+
+# exact — точный подсчёт по множествам клиентов за день, hll — приближённый HyperLogLog
+# с фиксированной памятью на ячейку, rows — nunique по отфильтрованным строкам
+MODE = os.environ.get('DASHBOARD_DISTINCT', 'exact')
+HLL_PRECISION = int(os.environ.get('DASHBOARD_HLL_PRECISION', 10))
+# Длина блока дней в свёртках точного индекса
+BLOCK_DAYS = int(os.environ.get('DASHBOARD_DISTINCT_BLOCK_DAYS', 32))
+
+_EPOCH_DAY = np.datetime64(0, 'D')
+_EPOCH = pd.Timestamp(0)
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+# Позиции [starts[i], ends[i]) всех диапазонов одним массивом
+def _expand(starts, ends):
+    lengths = ends - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    shifts = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return shifts + np.arange(total)
+
+
+# Границы диапазона дат в днях от эпохи, [start, end); None — без границы
+def _day_range(start_date, end_date):
+    start, end = day_bounds(start_date, end_date)
+    return tuple(None if bound is None else (bound - _EPOCH).days for bound in (start, end))
+
+
+# Общая часть индексов: непустые ячейки день × пол × возраст в отсортированном массиве cells.
+# Дни хранятся как номера от эпохи, чтобы индексы разных снимков было легко объединять
+class _CellIndex:
+    def __init__(self, first_day, days, genders, ages, cells):
+        self.first_day = first_day
+        self.days = days
+        self.genders = genders
+        self.ages = ages
+        self.cells = cells
+
+    def _decode(self):
+        day, gender, age = np.unravel_index(self.cells, (self.days, len(self.genders), len(self.ages)))
+        return day + self.first_day, self.genders.take(gender), self.ages.take(age)
+
+    # Диапазоны позиций в cells, попадающие под фильтр, для дней [start, end) от эпохи
+    def _selected(self, start, end, gender=None, age=None):
+        d0 = 0 if start is None else min(max(start - self.first_day, 0), self.days)
+        d1 = self.days if end is None else min(max(end - self.first_day, d0), self.days)
+        genders, ages = len(self.genders), len(self.ages)
+        gender_index = self.genders.get_indexer([gender])[0] if gender else None
+        age_index = self.ages.get_indexer([age])[0] if age else None
+        if gender_index == -1 or age_index == -1:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        day = np.arange(d0, d1, dtype=np.int64)
+        if gender_index is None and age_index is None:
+            starts = np.array([d0 * genders * ages])
+            ends = np.array([d1 * genders * ages])
+        elif age_index is None:
+            starts = (day * genders + gender_index) * ages
+            ends = starts + ages
+        elif gender_index is None:
+            starts = ((day[:, None] * genders + np.arange(genders)[None, :]) * ages + age_index).ravel()
+            ends = starts + 1
+        else:
+            starts = (day * genders + gender_index) * ages + age_index
+            ends = starts + 1
+        return np.searchsorted(self.cells, starts), np.searchsorted(self.cells, ends)
+
+
+def _layout(day, gender, age):
+    first_day = int(day.min()) if len(day) else 0
+    days = int(day.max()) - first_day + 1 if len(day) else 0
+    gender_codes, genders = pd.factorize(gender, sort=True, use_na_sentinel=False)
+    age_codes, ages = pd.factorize(age, sort=True, use_na_sentinel=False)
+    cells = np.ravel_multi_index((day - first_day, gender_codes, age_codes), (days, len(genders), len(ages)))
+    return first_day, days, pd.Index(genders), pd.Index(ages), cells
+
+
+# Точный индекс в духе roaring: небольшие множества хранятся отсортированными массивами
+# кодов клиентов, крупные (больше 1/32 всех клиентов) — упакованными битовыми картами.
+# Для запросов без фильтра по возрасту рядом лежат свёртки индекса без возраста (и без пола)
+# по дням и по блокам из BLOCK_DAYS дней: диапазон читается целыми блоками и днями по краям,
+# а в блоках и днях с большой долей клиентов — битовыми картами, поэтому стоимость широкого
+# диапазона растёт с числом дней, а не строк
+class ExactIndex(_CellIndex):
+    def __init__(self, first_day, days, genders, ages, cells, offsets, codes, dense_positions, bitmaps, customers,
+                 rollups=None):
+        super().__init__(first_day, days, genders, ages, cells)
+        self.offsets = offsets
+        self.codes = codes
+        self.dense_positions = dense_positions
+        self.bitmaps = bitmaps
+        self.customers = customers
+        self.rollups = rollups or {}
+
+    # Индексы и диапазоны дней (в днях или блоках индекса), из которых складывается запрос
+    def _pieces(self, start, end, gender, age):
+        levels = self.rollups.get(bool(gender)) if not age else None
+        if levels is None:
+            return [(self, start, end)]
+        blocks, days = levels
+        first = None if start is None else -(-start // BLOCK_DAYS)
+        last = None if end is None else end // BLOCK_DAYS
+        if first is not None and last is not None and first >= last:
+            return [(days, start, end)]
+        pieces = [(blocks, first, last)]
+        if start is not None:
+            pieces.append((days, start, first * BLOCK_DAYS))
+        if end is not None:
+            pieces.append((days, last * BLOCK_DAYS, end))
+        return pieces
+
+    def count(self, start_date, end_date, gender=None, age=None):
+        codes, dense = [], []
+        for index, start, end in self._pieces(*_day_range(start_date, end_date), gender, age):
+            starts, ends = index._selected(start, end, gender, age)
+            codes.append(index.codes[_expand(index.offsets[starts], index.offsets[ends])])
+            rows = _expand(np.searchsorted(index.dense_positions, starts), np.searchsorted(index.dense_positions, ends))
+            if len(rows):
+                dense.append(np.bitwise_or.reduce(index.bitmaps[rows], axis=0))
+        codes = np.concatenate(codes)
+        if not dense and len(codes) * 32 < self.customers:
+            return len(np.unique(codes))
+        seen = np.zeros(self.customers, dtype=bool)
+        seen[codes] = True
+        if not dense:
+            return int(np.count_nonzero(seen))
+        bits = np.bitwise_or.reduce([np.packbits(seen)] + dense, axis=0)
+        return int(_POPCOUNT[bits].sum(dtype=np.int64))
+
+
+def _build_cells(day, gender, age, codes, customers):
+    first_day, days, genders, ages, cells = _layout(day, gender, age)
+    pairs = np.unique(cells.astype(np.int64) * max(customers, 1) + codes)
+    pair_cells, pair_codes = np.divmod(pairs, max(customers, 1))
+    cells, first, counts = np.unique(pair_cells, return_index=True, return_counts=True)
+    dense = counts * 32 > customers
+    dense_positions = np.flatnonzero(dense)
+    bitmaps = np.zeros((len(dense_positions), (customers + 7) // 8), dtype=np.uint8)
+    for row, position in enumerate(dense_positions):
+        seen = np.zeros(customers, dtype=bool)
+        seen[pair_codes[first[position]:first[position] + counts[position]]] = True
+        bitmaps[row] = np.packbits(seen)
+    sparse = ~np.repeat(dense, counts)
+    offsets = np.zeros(len(cells) + 1, dtype=np.int64)
+    np.cumsum(np.where(dense, 0, counts), out=offsets[1:])
+    return ExactIndex(first_day, days, genders, ages, cells, offsets,
+                      pair_codes[sparse].astype(np.uint32), dense_positions, bitmaps, customers)
+
+
+# Индекс со свёртками: по ключу «есть фильтр по полу» — пара индексов по блокам дней и по дням,
+# в которых ось возраста (а без фильтра по полу — и ось пола) одна на все строки
+def _build_exact(day, gender, age, codes, customers):
+    index = _build_cells(day, gender, age, codes, customers)
+    single = np.zeros(len(day), dtype=np.int8)
+    index.rollups = {
+        keep_gender: tuple(
+            _build_cells(day // span, gender if keep_gender else single, single, codes, customers)
+            for span in (BLOCK_DAYS, 1)
+        )
+        for keep_gender in (False, True)
+    }
+    return index
+
+
+# Хэш splitmix64: равномерно распределяет коды клиентов по 64 битам
+def _hash(values):
+    with np.errstate(over='ignore'):
+        x = values.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+
+def _bit_length(values):
+    length = np.zeros(len(values), dtype=np.int64)
+    x = values.copy()
+    for shift in (32, 16, 8, 4, 2, 1):
+        high = x >= (np.uint64(1) << np.uint64(shift))
+        length[high] += shift
+        x[high] >>= np.uint64(shift)
+    return length + (x > 0)
+
+
+# Приближённый индекс: на каждую непустую ячейку 2**precision однобайтовых регистров
+# HyperLogLog; объединение за диапазон — поэлементный максимум регистров
+class HllIndex(_CellIndex):
+    def __init__(self, first_day, days, genders, ages, cells, registers):
+        super().__init__(first_day, days, genders, ages, cells)
+        self.registers = registers
+
+    def count(self, start_date, end_date, gender=None, age=None):
+        rows = _expand(*self._selected(*_day_range(start_date, end_date), gender, age))
+        if len(rows) == 0:
+            return 0
+        merged = self.registers[rows].max(axis=0)
+        m = merged.shape[0]
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -merged.astype(np.int64)))
+        zeros = int(np.count_nonzero(merged == 0))
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+
+def _observations(codes, precision):
+    hashed = _hash(codes)
+    register = (hashed >> np.uint64(64 - precision)).astype(np.int64)
+    rest = hashed & ((np.uint64(1) << np.uint64(64 - precision)) - np.uint64(1))
+    rank = (64 - precision) - _bit_length(rest) + 1
+    return register, rank.astype(np.uint8)
+
+
+def _build_hll(day, gender, age, register, rank, precision):
+    first_day, days, genders, ages, cells = _layout(day, gender, age)
+    cells, inverse = np.unique(cells, return_inverse=True)
+    registers = np.zeros((len(cells), 1 << precision), dtype=np.uint8)
+    np.maximum.at(registers, (inverse, register), rank)
+    return HllIndex(first_day, days, genders, ages, cells, registers)
+
+
+def _row_dimensions(rows):
+    day = rows[DATE_COLUMN].to_numpy().astype('datetime64[D]') - _EPOCH_DAY
+    return day.astype(np.int64), rows['Gender'].to_numpy(), rows['Age'].to_numpy()
+
+
+def build_index(frame, codes, customers, mode=MODE):
+    # Строки без даты не попадают ни в один диапазон дат, поэтому в индекс не входят
+    dated = ~np.isnat(frame[DATE_COLUMN].to_numpy())
+    if not dated.all():
+        frame, codes = frame[dated], np.asarray(codes)[dated]
+    day, gender, age = _row_dimensions(frame)
+    if mode == 'hll':
+        return _build_hll(day, gender, age, *_observations(codes, HLL_PRECISION), HLL_PRECISION)
+    return _build_exact(day, gender, age, codes, customers)
+
+
+# Дописанные строки собираются в отдельный индекс, который вливается в индекс снимка
+def extend_index(index, rows, snapshot):
+    dimension = get_dimension(snapshot)
+    mode = 'hll' if isinstance(index, HllIndex) else 'exact'
+    return merge_indexes(index, build_index(rows, dimension.codes(rows['Customer ID']), len(dimension), mode))
+
+
+# Множество клиентов ячейки position точного индекса
+def _cell_codes(index, position):
+    row = np.searchsorted(index.dense_positions, position)
+    if row < len(index.dense_positions) and index.dense_positions[row] == position:
+        return np.flatnonzero(np.unpackbits(index.bitmaps[row], count=index.customers))
+    return index.codes[index.offsets[position]:index.offsets[position + 1]].astype(np.int64)
+
+
+# Слияние точных индексов без разворачивания в пары (ячейка, клиент): ячейки, которые есть
+# только в одном индексе, переносятся как есть — срезом кодов или битовой картой, расширенной
+# до общего числа клиентов; множества совпадающих ячеек объединяются заново. Коды клиентов
+# у индексов общие: измерение клиентов при дописывании только добавляет коды в конец
+def _merge_exact(left, right, cells):
+    customers = max(left.customers, right.customers)
+    width = (customers + 7) // 8
+    left_cells, right_cells = cells[:len(left.cells)], cells[len(left.cells):]
+    common, left_common, right_common = np.intersect1d(left_cells, right_cells, assume_unique=True, return_indices=True)
+
+    overlap_codes, overlap_offsets, overlap_bitmaps, overlap_rows = [], [0], [], []
+    for left_position, right_position in zip(left_common, right_common):
+        codes = np.union1d(_cell_codes(left, left_position), _cell_codes(right, right_position))
+        if len(codes) * 32 > customers:
+            seen = np.zeros(customers, dtype=bool)
+            seen[codes] = True
+            overlap_rows.append(len(overlap_bitmaps))
+            overlap_bitmaps.append(np.packbits(seen))
+            codes = codes[:0]
+        else:
+            overlap_rows.append(-1)
+        overlap_codes.append(codes.astype(np.uint32))
+        overlap_offsets.append(overlap_offsets[-1] + len(codes))
+
+    # Источники ячеек результата: коды и битовые карты левого, правого индекса и общих ячеек
+    # лежат подряд, у каждой ячейки — диапазон в кодах и строка битовой карты (-1 — нет)
+    parts, code_base, bitmap_base = [], 0, 0
+    for index, index_cells, shared in ((left, left_cells, left_common), (right, right_cells, right_common)):
+        alone = np.ones(len(index_cells), dtype=bool)
+        alone[shared] = False
+        rows = np.full(len(index_cells), -1, dtype=np.int64)
+        rows[index.dense_positions] = np.arange(len(index.dense_positions)) + bitmap_base
+        parts.append((index_cells[alone], index.offsets[:-1][alone] + code_base,
+                      index.offsets[1:][alone] + code_base, rows[alone]))
+        code_base += len(index.codes)
+        bitmap_base += len(index.dense_positions)
+    overlap_offsets = np.array(overlap_offsets, dtype=np.int64) + code_base
+    overlap_rows = np.array(overlap_rows, dtype=np.int64)
+    parts.append((common, overlap_offsets[:-1], overlap_offsets[1:],
+                  np.where(overlap_rows >= 0, overlap_rows + bitmap_base, -1)))
+    cells, starts, ends, rows = [np.concatenate(values) for values in zip(*parts)]
+    order = np.argsort(cells, kind='stable')
+    cells, starts, ends, rows = cells[order], starts[order], ends[order], rows[order]
+
+    codes = np.concatenate([left.codes, right.codes] + overlap_codes)[_expand(starts, ends)]
+    offsets = np.zeros(len(cells) + 1, dtype=np.int64)
+    np.cumsum(ends - starts, out=offsets[1:])
+    bitmaps = np.concatenate([
+        np.pad(index.bitmaps, ((0, 0), (0, width - index.bitmaps.shape[1]))) for index in (left, right)
+    ] + [bitmap[None, :] for bitmap in overlap_bitmaps])
+    dense_positions = np.flatnonzero(rows >= 0)
+    return cells, offsets, codes.astype(np.uint32), dense_positions, bitmaps[rows[dense_positions]], customers
+
+
+# Слияние индексов соседних порций строк: ячейки обоих переводятся в общую раскладку осей,
+# так что стоимость зависит от размера индексов, а не от числа строк. Регистры HyperLogLog
+# совпадающих ячеек объединяются максимумом, множества клиентов точного индекса — объединением
+def merge_indexes(left, right):
+    day, gender, age = [np.concatenate([np.asarray(a), np.asarray(b)]) for a, b in zip(left._decode(), right._decode())]
+    first_day, days, genders, ages, cells = _layout(day, gender, age)
+    if isinstance(left, ExactIndex):
+        rollups = {key: tuple(map(merge_indexes, left.rollups[key], right.rollups[key])) for key in left.rollups}
+        return ExactIndex(first_day, days, genders, ages, *_merge_exact(left, right, cells), rollups)
+    registers = np.concatenate([left.registers, right.registers])
+    order = np.argsort(cells, kind='stable')
+    cells, registers = cells[order], registers[order]
+    # Совпадают только ячейки на стыке порций: первая строка каждой ячейки берётся как есть,
+    # повторные вливаются в неё поэлементным максимумом
+    first = np.ones(len(cells), dtype=bool)
+    first[1:] = cells[1:] != cells[:-1]
+    merged = registers[first]
+    np.maximum.at(merged, np.cumsum(first)[~first] - 1, registers[~first])
+    return HllIndex(first_day, days, genders, ages, cells[first], merged)
+
+
+def get_index(snapshot):
+    customers = len(get_dimension(snapshot))
+    return snapshot.aggregate('distinct', lambda frame: data.reduce_chunks(
+        frame,
+        lambda part: build_index(part, customer_codes(snapshot, part), customers),
+        merge_indexes,
+    ))
+
+
+data.register_incremental('distinct', extend_index)
+
+
+# Количество уникальных клиентов за диапазон дат с фильтром по полу и возрасту
+def count_customers(snapshot, start_date, end_date, gender=None, age=None):
+    return get_index(snapshot).count(start_date, end_date, gender=gender, age=age)
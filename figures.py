@@ -0,0 +1,138 @@
+import datetime
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import plotly.io as pio
+
+# Фигуры страниц строятся из шаблонов: plotly express (или go.Figure) вызывается для графика
+# один раз, его JSON с оформлением, подписями и темой сохраняется, а на каждый запрос в копию
+# подставляются только массивы данных — без проверки свойств и сборки объектов plotly.
+# DASHBOARD_FIGURE_TEMPLATES=0 возвращает построение каждой фигуры через plotly
+ENABLED = os.environ.get('DASHBOARD_FIGURE_TEMPLATES', '1') == '1'
+
+# Значение-метка цвета в образце, по которому строится шаблон графика с разбиением по цвету
+SAMPLE = '\x00sample\x00'
+
+# Размер самого крупного маркера, как size_max по умолчанию в px.scatter
+SIZE_MAX = 20
+
+# Поля трассы px, в которые подставляется значение цвета
+GROUP_FIELDS = ('name', 'legendgroup', 'offsetgroup', 'hovertemplate')
+
+_templates = {}
+
+
+# JSON фигуры, построенной build(), по имени графика. Шаблоны общие для всех запросов и не
+# изменяются: фигуры запросов копируют только словари на пути к подставленным значениям
+def template(name, build):
+    figure = _templates.get(name)
+    if figure is None:
+        figure = _templates.setdefault(name, json.loads(pio.to_json(build(), validate=False)))
+    return figure
+
+
+# Массив в значения JSON так же, как его кодирует plotly: пропуски — null, даты — строки ISO
+def values(array):
+    array = np.asarray(array)
+    if array.dtype.kind == 'f' and np.isnan(array).any():
+        return [None if value != value else value for value in array.tolist()]
+    if array.dtype.kind == 'O':
+        return [
+            None if pd.isna(value) else value.isoformat() if isinstance(value, datetime.date) else value
+            for value in array.tolist()
+        ]
+    return array.tolist()
+
+
+def scalar(value):
+    if isinstance(value, np.generic):
+        value = value.item()
+    return None if isinstance(value, float) and value != value else value
+
+
+# Круговая диаграмма px.pie: меняются только подписи и значения
+def pie(name, build, frame, names, values_column):
+    if not ENABLED:
+        return build(frame)
+    figure = template(name, lambda: build(frame.iloc[:0]))
+    trace = dict(figure['data'][0], labels=values(frame[names]), values=values(frame[values_column]))
+    return dict(figure, data=[trace])
+
+
+# Образец для шаблона: одна строка со значением-меткой цвета, в остальных колонках —
+# значение того же вида (число или строка), что и в данных
+def _sample(frame, color, columns):
+    sample = {
+        name: [1] if pd.api.types.is_numeric_dtype(frame[name]) else ['']
+        for name in columns if name != color
+    }
+    sample[color] = [SAMPLE]
+    return pd.DataFrame(sample)
+
+
+# График px с разбиением по цвету (color=...). Как и px, строит трассу на каждое значение цвета
+# в порядке появления с цветом палитры по номеру значения; строки без значения в трассы
+# не попадают, но номер в палитре занимают (кроме случая, когда других значений нет: тогда px
+# не группирует строки и строит одну трассу «nan»). x, y и size — колонки, которые build передаёт в px
+def grouped(name, build, frame, color, x, y, size=None):
+    if not ENABLED:
+        return build(frame)
+    columns = [column for column in (color, x, y, size) if column is not None]
+    figure = template(name, lambda: build(_sample(frame, color, columns)))
+    sample_trace = figure['data'][0]
+    palette = figure['layout']['template']['layout']['colorway']
+
+    codes, uniques = pd.factorize(frame[color], use_na_sentinel=False)
+    x_values, y_values = frame[x].to_numpy(), frame[y].to_numpy()
+    if size is not None:
+        size_values = frame[size].to_numpy()
+        sizeref = scalar(frame[size].max() / SIZE_MAX ** 2)
+
+    traces = []
+    for position, value in enumerate(uniques):
+        if pd.isna(value) and len(uniques) > 1:
+            continue
+        rows = codes == position
+        trace = dict(sample_trace, x=values(x_values[rows]), y=values(y_values[rows]))
+        for field in GROUP_FIELDS:
+            if field in trace:
+                trace[field] = trace[field].replace(SAMPLE, str(value))
+        trace['marker'] = dict(trace['marker'], color=palette[position % len(palette)])
+        if size is not None:
+            trace['marker'].update(size=values(size_values[rows]), sizeref=sizeref)
+        traces.append(trace)
+
+    # Порядок категорий оси px задаёт по значениям колонки, а заголовок легенды — только при трассах
+    layout = figure['layout']
+    if 'categoryarray' in layout['xaxis']:
+        layout = dict(layout, xaxis=dict(layout['xaxis'], categoryarray=values(pd.unique(x_values))))
+    if not traces:
+        layout = dict(layout, legend={key: item for key, item in layout['legend'].items() if key != 'title'})
+    return dict(figure, data=traces, layout=layout)
+
+
+# Индикатор go.Indicator: build(value, reference) строит фигуру, в шаблоне меняются
+# только значение и опорное значение дельты
+def indicator(name, build, value, reference=None):
+    if not ENABLED:
+        return build(value, reference)
+    figure = template(name, lambda: build(0, None if reference is None else 0))
+    trace = dict(figure['data'][0], value=scalar(value))
+    if reference is not None:
+        trace['delta'] = dict(trace['delta'], reference=scalar(reference))
+    return dict(figure, data=[trace])
+
+
+# Фигура из рядов go.Scatter с постоянным оформлением: build(series, **layout) строит её по списку
+# пар (x, y); в шаблоне меняются массивы трасс и поля макета layout (в виде JSON, как их хранит plotly)
+def series(name, build, points, **layout):
+    if not ENABLED:
+        return build(points, **layout)
+    figure = template(name, lambda: build([([], [])] * len(points), **layout))
+    traces = [
+        dict(trace, x=values(x_values), y=values(y_values))
+        for trace, (x_values, y_values) in zip(figure['data'], points)
+    ]
+    return dict(figure, data=traces, layout=dict(figure['layout'], **layout))
@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+
+import data
+from data import DATE_COLUMN
+import metrics
+import partitions
+
+
+# Границы диапазона из DatePickerRange приводятся к целым дням:
+# начальная дата включается с 00:00, конечная — до конца дня
+def day_bounds(start_date, end_date):
+    start = pd.Timestamp(start_date).normalize() if start_date else None
+    end = pd.Timestamp(end_date).normalize() + pd.Timedelta(days=1) if end_date else None
+    return start, end
+
+
+# Окно дат включает все строки снимка с датой и не включает строки без даты: такой запрос
+# можно ответить агрегатом по всему снимку
+def covers_dated(snapshot, start_date, end_date):
+    first_date, last_date = snapshot.date_bounds
+    start, end = day_bounds(start_date, end_date)
+    return first_date is not None and end is not None and end > last_date and (start is None or start <= first_date)
+
+
+# Срез строк за диапазон дат без копирования: датасет отсортирован по дате,
+# поэтому достаточно двух бинарных поисков по колонке Purchase Date
+def date_window(frame, start_date, end_date):
+    dates = frame[DATE_COLUMN].to_numpy()
+    start, end = day_bounds(start_date, end_date)
+    lo = np.searchsorted(dates, start.to_datetime64(), side='left') if start is not None else 0
+    hi = np.searchsorted(dates, end.to_datetime64(), side='left') if end is not None else len(dates)
+    metrics.count_rows(hi - lo)
+    return frame.iloc[lo:hi]
+
+
+# Маски по измерениям. У Categorical выбранные значения один раз переводятся в коды
+# по словарю категорий, и сравниваются только коды строк, без раскодирования строк
+def _equals(column, value):
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        code = column.cat.categories.get_indexer([value])[0]
+        if code < 0:
+            return np.zeros(len(column), dtype=bool)
+        return column.array.codes == code
+    return column.to_numpy() == value
+
+
+def _isin(column, values):
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        codes = column.cat.categories.get_indexer(list(values))
+        # Последний элемент таблицы соответствует коду -1 (пропуск) и остаётся False
+        selected = np.zeros(len(column.cat.categories) + 1, dtype=bool)
+        selected[codes[codes >= 0]] = True
+        return selected[column.array.codes]
+    return column.isin(values).to_numpy()
+
+
+# Фильтр по полу, возрасту и категориям применяется уже к срезу по датам,
+# так что стоимость зависит только от размера выбранного окна
+def apply_predicates(window, gender=None, age=None, categories=None):
+    mask = None
+    if gender:
+        mask = _equals(window['Gender'], gender)
+    if age:
+        age_mask = window['Age'].to_numpy() == age
+        mask = age_mask if mask is None else mask & age_mask
+    if categories:
+        category_mask = _isin(window['Product Category'], categories)
+        mask = category_mask if mask is None else mask & category_mask
+    return window if mask is None else window[mask]
+
+
+# Строки окна дат по месячным разделам снимка (см. partitions.py), если frame — строки текущего
+# снимка; иначе один срез date_window. Хотя бы одна, возможно пустая, часть возвращается всегда
+def _window_parts(frame, start_date, end_date, age=None):
+    snapshot = data.current() if partitions.ENABLED else None
+    if snapshot is None or frame is not snapshot.df:
+        yield date_window(frame, start_date, end_date)
+        return
+    start, end = day_bounds(start_date, end_date)
+    empty = True
+    for part in partitions.get_store(snapshot).window(start, end, age):
+        metrics.count_rows(len(part))
+        empty = False
+        yield part
+    if empty:
+        yield frame.iloc[0:0]
+
+
+def filter_df(frame, start_date, end_date, gender=None, age=None, categories=None):
+    parts = [
+        apply_predicates(window, gender=gender, age=age, categories=categories)
+        for window in _window_parts(frame, start_date, end_date, age)
+    ]
+    return parts[0] if len(parts) == 1 else pd.concat(parts)
+
+
+# Отфильтрованные строки окна порциями (см. data.chunks): построчные представления
+# обрабатывают их по одной, не собирая копию всего окна. Фильтрация каждой порции
+# учитывается в этапе filter коллбэка
+def filter_chunks(frame, start_date, end_date, gender=None, age=None, categories=None):
+    for part in (part for window in _window_parts(frame, start_date, end_date, age) for part in data.chunks(window)):
+        with metrics.phase('filter'):
+            rows = apply_predicates(part, gender=gender, age=age, categories=categories)
+        yield rows
@@ -0,0 +1,102 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import data
+
+# Способ группировки в страницах: bincount (по умолчанию) или pandas — эталон для проверки
+# и сравнения в benchmark.py
+ENGINE = os.environ.get('DASHBOARD_GROUPBY', 'bincount')
+
+# Целые числа и даты кодируются сдвигом от минимума, если их диапазон не шире стольких
+# значений; иначе коды строит pd.factorize
+MAX_SPAN = 1 << 16
+
+
+# Коды значений ключа 0..n-1 и значение для каждого кода. У Categorical коды берутся
+# как есть, пропуски получают отдельный последний код
+def _encode(values):
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes = values.array.codes
+        labels = values.cat.categories
+        if np.any(codes < 0):
+            codes = np.where(codes < 0, len(labels), codes)
+            labels = labels.append(pd.Index([np.nan]))
+        return codes, labels.astype(object)
+    array = values.to_numpy()
+    if array.dtype.kind in 'iuM':
+        ints = array.view(np.int64) if array.dtype.kind == 'M' else array.astype(np.int64, copy=False)
+        lo, hi = ints.min(), ints.max()
+        # NaT — минимальное int64, поэтому колонка дат с пропусками уходит в factorize;
+        # разность считается в целых Python, чтобы она не переполнилась
+        if int(hi) - int(lo) < MAX_SPAN:
+            labels = np.arange(lo, hi + 1)
+            labels = labels.view(array.dtype) if array.dtype.kind == 'M' else labels.astype(array.dtype)
+            return ints - lo, pd.Index(labels)
+    codes, labels = pd.factorize(array, sort=True, use_na_sentinel=False)
+    return codes, pd.Index(labels)
+
+
+def _group_pandas(index, keys, measures, dropna):
+    grouped = pd.DataFrame(measures, index=index).groupby(keys, dropna=dropna, observed=True)
+    result = grouped.sum()
+    result.insert(0, 'size', grouped.size())
+    return data.with_labels(result)
+
+
+# Число строк и суммы мер по сочетаниям значений ключей за один проход np.bincount по
+# номерам ячеек (ravel_multi_index кодов ключей). Ключи by — имена колонок frame или Series
+# с тем же индексом, меры — словарь имя → колонка или массив (например, маска оттока).
+# Результат совпадает с groupby(by, observed=True).agg: колонка size и суммы мер (пропуски
+# не учитываются, целые суммы остаются целыми), строки только для встреченных сочетаний,
+# в порядке значений ключей
+def group(frame, by, measures=None, dropna=True, engine=None):
+    keys = [frame[key] if isinstance(key, str) else key for key in ([by] if isinstance(by, str) else by)]
+    measures = {
+        name: frame[values].to_numpy() if isinstance(values, str) else np.asarray(values)
+        for name, values in (measures or {}).items()
+    }
+    if (engine or ENGINE) == 'pandas' or len(frame) == 0:
+        return _group_pandas(frame.index, keys, measures, dropna)
+
+    encoded = [_encode(key) for key in keys]
+    shape = tuple(len(labels) for _, labels in encoded)
+    cells = encoded[0][0] if len(keys) == 1 else np.ravel_multi_index([codes for codes, _ in encoded], shape)
+    cell_count = int(np.prod(shape))
+    counts = np.bincount(cells, minlength=cell_count)
+    observed = np.flatnonzero(counts)
+    level_codes = np.unravel_index(observed, shape)
+    if dropna:
+        keep = np.ones(len(observed), dtype=bool)
+        for codes, (_, labels) in zip(level_codes, encoded):
+            keep &= ~pd.isna(labels).take(codes)
+        observed = observed[keep]
+        level_codes = [codes[keep] for codes in level_codes]
+
+    columns = {'size': counts[observed].astype(np.int64)}
+    for name, values in measures.items():
+        weights = np.where(np.isnan(values), 0, values) if values.dtype.kind == 'f' else values
+        sums = np.bincount(cells, weights=weights, minlength=cell_count)[observed]
+        # Суммы целых в float64 точны до 2**53 и возвращаются целыми, как у pandas
+        columns[name] = sums.astype(np.int64) if values.dtype.kind in 'iub' else sums
+
+    arrays = [labels.take(codes) for codes, (_, labels) in zip(level_codes, encoded)]
+    names = [key.name for key in keys]
+    if len(keys) == 1:
+        index = pd.Index(arrays[0], name=names[0])
+    else:
+        index = pd.MultiIndex.from_arrays(arrays, names=names)
+    result = pd.DataFrame(columns, index=index)
+    # Категории, дописанные при обновлении данных, стоят в конце словаря
+    return result if index.is_monotonic_increasing else result.sort_index()
+
+
+# Число строк по сочетаниям значений колонок (как groupby(columns).size()), посчитанное по порциям
+def group_sizes(frame, columns):
+    return data.reduce_chunks(frame, lambda part: group(part, columns)['size'], merge_sizes)
+
+
+# Сумма двух результатов group_sizes, например по снимку и по дописанным к нему строкам
+def merge_sizes(left, right):
+    return left.add(right, fill_value=0).astype(np.int64)
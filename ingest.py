@@ -0,0 +1,73 @@
+import io
+import logging
+import os
+import threading
+
+import pandas as pd
+
+import cache
+import data
+import precompute
+
+# Период опроса CSV в секундах; 0 отключает наблюдение за файлом
+INTERVAL = float(os.environ.get('DASHBOARD_WATCH_INTERVAL', 5))
+
+logger = logging.getLogger(__name__)
+
+
+# Файл после снимка только дописывали: он не короче, и байты перед смещением снимка
+# не изменились (см. data.tail_hash)
+def is_appended(csv_path, snapshot):
+    if os.path.getsize(csv_path) < snapshot.offset:
+        return False
+    return data.tail_hash(csv_path, snapshot.offset) == snapshot.source[1]['tail']
+
+
+# Читает только байты, дописанные после снимка, до последнего полного перевода строки
+def read_appended(csv_path, snapshot):
+    size = os.path.getsize(csv_path)
+    if size <= snapshot.offset:
+        return None, snapshot.offset
+    with open(csv_path, 'rb') as f:
+        f.seek(snapshot.offset)
+        chunk = f.read(size - snapshot.offset)
+    end = chunk.rfind(b'\n') + 1
+    if end == 0:
+        return None, snapshot.offset
+    rows = pd.read_csv(io.BytesIO(chunk[:end]), sep=',', header=None, names=list(snapshot.df.columns))
+    rows[data.DATE_COLUMN] = pd.to_datetime(rows[data.DATE_COLUMN])
+    return rows, snapshot.offset + end
+
+
+def poll(csv_path=data.CSV_PATH):
+    snapshot = data.current()
+    if not is_appended(csv_path, snapshot):
+        # Файл перезаписан: дописывать нечего, снимок собирается заново
+        updated = data.load_snapshot(csv_path)
+    else:
+        rows, offset = read_appended(csv_path, snapshot)
+        if rows is None:
+            return snapshot
+        updated = snapshot.extend(rows, offset, data.tail_hash(csv_path, offset))
+    data.publish(updated)
+    cache.drop_stale(updated.version)
+    precompute.warm_up()
+    logger.info('dataset updated to version %s (%d rows)', updated.version, len(updated.df))
+    return updated
+
+
+def _watch(csv_path, interval, stop):
+    while not stop.wait(interval):
+        try:
+            poll(csv_path)
+        except Exception:
+            logger.exception('failed to ingest appended rows from %s', csv_path)
+
+
+# Запускает фоновый поток наблюдения; возвращает Event для остановки или None, если отключено
+def start_watcher(csv_path=data.CSV_PATH, interval=INTERVAL):
+    if interval <= 0:
+        return None
+    stop = threading.Event()
+    threading.Thread(target=_watch, args=(csv_path, interval, stop), name='csv-watcher', daemon=True).start()
+    return stop
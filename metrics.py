@@ -0,0 +1,233 @@
+import cProfile
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+import flask
+
+logger = logging.getLogger(__name__)
+
+# Порог в миллисекундах, выше которого профиль запроса сохраняется в PROFILE_DIR; не задан — профилирование выключено.
+# DASHBOARD_PROFILER=pyinstrument использует pyinstrument (если установлен) вместо cProfile
+PROFILE_MS = float(os.environ['DASHBOARD_PROFILE_MS']) if os.environ.get('DASHBOARD_PROFILE_MS') else None
+PROFILE_DIR = os.environ.get('DASHBOARD_PROFILE_DIR', 'profiles')
+PROFILER = os.environ.get('DASHBOARD_PROFILER', 'cprofile')
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram:
+    def __init__(self, name, help, labels, buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._series.items()):
+                labels = _labels(self.labels, label_values)
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{{{labels},le="{bound:g}"}} {bucket_count}')
+                lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {count}')
+                lines.append(f'{self.name}_sum{{{labels}}} {total:.6f}')
+                lines.append(f'{self.name}_count{{{labels}}} {count}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{{{_labels(self.labels, label_values)}}} {value}')
+        return lines
+
+
+def _labels(names, values):
+    return ','.join(f'{name}="{value}"' for name, value in zip(names, values))
+
+
+callback_seconds = Histogram('dashboard_callback_seconds', 'Время выполнения коллбэка', ('callback',), SECONDS_BUCKETS)
+phase_seconds = Histogram('dashboard_phase_seconds', 'Время этапа коллбэка', ('callback', 'phase'), SECONDS_BUCKETS)
+response_bytes = Histogram('dashboard_response_bytes', 'Размер ответа коллбэка', ('callback',), BYTES_BUCKETS)
+rows_scanned = Counter('dashboard_rows_scanned_total', 'Строки, просмотренные фильтрами', ('callback',))
+slow_requests = Counter('dashboard_slow_requests_total', 'Запросы дольше порога профилирования', ('callback',))
+part_seconds = Histogram('dashboard_part_seconds', 'Время независимой части коллбэка', ('callback', 'part'), SECONDS_BUCKETS)
+
+# Блокировки метрик могли быть захвачены потоками родителя в момент fork (см. cache._reset_after_fork)
+def _reset_after_fork():
+    for metric in (callback_seconds, phase_seconds, response_bytes, rows_scanned, slow_requests, part_seconds):
+        metric._lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+# Длительность этапов запуска процесса в секундах (см. app.py)
+startup = {}
+
+# Имя выполняемого коллбэка в текущем потоке; этапы и счётчики строк относятся к нему
+_local = threading.local()
+
+
+def _callback_name():
+    return getattr(_local, 'callback', None) or 'other'
+
+
+def current_callback():
+    return getattr(_local, 'callback', None)
+
+
+# Части коллбэка в потоках пула (см. parallel.py) записывают этапы и строки в коллбэк,
+# который их запустил
+@contextmanager
+def context(name):
+    previous = getattr(_local, 'callback', None)
+    _local.callback = name
+    try:
+        yield
+    finally:
+        _local.callback = previous
+
+
+@contextmanager
+def phase(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        phase_seconds.observe(time.perf_counter() - started, _callback_name(), name)
+
+
+def count_rows(rows):
+    rows_scanned.inc(rows, _callback_name())
+
+
+def _start_profiler():
+    if PROFILER == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            logger.warning('pyinstrument is not installed, falling back to cProfile')
+        else:
+            profiler = Profiler()
+            profiler.start()
+            return profiler
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def _dump_profile(profiler, name, elapsed):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stem = os.path.join(PROFILE_DIR, f'{time.strftime("%Y%m%d-%H%M%S")}-{name}-{elapsed * 1000:.0f}ms')
+    if isinstance(profiler, cProfile.Profile):
+        profiler.dump_stats(stem + '.prof')
+        path = stem + '.prof'
+    else:
+        path = stem + '.html'
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(profiler.output_html())
+    logger.warning('slow callback %s took %.0f ms, profile saved to %s', name, elapsed * 1000, path)
+
+
+# Декоратор для коллбэков страниц: общее время, а при включённом профилировании — дамп медленных вызовов.
+# Вложенные вызовы (общие этапы) учитываются в коллбэке верхнего уровня
+def instrument(func):
+    name = f'{func.__module__}.{func.__qualname__}'
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if getattr(_local, 'callback', None) is not None:
+            return func(*args, **kwargs)
+        _local.callback = name
+        profiler = _start_profiler() if PROFILE_MS is not None else None
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            _local.callback = None
+            callback_seconds.observe(elapsed, name)
+            if profiler is not None:
+                if isinstance(profiler, cProfile.Profile):
+                    profiler.disable()
+                else:
+                    profiler.stop()
+                if elapsed * 1000 >= PROFILE_MS:
+                    slow_requests.inc(1, name)
+                    _dump_profile(profiler, name, elapsed)
+            # Сериализацию в JSON Dash выполняет после возврата из коллбэка; её время и размер
+            # ответа досчитываются в after_request
+            if flask.has_request_context():
+                flask.g.metrics_callback = name
+                flask.g.metrics_returned = time.perf_counter()
+
+    return wrapper
+
+
+def _after_request(response):
+    name = flask.g.get('metrics_callback')
+    if name is not None:
+        phase_seconds.observe(time.perf_counter() - flask.g.metrics_returned, name, 'serialize')
+        if response.content_length is not None:
+            response_bytes.observe(response.content_length, name)
+    return response
+
+
+def render():
+    import cache
+    import data
+
+    lines = []
+    for metric in (callback_seconds, phase_seconds, response_bytes, rows_scanned, slow_requests, part_seconds):
+        lines.extend(metric.render())
+    stats = cache.results.stats()
+    for key, kind in (('hits', 'counter'), ('misses', 'counter'), ('evictions', 'counter'),
+                      ('entries', 'gauge'), ('bytes', 'gauge'), ('max_bytes', 'gauge')):
+        suffix = '_total' if kind == 'counter' else ''
+        lines.append(f'# TYPE dashboard_cache_{key}{suffix} {kind}')
+        lines.append(f'dashboard_cache_{key}{suffix} {stats[key]}')
+    lines.append('# TYPE dashboard_startup_seconds gauge')
+    for stage, seconds in list(startup.items()):
+        lines.append(f'dashboard_startup_seconds{{stage="{stage}"}} {seconds:.6f}')
+    if data.ready():
+        lines.append('# TYPE dashboard_dataset_rows gauge')
+        lines.append(f'dashboard_dataset_rows {len(data.current().df)}')
+    return '\n'.join(lines) + '\n'
+
+
+# Маршрут /metrics в текстовом формате Prometheus. Метрики собираются в каждом процессе
+# отдельно, под gunicorn каждый воркер отдаёт свои значения
+def register(server):
+    server.after_request(_after_request)
+    server.add_url_rule('/metrics', 'metrics', lambda: flask.Response(render(), mimetype='text/plain; version=0.0.4'))
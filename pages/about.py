@@ -17,7 +17,7 @@ layout = dbc.Container([
     
     html.H3("Структура проекта", className='mt-4'),
     html.Ul([
-        html.Li("data.py: Содержит датасет df, используемый в приложении."),
+        html.Li("data.py: Загружает датасет и публикует его снимки, используемые в приложении."),
         html.Li("app.py: Основной файл приложения Dash."),
         html.Li("pages/: Каталог, содержащий файлы с определениями страниц (home.py, clients.py, purchase.py, about.py).")
     ]),
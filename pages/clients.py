@@ -2,74 +2,208 @@ from dash import html, dcc, callback, Output, Input
 import dash_bootstrap_components as dbc
 import plotly.express as px
 import plotly.graph_objects as go
-import pandas as pd
-from data import df
-
-
-layout = dbc.Container([
-    html.H1("Анализ клиентов", className='text-center my-4'),
-
-    # Селекторы в одну строку с отступами
-    dbc.Row([
-        dbc.Col([
-            html.Label("Выберите диапазон дат:", className='d-block'),
-            dcc.DatePickerRange(
-                id='date-picker-range',
-                start_date=df['Purchase Date'].min(),
-                end_date=df['Purchase Date'].max(),
-                display_format='YYYY-MM-DD',
-                className='d-block'
-            ),
-        ], id='left-align', width=4, className='me-3'),  
-
-        dbc.Col([
-            html.Label("Выберите пол:", className='d-block'),
-            dcc.Dropdown(
-                id='gender-dropdown',
-                options=[
-                    {'label': 'Мужчина', 'value': 'Мужчина'},
-                    {'label': 'Женщина', 'value': 'Женщина'}
-                ],
-                multi=False,
-                placeholder="Select...",
-                className='d-block',
-                style={'width': '150px'}  
-            ),
-        ], id='center-align', width='auto', className='me-3'),  
-
-        dbc.Col([
-            html.Label("Введите возраст:", className='d-block'),
-            dcc.Input(
-                id='age-input',
-                type='number',
-                placeholder='Введите возраст',
-                className='d-block'
-            ),
-        ], id='right-align', width=4)
-    ], className='mb-3 align-items-end g-0'),  
-
-    # Столбчатая диаграмма по возрасту клиентов
-    dbc.Row([
-        dbc.Col(dcc.Graph(id='age-bar-chart'), width=12, className='p-0')
-    ], className='mt-3 g-0'),
-
-
-    dbc.Row([
-        dbc.Col(dcc.Graph(id='gender-pie-chart'), width=4, className='p-0'),
-        dbc.Col(dcc.Graph(id='churn-bar-chart'), width=8, className='p-0'),
-    ], className='mt-3 g-0'), 
-
-    dbc.Row([
-        dbc.Col([
-            html.H3("Топ-5 клиентов по выручке", className='text-center my-4'),
-            dbc.Table(id='top-customers-table', bordered=True, striped=True, hover=True, responsive=True)
-        ], width=4, className='mr-3'),
-        dbc.Col([
-            html.H3("Топ-5 клиентов по возвратам", className='text-center my-4'),
-            dbc.Table(id='top-5-returns-table', striped=True, bordered=True, hover=True)
-        ], width=4, className='mr-3')  
-    ]), 
-], fluid=True) 
+from data import current, dimension_options, layout_metadata
+from cache import filter_key, memoize
+import background
+import cube
+import metrics
+import data
+import figures
+import grouping
+import parallel
+import precompute
+from customers import CustomerTotals, get_totals
+from filters import covers_dated, filter_chunks
+
+
+# Макет строится из метаданных датасета, как на главной странице
+def layout():
+    metadata = layout_metadata()
+    first_date, last_date = metadata['first_date'], metadata['last_date']
+
+    return dbc.Container([
+        html.H1("Анализ клиентов", className='text-center my-4'),
+
+        # Селекторы в одну строку с отступами
+        dbc.Row([
+            dbc.Col([
+                html.Label("Выберите диапазон дат:", className='d-block'),
+                dcc.DatePickerRange(
+                    id='date-picker-range',
+                    start_date=first_date,
+                    end_date=last_date,
+                    display_format='YYYY-MM-DD',
+                    className='d-block'
+                ),
+            ], id='left-align', width=4, className='me-3'),  
+
+            dbc.Col([
+                html.Label("Выберите пол:", className='d-block'),
+                dcc.Dropdown(
+                    id='gender-dropdown',
+                    options=dimension_options('Gender', metadata['dimensions']['Gender']),
+                    multi=False,
+                    placeholder="Select...",
+                    className='d-block',
+                    style={'width': '150px'}  
+                ),
+            ], id='center-align', width='auto', className='me-3'),  
+
+            dbc.Col([
+                html.Label("Введите возраст:", className='d-block'),
+                dcc.Input(
+                    id='age-input',
+                    type='number',
+                    placeholder='Введите возраст',
+                    debounce=background.INPUT_DEBOUNCE,
+                    className='d-block'
+                ),
+            ], id='right-align', width=4)
+        ], className='mb-3 align-items-end g-0'),  
+
+        # Столбчатая диаграмма по возрасту клиентов
+        dbc.Row([
+            dbc.Col(dcc.Graph(id='age-bar-chart'), width=12, className='p-0')
+        ], className='mt-3 g-0'),
+
+
+        dbc.Row([
+            dbc.Col(dcc.Graph(id='gender-pie-chart'), width=4, className='p-0'),
+            dbc.Col(dcc.Graph(id='churn-bar-chart'), width=8, className='p-0'),
+        ], className='mt-3 g-0'), 
+
+        dbc.Row([
+            dbc.Col([
+                html.H3("Топ-5 клиентов по выручке", className='text-center my-4'),
+                dbc.Table(id='top-customers-table', bordered=True, striped=True, hover=True, responsive=True)
+            ], width=4, className='mr-3'),
+            dbc.Col([
+                html.H3("Топ-5 клиентов по возвратам", className='text-center my-4'),
+                dbc.Table(id='top-5-returns-table', striped=True, bordered=True, hover=True)
+            ], width=4, className='mr-3')  
+        ]), 
+    ], fluid=True) 
+
+# Распределения по возрасту и полу: число строк по значениям во всём датасете. Агрегаты
+# переносятся в снимок с дописанными строками и дополняются только по новым строкам
+def age_gender_sizes(snapshot):
+    return snapshot.aggregate('clients.age_gender_sizes', lambda frame: grouping.group_sizes(frame, ['Age', 'Gender']))
+
+def gender_sizes(snapshot):
+    return snapshot.aggregate('clients.gender_sizes', lambda frame: grouping.group_sizes(frame, 'Gender'))
+
+data.register_incremental('clients.age_gender_sizes', lambda value, rows, snapshot: grouping.merge_sizes(
+    value, grouping.group_sizes(rows, ['Age', 'Gender'])))
+data.register_incremental('clients.gender_sizes', lambda value, rows, snapshot: grouping.merge_sizes(
+    value, grouping.group_sizes(rows, 'Gender')))
+
+# Столбчатая диаграмма по возрасту клиентов
+def build_age_bar_chart(sizes):
+    age_gender_df = data.localize(sizes).reset_index(name='Count')
+    return px.bar(
+        age_gender_df,
+        x='Age',
+        y='Count',
+        color='Gender',
+        barmode='stack',
+        title='Распределение клиентов по возрасту',
+        labels={
+            'Age': 'Возраст',
+            'Count': 'Количество',
+            'Gender': 'Пол',
+        }
+    )
+
+# Круговая диаграмма с распределением клиентов по полу
+def build_gender_pie_chart(sizes):
+    gender_count = data.localize(sizes).sort_values(ascending=False).reset_index()
+    gender_count.columns = ['Gender', 'Count']
+    return px.pie(gender_count,
+        names='Gender',
+        values='Count',
+        title='Распределение клиентов по полу',
+        labels={
+            'Count': 'Количество',
+            'Gender': 'Пол',
+        },
+        hole=0.3)
+
+# Столбчатая диаграмма оттока клиентов по возрасту
+def build_churn_bar_chart(frame):
+    return px.bar(frame, x='Age',
+    y='Count',
+    color='Gender', 
+    barmode='stack',
+    labels={
+        'Age': 'Возраст',
+        'Count': 'Количество',
+        'Gender': 'Пол',
+    },
+    title='Отток клиентов по возрасту')
+
+# Отток по возрасту: из куба, а при отключённом кубе — по отфильтрованным строкам порциями
+# (в обычном режиме — одной)
+def churn_bar_chart(start_date, end_date, selected_gender, selected_age):
+    snapshot = current()
+    if cube.ENABLED:
+        with metrics.phase('aggregate'):
+            churn_age = cube.get_cube(snapshot).by_age_gender('churn', start_date, end_date, gender=selected_gender, age=selected_age)
+            churn_age = churn_age[churn_age > 0]
+    else:
+        churn_counts = []
+        for filtered_df in filter_chunks(snapshot.df, start_date, end_date, gender=selected_gender, age=selected_age):
+            with metrics.phase('aggregate'):
+                churn = grouping.group(filtered_df, ['Age', 'Gender'], {'churned': filtered_df['Churn'].to_numpy() == 1})
+                churn_counts.append(churn.loc[churn['churned'] > 0, 'churned'])
+        with metrics.phase('aggregate'):
+            churn_age = churn_counts[0]
+            for counts in churn_counts[1:]:
+                churn_age = churn_age.add(counts, fill_value=0).astype(churn_age.dtype)
+
+    with metrics.phase('aggregate'):
+        churn_age_df = data.localize(churn_age).reset_index(name='Count')
+
+    with metrics.phase('figure'):
+        # Столбчатая диаграмма по оттоку клиентов из шаблона (см. figures.py)
+        return figures.grouped('clients.churn_bar_chart', build_churn_bar_chart, churn_age_df, 'Gender', 'Age', 'Count')
+
+# Топ-5 клиентов по сумме покупок и по возвратам: отфильтрованные строки обрабатываются порциями,
+# суммы по клиентам копятся без копии всего окна. Для всего диапазона без фильтров суммы
+# берутся из агрегата снимка
+def top_tables(start_date, end_date, selected_gender, selected_age):
+    snapshot = current()
+    if not selected_gender and not selected_age and covers_dated(snapshot, start_date, end_date):
+        with metrics.phase('aggregate'):
+            totals = get_totals(snapshot)
+    else:
+        totals = CustomerTotals(snapshot, ['Total Purchase Amount', 'Returns'])
+        for filtered_df in filter_chunks(snapshot.df, start_date, end_date, gender=selected_gender, age=selected_age):
+            with metrics.phase('aggregate'):
+                totals.add(filtered_df)
+
+    with metrics.phase('aggregate'):
+        top_customers_df = totals.top('Total Purchase Amount', k=5)
+        top_5_returns = totals.top('Returns', k=5)
+
+    with metrics.phase('figure'):
+        # Таблица топ-5 клиентов
+        table_header_Purchase = [
+            html.Thead(html.Tr([html.Th("Имя покупателя"), html.Th("Общая сумма покупок")]))
+        ]
+        table_body_Purchase = [
+            html.Tbody([
+                html.Tr([html.Td(name), html.Td(f"{amount:.2f}")])
+                for name, amount in zip(top_customers_df['Customer Name'], top_customers_df['Total Purchase Amount'])
+            ])
+        ]
+
+        # Таблица с топ-5 клиентов по возвратам
+        table_header_Returns = [html.Thead(html.Tr([html.Th("Имя покупателя"), html.Th("Количество возвратов")]))]
+        rows = [html.Tr([html.Td(name), html.Td(returns)]) for name, returns in zip(top_5_returns['Customer Name'], top_5_returns['Returns'])]
+        table_body_Returns = [html.Tbody(rows)]
+
+
+    return table_header_Purchase + table_body_Purchase, table_header_Returns + table_body_Returns
 
 # Коллбэк для обновления графиков на основе селекторов
 @callback(
@@ -81,87 +215,32 @@ layout = dbc.Container([
     [Input('date-picker-range', 'start_date'),
      Input('date-picker-range', 'end_date'),
      Input('gender-dropdown', 'value'),
-     Input('age-input', 'value')]
+     Input('age-input', 'value')],
+    **background.options(),
 )
+@metrics.instrument
+@memoize(key=filter_key)
 def update_graphs(start_date, end_date, selected_gender, selected_age):
-    # Фильтрация данных
-    filtered_df = df[
-        (df['Purchase Date'] >= start_date) &
-        (df['Purchase Date'] <= end_date)
-    ]
-    
-    if selected_gender:
-        filtered_df = filtered_df[filtered_df['Gender'] == selected_gender]
-    
-
-    # Столбчатая диаграмма по возрасту клиентов
-    age_gender_df = df.groupby(['Age', 'Gender']).size().reset_index(name='Count') 
-    age_bar_chart = px.bar(
-    age_gender_df,
-    x='Age',
-    y='Count',
-    color='Gender',
-    barmode='stack',
-    title='Распределение клиентов по возрасту',
-    labels={
-        'Age': 'Возраст',
-        'Count': 'Количество',
-        'Gender': 'Пол',
-    }
-)
-
-    # Круговая диаграмма с распределением клиентов по полу
-    gender_count = df['Gender'].value_counts().reset_index()  
-    gender_count.columns = ['Gender', 'Count']
-    gender_pie_chart = px.pie(gender_count, 
-    names='Gender', 
-    values='Count', 
-    title='Распределение клиентов по полу',
-        labels={
-        'Count': 'Количество',
-        'Gender': 'Пол',
-    }, 
-    hole=0.3)
-
-    # Фильтрация данных по возрасту для диаграммы по оттоку клиентов
-    if selected_age:
-        filtered_df = filtered_df[filtered_df['Age'] == selected_age]
-
-    # Столбчатая диаграмма по оттоку клиентов
-    churn_age_df = filtered_df[filtered_df['Churn'] == 1].groupby(['Age', 'Gender']).size().reset_index(name='Count')
-    churn_bar_chart = px.bar(churn_age_df, x='Age',
-    y='Count',
-    color='Gender', 
-    barmode='stack',
-    labels={
-        'Age': 'Возраст',
-        'Count': 'Количество',
-        'Gender': 'Пол',
-    },
-    title='Отток клиентов по возрасту')
-
-    # Таблица топ-5 клиентов
-    top_customers_df = filtered_df.groupby(['Customer ID', 'Customer Name'])['Total Purchase Amount'].sum().reset_index()
-    top_customers_df = top_customers_df.sort_values(by='Total Purchase Amount', ascending=False).head(5)
+    # Распределения по возрасту и полу строятся по всему датасету и не зависят от фильтров
+    age_bar_chart = precompute.invariant_figure(
+        'clients.age_bar_chart', lambda snapshot: build_age_bar_chart(age_gender_sizes(snapshot)))
+    gender_pie_chart = precompute.invariant_figure(
+        'clients.gender_pie_chart', lambda snapshot: build_gender_pie_chart(gender_sizes(snapshot)))
 
-    table_header_Purchase = [
-        html.Thead(html.Tr([html.Th("Имя покупателя"), html.Th("Общая сумма покупок")]))
-    ]
-    table_body_Purchase = [
-        html.Tbody([
-            html.Tr([html.Td(row['Customer Name']), html.Td(f"{row['Total Purchase Amount']:.2f}")])
-            for _, row in top_customers_df.iterrows()
-        ])
-    ]
+    # Таблицы и график оттока независимы и могут считаться одновременно (см. parallel.py);
+    # таблицам нужен проход по строкам, поэтому они идут первыми
+    inputs = (start_date, end_date, selected_gender, selected_age)
+    parts = parallel.run({
+        'top_tables': (top_tables, *inputs),
+        'churn_bar_chart': (churn_bar_chart, *inputs),
+    })
+    purchase_table, returns_table = parts['top_tables']
 
-    # Таблица с топ-5 клиентов по возвратам
-    returns_by_customer = filtered_df.groupby('Customer ID')['Returns'].sum().reset_index()
-    top_5_returns = returns_by_customer.sort_values(by='Returns', ascending=False).head(5)
-    top_5_returns = pd.merge(top_5_returns, df[['Customer ID', 'Customer Name']].drop_duplicates(), on='Customer ID')
+    return age_bar_chart, gender_pie_chart, parts['churn_bar_chart'], purchase_table, returns_table
 
-    table_header_Returns = [html.Thead(html.Tr([html.Th("Имя покупателя"), html.Th("Количество возвратов")]))]
-    rows = [html.Tr([html.Td(row['Customer Name']), html.Td(row['Returns'])]) for index, row in top_5_returns.iterrows()]
-    table_body_Returns = [html.Tbody(rows)]
 
+def default_inputs():
+    first_date, last_date = current().date_bounds
+    return first_date, last_date, None, None
 
-    return age_bar_chart, gender_pie_chart, churn_bar_chart, table_header_Purchase + table_body_Purchase, table_header_Returns + table_body_Returns
+precompute.register_default(update_graphs, default_inputs)
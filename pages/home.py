@@ -1,139 +1,385 @@
-from dash import html, dcc, callback, Output, Input
+from dash import html, dcc, callback, clientside_callback, ctx, no_update, ClientsideFunction, Output, Input
 import dash_bootstrap_components as dbc
 import plotly.express as px
 import plotly.graph_objects as go
+import numpy as np
 import pandas as pd
-from data import df
-
-gender_map = {'Male': 'Мужчина', 'Female': 'Женщина'}
-df['Gender'] = df['Gender'].map(gender_map)
-
-category_map = {'Books': 'Книги', 'Clothing': 'Одежда', 'Home': 'Дом', 'Electronics': 'Электроника'}
-df['Product Category'] = df['Product Category'].map(category_map)
-
-layout = dbc.Container([
-    html.H1("Главная", className='text-center my-4'),
-
-    # Селекторы в одну строку
-    dbc.Row([
-        dbc.Col([
-            html.Label("Выберите диапазон дат:", className='d-block'),
-            dcc.DatePickerRange(
-                id='date-picker-range',
-                start_date=df['Purchase Date'].min(),
-                end_date=df['Purchase Date'].max(),
-                display_format='YYYY-MM-DD',
-                className='d-block'
-            ),
-        ], width=4, className='me-3'),
-
-        dbc.Col([
-            html.Label("Выберите пол:", className='d-block'),
-            dcc.Dropdown(
-                id='gender-dropdown',
-                options=[
-                    {'label': 'Мужчина', 'value': 'Мужчина'},
-                    {'label': 'Женщина', 'value': 'Женщина'}
-                ],
-                multi=False,
-                placeholder="Select...",
-                className='d-block'
-            ),
-        ], width=3, className='me-3'),
-
-        dbc.Col([
-            html.Label("Введите возраст:", className='d-block'),
-            dcc.Input(
-                id='age-input',
-                type='number',
-                placeholder='Введите возраст',
-                className='d-block'
-            ),
-        ], width=4)
-    ], className='mb-3 align-items-end g-0'),
-
-    html.H1("Общая информация", className='text-center'),
-    # Индикаторы
-    dbc.Row([
-        dbc.Col(dcc.Graph(id='total-customers'), width=4, className='p-0'),
-        dbc.Col(dcc.Graph(id='total-revenue'), width=4, className='p-0'),
-        dbc.Col(dcc.Graph(id='churn-rate'), width=4, className='p-0'),
-    ], className='g-0'),
-    
-    # График выручки по дням
-   dbc.Row([
-        dbc.Col(dcc.Graph(id='revenue-by-date'), width=12, className='p-0')
-    ], className='mt-3 g-0'),
-
-    # Круговая диаграмма с процентом возвратов
-     dbc.Row([
-        dbc.Col(dcc.Graph(id='returns-pie-chart'), width=6, className='p-0', style={'margin': '0 auto', 'textAlign': 'center'})
-    ], className='mt-3 g-0')
-], fluid=True)
-
-@callback(
-    [Output('total-customers', 'figure'),
-     Output('total-revenue', 'figure'),
-     Output('churn-rate', 'figure'),
-     Output('revenue-by-date', 'figure'),
-     Output('returns-pie-chart', 'figure')],
-    [Input('date-picker-range', 'start_date'),
-     Input('date-picker-range', 'end_date'),
-     Input('gender-dropdown', 'value'),
-     Input('age-input', 'value')]
-)
-def update_indicators_and_graph(start_date, end_date, selected_gender, selected_age):
-    # Фильтрация данных
-    filtered_df = df[
-        (df['Purchase Date'] >= start_date) &
-        (df['Purchase Date'] <= end_date)
-    ]
-    
-    if selected_gender:
-        filtered_df = filtered_df[filtered_df['Gender'] == selected_gender]
-    
-    if selected_age:
-        filtered_df = filtered_df[filtered_df['Age'] == selected_age]
-    
-    # Общее количество клиентов
-    total_customers = filtered_df['Customer ID'].nunique()
-    total_customers_fig = go.Figure(go.Indicator(
-        mode = "number",
-        value = total_customers,
-        title = {"text": "Кол-во клиентов"}
-    ))
+from data import current, dimension_options, layout_metadata
+from cache import filter_key, memoize
+from filters import day_bounds, filter_df
+import background
+import clientside
+import cube
+import distinct
+import figures
+import metrics
+import parallel
+import precompute
+import timeseries
 
-    # Выручка
-    total_revenue = filtered_df['Total Purchase Amount'].sum()
-    total_revenue_fig = go.Figure(go.Indicator(
-        mode = "number",
-        value = total_revenue,
-        title = {"text": "Выручка"}
-    ))
+# Макет строится при каждом открытии страницы из метаданных датасета (границы дат и значения
+# измерений), поэтому страница открывается, даже пока сам датасет ещё загружается
+def layout():
+    metadata = layout_metadata()
+    first_date, last_date = metadata['first_date'], metadata['last_date']
 
-    # Отток клиентов
-    churn_rate = (filtered_df['Churn'].sum() / len(filtered_df)) * 100 if len(filtered_df) > 0 else 0
-    churn_rate_fig = go.Figure(go.Indicator(
-        mode = "number",
-        value = churn_rate,
-        title = {"text": "Отток клиентов (%)"}
-    ))
+    return dbc.Container([
+        html.H1("Главная", className='text-center my-4'),
+
+        # Селекторы в одну строку
+        dbc.Row([
+            dbc.Col([
+                html.Label("Выберите диапазон дат:", className='d-block'),
+                dcc.DatePickerRange(
+                    id='date-picker-range',
+                    start_date=first_date,
+                    end_date=last_date,
+                    display_format='YYYY-MM-DD',
+                    className='d-block'
+                ),
+            ], width=4, className='me-3'),
+
+            dbc.Col([
+                html.Label("Выберите пол:", className='d-block'),
+                dcc.Dropdown(
+                    id='gender-dropdown',
+                    options=dimension_options('Gender', metadata['dimensions']['Gender']),
+                    multi=False,
+                    placeholder="Select...",
+                    className='d-block'
+                ),
+            ], width=3, className='me-3'),
+
+            dbc.Col([
+                html.Label("Введите возраст:", className='d-block'),
+                dcc.Input(
+                    id='age-input',
+                    type='number',
+                    placeholder='Введите возраст',
+                    debounce=background.INPUT_DEBOUNCE,
+                    className='d-block'
+                ),
+            ], width=4)
+        ], className='mb-3 align-items-end g-0'),
+
+        html.H1("Общая информация", className='text-center'),
+        # Индикаторы
+        dbc.Row([
+            dbc.Col(dcc.Graph(id='total-customers'), width=4, className='p-0'),
+            dbc.Col(dcc.Graph(id='total-revenue'), width=4, className='p-0'),
+            dbc.Col(dcc.Graph(id='churn-rate'), width=4, className='p-0'),
+        ], className='g-0'),
     
-    revenue_by_date_df = filtered_df.groupby(pd.to_datetime(filtered_df['Purchase Date']).dt.date)['Total Purchase Amount'].sum().reset_index()
-    revenue_by_date_fig = go.Figure(
-        data=go.Scatter(x=revenue_by_date_df['Purchase Date'], y=revenue_by_date_df['Total Purchase Amount'], mode='lines+markers'),
+        # График выручки по дням
+       dbc.Row([
+            dbc.Col(dcc.Graph(id='revenue-by-date'), width=12, className='p-0')
+        ], className='mt-3 g-0'),
+
+        # Круговая диаграмма с процентом возвратов
+         dbc.Row([
+            dbc.Col(dcc.Graph(id='returns-pie-chart'), width=6, className='p-0', style={'margin': '0 auto', 'textAlign': 'center'})
+        ], className='mt-3 g-0')
+    ], fluid=True)
+
+RETURNS_LABELS = ('Не возвращен', 'Возвращен')
+
+REVENUE_TITLE = 'Выручка по дням'
+
+# Окна скользящих средних выручки и оттока на графике выручки, в днях
+ROLLING_WINDOWS = (7, 30, 90)
+
+# Дельты индикаторов относительно предыдущего периода: выручка — в процентах,
+# отток — в процентных пунктах; рост оттока — ухудшение, поэтому цвета обратные
+REVENUE_DELTA = {'relative': True, 'valueformat': '.1%'}
+CHURN_DELTA = {'valueformat': '.2f', 'increasing': {'color': '#FF4136'}, 'decreasing': {'color': '#3D9970'}}
+
+# Первый день данных и диапазон [start, end) выбранных дат, обрезанный по данным, как в кубе
+def data_range(snapshot, start_date, end_date):
+    first_date, last_date = snapshot.date_bounds
+    if first_date is None:
+        return None, None, None
+    first_day, stop = first_date.normalize(), last_date.normalize() + pd.Timedelta(days=1)
+    start, end = day_bounds(start_date, end_date)
+    start = first_day if start is None else min(max(start, first_day), stop)
+    end = stop if end is None else min(max(end, start), stop)
+    return first_day, start, end
+
+# Период той же длины непосредственно перед выбранным (первый и последний день);
+# None, если он начинается раньше данных
+def previous_period(snapshot, start_date, end_date):
+    first_day, start, end = data_range(snapshot, start_date, end_date)
+    if first_day is None or end == start or start - (end - start) < first_day:
+        return None
+    return start - (end - start), start - pd.Timedelta(days=1)
+
+# Префиксные суммы выручки, оттока и числа покупок по дням диапазона и max(ROLLING_WINDOWS) - 1
+# дням перед ним: из куба или, при отключённом кубе, по строкам окна
+def daily_cumulative(snapshot, start, last_day, selected_gender, selected_age):
+    lookback = max(ROLLING_WINDOWS) - 1
+    if cube.ENABLED:
+        return cube.get_cube(snapshot).cumulative(
+            ('revenue', 'churn', 'count'), start, last_day, gender=selected_gender, age=selected_age, lookback=lookback)
+    first_day, start, end = data_range(snapshot, start, last_day)
+    if first_day is None:
+        return pd.DatetimeIndex([]), {name: np.zeros(1) for name in ('revenue', 'churn', 'count')}
+    lo = max(start - pd.Timedelta(days=lookback), first_day)
+    rows = filter_df(snapshot.df, lo, end - pd.Timedelta(days=1), gender=selected_gender, age=selected_age)
+    day_index = ((rows['Purchase Date'].dt.normalize() - lo) // pd.Timedelta(days=1)).to_numpy()
+    weights = {
+        'revenue': rows['Total Purchase Amount'].to_numpy(dtype=np.float64),
+        'churn': rows['Churn'].to_numpy(dtype=np.float64),
+        'count': None,
+    }
+    cumulative = {
+        name: np.concatenate([[0], np.cumsum(np.bincount(day_index, weights=values, minlength=(end - lo).days))])
+        for name, values in weights.items()
+    }
+    return pd.date_range(start, periods=max((end - start).days, 0), freq='D'), cumulative
+
+# Скользящие средние для каждого дня диапазона: выручка в день и доля оттока (%) за последние
+# 7, 30 и 90 дней. Каждое окно — разность префиксных сумм, поэтому стоимость — O(дней) при любом
+# числе строк; дни, для которых окно начинается раньше данных, остаются пустыми
+def rolling_averages(snapshot, start, last_day, selected_gender, selected_age):
+    days, cumulative = daily_cumulative(snapshot, start, last_day, selected_gender, selected_age)
+    revenue, churn = {}, {}
+    for window in ROLLING_WINDOWS:
+        revenue[window] = timeseries.rolling_sums(cumulative['revenue'], len(days), window) / window
+        counts = timeseries.rolling_sums(cumulative['count'], len(days), window)
+        churned = timeseries.rolling_sums(cumulative['churn'], len(days), window)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            churn[window] = np.where(counts > 0, churned / counts * 100, np.nan)
+    return days, revenue, churn
+
+# Дневной ряд выручки за диапазон: из куба или по строкам
+def daily_revenue(snapshot, start_date, end_date, selected_gender, selected_age):
+    if cube.ENABLED:
+        return cube.get_cube(snapshot).daily('revenue', start_date, end_date, gender=selected_gender, age=selected_age)
+    filtered_df = filter_df(snapshot.df, start_date, end_date, gender=selected_gender, age=selected_age)
+    revenue_by_date_df = filtered_df.groupby(filtered_df['Purchase Date'].dt.normalize())['Total Purchase Amount'].sum()
+    return revenue_by_date_df.index, revenue_by_date_df.to_numpy()
+
+def revenue_key(start_date, end_date, selected_gender, selected_age, window_start=None, window_end=None):
+    return filter_key(start_date, end_date, gender=selected_gender, age=selected_age), window_start, window_end
+
+# График выручки: дневной ряд прореживается LTTB до timeseries.TARGET_POINTS точек с сохранением
+# пиков, скользящие средние — равным шагом. При увеличении графика пересчитывается только видимое окно
+@memoize(key=revenue_key)
+def revenue_by_date_figure(start_date, end_date, selected_gender, selected_age, window_start=None, window_end=None):
+    snapshot = current()
+    start, last_day = timeseries.clip_range(start_date, end_date, window_start, window_end)
+
+    with metrics.phase('aggregate'):
+        revenue_dates, revenue_values = daily_revenue(snapshot, start, last_day, selected_gender, selected_age)
+        revenue_dates, revenue_values = timeseries.lttb(revenue_dates, revenue_values)
+        rolling_days, rolling_revenue, rolling_churn = rolling_averages(snapshot, start, last_day, selected_gender, selected_age)
+        positions = timeseries.even_positions(len(rolling_days))
+        rolling_dates = rolling_days[positions].date
+
+    with metrics.phase('figure'):
+        points = [(revenue_dates.date, revenue_values)]
+        points += [(rolling_dates, rolling_revenue[window][positions]) for window in ROLLING_WINDOWS]
+        points += [(rolling_dates, rolling_churn[window][positions]) for window in ROLLING_WINDOWS]
+        # Масштаб, выбранный пользователем, сохраняется, пока не изменились фильтры
+        return figures.series('home.revenue_by_date', build_revenue_chart, points,
+                              title={'text': REVENUE_TITLE},
+                              uirevision=repr(revenue_key(start_date, end_date, selected_gender, selected_age)))
+
+# График выручки по рядам (даты, значения): выручка, затем скользящие средние выручки и оттока
+def build_revenue_chart(points, title, uirevision):
+    (dates, revenue), rolling = points[0], points[1:]
+    traces = [go.Scatter(x=dates, y=revenue, mode='lines+markers', name='Выручка')]
+    traces += [
+        go.Scatter(x=x, y=y, mode='lines', yaxis='y2', name=f'Средняя выручка в день, {window} дн.')
+        for window, (x, y) in zip(ROLLING_WINDOWS, rolling[:len(ROLLING_WINDOWS)])
+    ]
+    # Отток скрыт до выбора в легенде, чтобы не перегружать график
+    traces += [
+        go.Scatter(x=x, y=y, mode='lines', yaxis='y3', visible='legendonly',
+                   line={'dash': 'dot'}, name=f'Отток, {window} дн. (%)')
+        for window, (x, y) in zip(ROLLING_WINDOWS, rolling[len(ROLLING_WINDOWS):])
+    ]
+    return go.Figure(
+        data=traces,
         layout=go.Layout(
-            title='Выручка по дням',
+            title=title,
             xaxis_title='Дата покупки',
             yaxis_title='Общая сумма покупки',
-            autosize=True
+            yaxis2={'title': 'Средняя выручка в день', 'overlaying': 'y', 'side': 'right', 'showgrid': False},
+            yaxis3={'title': 'Отток клиентов (%)', 'overlaying': 'y', 'side': 'right', 'anchor': 'free',
+                    'autoshift': True, 'showgrid': False},
+            legend={'orientation': 'h', 'y': -0.2},
+            autosize=True,
+            uirevision=uirevision,
         )
     )
 
-    # Круговая диаграмма с процентом возвратов
-    returns_count = filtered_df['Returns'].value_counts().reset_index()
-    returns_count.columns = ['Returns', 'Count']
-    returns_count['Returns'] = returns_count['Returns'].map({0: 'Не возвращен', 1: 'Возвращен'})
-    returns_pie_chart = px.pie(returns_count, names='Returns', values='Count', title='Процент возвратов', hole=0.3)
-    
-    return total_customers_fig, total_revenue_fig, churn_rate_fig, revenue_by_date_fig, returns_pie_chart
\ No newline at end of file
+# Индикаторы строятся из шаблонов (см. figures.py): go.Figure собирается только один раз
+def customers_indicator(total_customers):
+    return figures.indicator('home.customers', lambda value, reference: go.Figure(go.Indicator(
+        mode = "number",
+        value = value,
+        title = {"text": "Кол-во клиентов"}
+    )), total_customers)
+
+# Индикатор с дельтой относительно предыдущего периода; без него — только число
+def delta_indicator(value, title, reference=None, delta=None):
+    def build(value, reference):
+        if reference is None:
+            return go.Figure(go.Indicator(mode="number", value=value, title={"text": title}))
+        return go.Figure(go.Indicator(mode="number+delta", value=value, delta=dict(delta, reference=reference), title={"text": title}))
+    name = f'home.indicator.{title}' if reference is None else f'home.indicator.{title}.delta'
+    return figures.indicator(name, build, value, reference)
+
+def churn_rate(totals):
+    return (totals['churn'] / totals['count']) * 100 if totals['count'] > 0 else 0
+
+def build_returns_pie_chart(frame):
+    return px.pie(frame, names='Returns', values='Count', title='Процент возвратов', hole=0.3)
+
+# Индикатор числа уникальных клиентов: по индексу уникальных клиентов или по строкам
+def total_customers_figure(start_date, end_date, selected_gender, selected_age):
+    snapshot = current()
+    if distinct.MODE == 'rows':
+        with metrics.phase('filter'):
+            filtered_df = filter_df(snapshot.df, start_date, end_date, gender=selected_gender, age=selected_age)
+        with metrics.phase('aggregate'):
+            total_customers = filtered_df['Customer ID'].nunique()
+    else:
+        with metrics.phase('aggregate'):
+            total_customers = distinct.count_customers(snapshot, start_date, end_date, gender=selected_gender, age=selected_age)
+    with metrics.phase('figure'):
+        return customers_indicator(total_customers)
+
+# Индикаторы выручки и оттока с дельтами и круговая диаграмма возвратов. Суммарные показатели
+# берутся из предагрегированного куба, при отключённом кубе — по строкам отфильтрованного датасета
+def totals_figures(start_date, end_date, selected_gender, selected_age):
+    snapshot = current()
+    filtered_df = None
+    if not cube.ENABLED:
+        with metrics.phase('filter'):
+            filtered_df = filter_df(snapshot.df, start_date, end_date, gender=selected_gender, age=selected_age)
+
+    with metrics.phase('aggregate'):
+        if cube.ENABLED:
+            totals = cube.get_cube(snapshot).totals(start_date, end_date, gender=selected_gender, age=selected_age)
+        else:
+            totals = cube.totals_from_rows(filtered_df)
+
+        # Те же показатели за предыдущий период той же длины — для дельт индикаторов
+        previous = previous_period(snapshot, start_date, end_date)
+        previous_totals = None
+        if previous is not None and cube.ENABLED:
+            previous_totals = cube.get_cube(snapshot).totals(*previous, gender=selected_gender, age=selected_age)
+        elif previous is not None:
+            previous_totals = cube.totals_from_rows(filter_df(snapshot.df, *previous, gender=selected_gender, age=selected_age))
+
+    with metrics.phase('figure'):
+        # Выручка; относительная дельта не определена, если в предыдущем периоде выручки не было
+        previous_revenue = previous_totals['revenue'] if previous_totals is not None and previous_totals['revenue'] != 0 else None
+        total_revenue_fig = delta_indicator(totals['revenue'], "Выручка", previous_revenue, REVENUE_DELTA)
+
+        # Отток клиентов
+        previous_churn = churn_rate(previous_totals) if previous_totals is not None and previous_totals['count'] > 0 else None
+        churn_rate_fig = delta_indicator(churn_rate(totals), "Отток клиентов (%)", previous_churn, CHURN_DELTA)
+
+        # Круговая диаграмма с процентом возвратов
+        returns_count = pd.DataFrame({
+            'Returns': list(RETURNS_LABELS),
+            'Count': [totals['not_returned'], totals['returned']],
+        })
+        returns_count = returns_count[returns_count['Count'] > 0].sort_values('Count', ascending=False, kind='stable')
+        returns_pie_chart = figures.pie('home.returns_pie_chart', build_returns_pie_chart, returns_count, 'Returns', 'Count')
+
+    return total_revenue_fig, churn_rate_fig, returns_pie_chart
+
+# Число клиентов, показатели и график выручки независимы и могут считаться одновременно
+# (см. parallel.py); число уникальных клиентов обычно считается дольше остальных, поэтому идёт первым
+@memoize(key=filter_key)
+def home_figures(start_date, end_date, selected_gender, selected_age):
+    inputs = (start_date, end_date, selected_gender, selected_age)
+    parts = parallel.run({
+        'total_customers': (total_customers_figure, *inputs),
+        'revenue_by_date': (revenue_by_date_figure, *inputs),
+        'totals': (totals_figures, *inputs),
+    })
+    total_revenue_fig, churn_rate_fig, returns_pie_chart = parts['totals']
+    return parts['total_customers'], total_revenue_fig, churn_rate_fig, parts['revenue_by_date'], returns_pie_chart
+
+@metrics.instrument
+def update_indicators_and_graph(start_date, end_date, selected_gender, selected_age, relayout_data=None):
+    # Изменение масштаба графика выручки пересчитывает только этот график
+    if ctx.triggered_id == 'revenue-by-date':
+        window_start, window_end = timeseries.visible_window(relayout_data)
+        revenue_by_date_fig = revenue_by_date_figure(start_date, end_date, selected_gender, selected_age, window_start, window_end)
+        return no_update, no_update, no_update, revenue_by_date_fig, no_update
+    return home_figures(start_date, end_date, selected_gender, selected_age)
+
+# Число уникальных клиентов не складывается из дневных агрегатов,
+# поэтому в режиме клиентских вычислений этот индикатор по-прежнему считает сервер
+@metrics.instrument
+@memoize(key=filter_key)
+def update_total_customers(start_date, end_date, selected_gender, selected_age):
+    return total_customers_figure(start_date, end_date, selected_gender, selected_age)
+
+FILTER_INPUTS = [
+    Input('date-picker-range', 'start_date'),
+    Input('date-picker-range', 'end_date'),
+    Input('gender-dropdown', 'value'),
+    Input('age-input', 'value'),
+]
+
+# При DASHBOARD_BACKGROUND=1 серверные коллбэки выполняются в фоновых процессах (см. background.py)
+if clientside.ENABLED:
+    callback(Output('total-customers', 'figure'), FILTER_INPUTS, **background.options())(update_total_customers)
+    clientside_callback(
+        ClientsideFunction(namespace='dashboard', function_name='homeFigures'),
+        [Output('total-revenue', 'figure'),
+         Output('churn-rate', 'figure'),
+         Output('revenue-by-date', 'figure'),
+         Output('returns-pie-chart', 'figure')],
+        FILTER_INPUTS + [Input('revenue-by-date', 'relayoutData'), Input(clientside.STORE, 'data')],
+    )
+else:
+    callback(
+        [Output('total-customers', 'figure'),
+         Output('total-revenue', 'figure'),
+         Output('churn-rate', 'figure'),
+         Output('revenue-by-date', 'figure'),
+         Output('returns-pie-chart', 'figure')],
+        FILTER_INPUTS + [Input('revenue-by-date', 'relayoutData')],
+        **background.options(),
+    )(update_indicators_and_graph)
+
+def default_inputs():
+    first_date, last_date = current().date_bounds
+    return first_date, last_date, None, None
+
+precompute.register_default(home_figures, default_inputs)
+
+# Агрегаты для браузера: дневные значения мер по осям день × пол × возраст из куба
+# и шаблоны фигур страницы для входов по умолчанию
+def clientside_payload(snapshot):
+    daily_cube = cube.get_cube(snapshot)
+    first_date, last_date = snapshot.date_bounds
+    figures = home_figures(*default_inputs())
+    return {
+        'first_day': daily_cube.first_day.date().isoformat(),
+        'first_date': first_date.isoformat() if first_date is not None else None,
+        'last_date': last_date.isoformat() if last_date is not None else None,
+        'genders': list(daily_cube.genders),
+        'ages': np.asarray(daily_cube.ages).tolist(),
+        'measures': {
+            name: clientside.encode(np.diff(prefix.sum(axis=-1), axis=0))
+            for name, prefix in daily_cube.prefix.items()
+        },
+        'target_points': timeseries.TARGET_POINTS,
+        'rolling_windows': list(ROLLING_WINDOWS),
+        'deltas': {'revenue': REVENUE_DELTA, 'churn': CHURN_DELTA},
+        'returns_labels': list(RETURNS_LABELS),
+        'figures': {
+            name: clientside.figure_json(figure)
+            for name, figure in zip(['total-revenue', 'churn-rate', 'revenue-by-date', 'returns-pie-chart'], figures[1:])
+        },
+    }
+
+clientside.register('home', clientside_payload)
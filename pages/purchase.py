@@ -1,97 +1,121 @@
-from dash import html, dcc, callback, Output, Input
+from dash import html, dcc, callback, clientside_callback, ClientsideFunction, Output, Input
 import dash_bootstrap_components as dbc
-import plotly.express as px
+import numpy as np
 import pandas as pd
-from data import df
-
-layout = dbc.Container([
-    html.H1("Анализ продуктов и покупок", className='text-center my-4'),
-
-    # Селекторы в одну строку
-    dbc.Row([
-        dbc.Col([
-            html.Label("Выберите диапазон дат:", className='d-block'),
-            dcc.DatePickerRange(
-                id='date-picker-range-product',
-                start_date=df['Purchase Date'].min(),
-                end_date=df['Purchase Date'].max(),
-                display_format='YYYY-MM-DD',
-                className='d-block'
-            ),
-        ], width=4, className='me-3'), 
-
-        dbc.Col([
-            html.Label("Категория продукта:", className='d-block'),
-            dcc.Dropdown(
-                id='product-category-dropdown',
-                options=[
-                    {'label': 'Книги', 'value': 'Книги'},
-                    {'label': 'Электроника', 'value': 'Электроника'},
-                    {'label': 'Дом', 'value': 'Дом'},
-                    {'label': 'Одежда', 'value': 'Одежда'}
-                ],
-                multi=True,
-                placeholder="Select Category",
-                className='d-block'
-            ),
-        ], width=4)
-    ], className='mb-3 g-0'),  
-
-    # Графики и таблица
-    dbc.Row([
-        dbc.Col(dcc.Graph(id='sales-bar-chart'), width=5, className='mr-3', ),
-        dbc.Col(dcc.Graph(id='profit-bar-chart'), width=5, className='mr-3'),
-        dbc.Col(dcc.Graph(id='payment-method-pie-chart'), width=5, className='mr-3'),
-        dbc.Col(dcc.Graph(id='scatter-plot'), width=6, className='mr-3'),        
-    ], className='mr-3 g-0')
-], fluid=True) 
+import plotly.express as px
+from data import DATE_COLUMN, current, dimension_options, layout_metadata
+import background
+import clientside
+import data
+import figures
+import grouping
+from cache import filter_key, memoize
+from filters import day_bounds
+import metrics
+import precompute
 
-# Коллбэк для обновления круговой диаграммы на основе селекторов
-@callback(
-    Output('payment-method-pie-chart', 'figure'),
-    [Input('date-picker-range-product', 'start_date'),
-     Input('date-picker-range-product', 'end_date'),
-     Input('product-category-dropdown', 'value')]
-)
-def update_pie_chart(start_date, end_date, selected_categories):
-    # Фильтрация данных
-    filtered_df = df[
-        (df['Purchase Date'] >= start_date) &
-        (df['Purchase Date'] <= end_date)
-    ]
-    
-    if selected_categories:
-        filtered_df = filtered_df[filtered_df['Product Category'].isin(selected_categories)]
+# Макет строится из метаданных датасета, как на главной странице
+def layout():
+    metadata = layout_metadata()
+    first_date, last_date = metadata['first_date'], metadata['last_date']
 
-    # Круговая диаграмма анализа метода оплаты
-    payment_method_count = filtered_df['Payment Method'].value_counts(normalize=True).reset_index()
-    payment_method_count.columns = ['Payment Method', 'Percentage']
-    payment_method_pie_chart = px.pie(payment_method_count, names='Payment Method', values='Percentage', title='Анализ метода оплаты (%)', hole=0.3)
+    return dbc.Container([
+        html.H1("Анализ продуктов и покупок", className='text-center my-4'),
 
-    return payment_method_pie_chart
+        # Селекторы в одну строку
+        dbc.Row([
+            dbc.Col([
+                html.Label("Выберите диапазон дат:", className='d-block'),
+                dcc.DatePickerRange(
+                    id='date-picker-range-product',
+                    start_date=first_date,
+                    end_date=last_date,
+                    display_format='YYYY-MM-DD',
+                    className='d-block'
+                ),
+            ], width=4, className='me-3'), 
 
-# Коллбэк для обновления столбчатых диаграмм и scatter plot на основе селекторов
-@callback(
-    [Output('sales-bar-chart', 'figure'),
-     Output('profit-bar-chart', 'figure'),
-     Output('scatter-plot', 'figure')],
-    [Input('date-picker-range-product', 'start_date'),
-     Input('date-picker-range-product', 'end_date'),
-     Input('product-category-dropdown', 'value')]
-)
-def update_graphs_and_table(start_date, end_date, selected_categories):
-    # Фильтрация данных
-    filtered_df = df[
-        (df['Purchase Date'] >= start_date) &
-        (df['Purchase Date'] <= end_date)
-    ]
+            dbc.Col([
+                html.Label("Категория продукта:", className='d-block'),
+                dcc.Dropdown(
+                    id='product-category-dropdown',
+                    options=dimension_options('Product Category', metadata['dimensions']['Product Category']),
+                    multi=True,
+                    placeholder="Select Category",
+                    className='d-block'
+                ),
+            ], width=4)
+        ], className='mb-3 g-0'),  
+
+        # Графики и таблица
+        dbc.Row([
+            dbc.Col(dcc.Graph(id='sales-bar-chart'), width=5, className='mr-3', ),
+            dbc.Col(dcc.Graph(id='profit-bar-chart'), width=5, className='mr-3'),
+            dbc.Col(dcc.Graph(id='payment-method-pie-chart'), width=5, className='mr-3'),
+            dbc.Col(dcc.Graph(id='scatter-plot'), width=6, className='mr-3'),        
+        ], className='mr-3 g-0')
+    ], fluid=True) 
+
+def purchase_key(start_date, end_date, selected_categories):
+    return filter_key(start_date, end_date, categories=selected_categories)
 
+# Число и сумма покупок по дням × категория × метод оплаты. Строится по порциям строк,
+# служит источником сводки страницы и агрегатов для браузера; после дописывания строк
+# дополняется только по новым строкам
+def build_sales(frame):
+    days = pd.Series(frame[DATE_COLUMN].to_numpy().astype('datetime64[D]'), index=frame.index, name='Day')
+    return grouping.group(frame, [days, 'Product Category', 'Payment Method'], {'sum': 'Total Purchase Amount'}, dropna=False)
+
+def merge_sales(left, right):
+    return pd.concat([left, right]).groupby(level=[0, 1, 2], dropna=False, observed=True).sum()
+
+def get_sales(snapshot):
+    return snapshot.aggregate('purchase.sales', lambda frame: data.reduce_chunks(frame, build_sales, merge_sales))
+
+data.register_incremental('purchase.sales', lambda value, rows, snapshot: merge_sales(value, build_sales(rows)))
+
+# Строки дневного агрегата за диапазон дат с фильтром по категориям
+def select_sales(sales, start_date, end_date, selected_categories):
+    days = sales.index.get_level_values('Day')
+    start, end = day_bounds(start_date, end_date)
+    mask = np.ones(len(sales), dtype=bool)
+    if start is not None:
+        mask &= days >= start
+    if end is not None:
+        mask &= days < end
     if selected_categories:
-        filtered_df = filtered_df[filtered_df['Product Category'].isin(selected_categories)]
+        mask &= sales.index.get_level_values('Product Category').isin(selected_categories)
+    return sales[mask]
+
+# Общий этап для обоих коллбэков страницы: меры по парам (категория, метод оплаты)
+# складываются из дневного агрегата, а не из строк. Результат кэшируется по тем же входам,
+# поэтому второй коллбэк получает уже посчитанные меры
+@memoize(key=purchase_key)
+def purchase_summary(start_date, end_date, selected_categories):
+    snapshot = current()
+
+    # Фильтрация дней и категорий
+    with metrics.phase('filter'):
+        sales = select_sales(get_sales(snapshot), start_date, end_date, selected_categories)
+
+    with metrics.phase('aggregate'):
+        grouped = sales.groupby(level=['Product Category', 'Payment Method'], dropna=False, observed=True).sum()
+
+        by_category = grouped.groupby(level='Product Category', observed=True).sum()
+        by_category['mean'] = by_category['sum'] / by_category['size']
+
+        by_payment = grouped['size'].groupby(level='Payment Method', observed=True).sum()
+        payment_share = (by_payment / by_payment.sum()).sort_values(ascending=False, kind='stable')
+
+    return {'by_category': by_category, 'payment_share': payment_share}
+
+# Фигуры страницы в plotly express; в коллбэках по ним один раз строятся шаблоны (см. figures.py)
+def build_payment_pie_chart(frame):
+    return px.pie(frame, names='Payment Method', values='Percentage', title='Анализ метода оплаты (%)', hole=0.3)
 
-    # Столбчатая диаграмма продаж по категориям продуктов
-    sales_by_category = filtered_df.groupby('Product Category').size().reset_index(name='Count')
-    sales_bar_chart = px.bar(sales_by_category, x='Product Category',
+# Столбчатая диаграмма продаж по категориям продуктов
+def build_sales_bar_chart(frame):
+    return px.bar(frame, x='Product Category',
     y='Count', 
     color='Product Category',
     labels={
@@ -100,9 +124,9 @@ def update_graphs_and_table(start_date, end_date, selected_categories):
     }, 
     title='Количество продаж по категориям продуктов')
 
-    # Столбчатая диаграмма прибыли по категориям продуктов
-    profit_by_category = filtered_df.groupby('Product Category')['Total Purchase Amount'].sum().reset_index()
-    profit_bar_chart = px.bar(profit_by_category, 
+# Столбчатая диаграмма прибыли по категориям продуктов
+def build_profit_bar_chart(frame):
+    return px.bar(frame, 
     x='Product Category', 
     y='Total Purchase Amount', 
     color='Product Category',
@@ -112,11 +136,9 @@ def update_graphs_and_table(start_date, end_date, selected_categories):
     },  
     title='Прибыль по категориям продуктов')
 
-    # График рассеивания средней стоимости покупок и количества покупок по категориям продуктов
-    avg_purchase_amount = filtered_df.groupby('Product Category')['Total Purchase Amount'].mean().reset_index()
-    purchase_count = filtered_df.groupby('Product Category').size().reset_index(name='Purchase Count')
-    scatter_data = pd.merge(avg_purchase_amount, purchase_count, on='Product Category')
-    scatter_plot = px.scatter(scatter_data, 
+# График рассеивания средней стоимости покупок и количества покупок по категориям продуктов
+def build_scatter_plot(frame):
+    return px.scatter(frame, 
     x='Purchase Count', 
     y='Total Purchase Amount', 
     color='Product Category', 
@@ -127,4 +149,117 @@ def update_graphs_and_table(start_date, end_date, selected_categories):
     },   
     title='Соотношение средней стоимости и количества покупок')
 
+# Коллбэк для обновления круговой диаграммы на основе селекторов
+@metrics.instrument
+@memoize(key=purchase_key)
+def update_pie_chart(start_date, end_date, selected_categories):
+    summary = purchase_summary(start_date, end_date, selected_categories)
+
+    # Круговая диаграмма анализа метода оплаты
+    with metrics.phase('figure'):
+        payment_method_count = data.localize(summary['payment_share']).reset_index()
+        payment_method_count.columns = ['Payment Method', 'Percentage']
+        payment_method_pie_chart = figures.pie('purchase.payment_pie_chart', build_payment_pie_chart, payment_method_count,
+                                               'Payment Method', 'Percentage')
+
+    return payment_method_pie_chart
+
+# Коллбэк для обновления столбчатых диаграмм и scatter plot на основе селекторов
+@metrics.instrument
+@memoize(key=purchase_key)
+def update_graphs_and_table(start_date, end_date, selected_categories):
+    by_category = data.localize(purchase_summary(start_date, end_date, selected_categories)['by_category'])
+
+    with metrics.phase('figure'):
+        sales_by_category = by_category['size'].rename('Count').reset_index()
+        sales_bar_chart = figures.grouped('purchase.sales_bar_chart', build_sales_bar_chart, sales_by_category,
+                                          'Product Category', 'Product Category', 'Count')
+
+        profit_by_category = by_category['sum'].rename('Total Purchase Amount').reset_index()
+        profit_bar_chart = figures.grouped('purchase.profit_bar_chart', build_profit_bar_chart, profit_by_category,
+                                           'Product Category', 'Product Category', 'Total Purchase Amount')
+
+        scatter_data = by_category[['mean', 'size']].reset_index()
+        scatter_data.columns = ['Product Category', 'Total Purchase Amount', 'Purchase Count']
+        scatter_plot = figures.grouped('purchase.scatter_plot', build_scatter_plot, scatter_data,
+                                       'Product Category', 'Purchase Count', 'Total Purchase Amount', size='Purchase Count')
+
     return sales_bar_chart, profit_bar_chart, scatter_plot
+
+FILTER_INPUTS = [
+    Input('date-picker-range-product', 'start_date'),
+    Input('date-picker-range-product', 'end_date'),
+    Input('product-category-dropdown', 'value'),
+]
+
+# В режиме клиентских вычислений все графики страницы строятся в браузере
+if clientside.ENABLED:
+    clientside_callback(
+        ClientsideFunction(namespace='dashboard', function_name='purchaseFigures'),
+        [Output('payment-method-pie-chart', 'figure'),
+         Output('sales-bar-chart', 'figure'),
+         Output('profit-bar-chart', 'figure'),
+         Output('scatter-plot', 'figure')],
+        FILTER_INPUTS + [Input(clientside.STORE, 'data')],
+    )
+else:
+    callback(Output('payment-method-pie-chart', 'figure'), FILTER_INPUTS, **background.options())(update_pie_chart)
+    callback(
+        [Output('sales-bar-chart', 'figure'),
+         Output('profit-bar-chart', 'figure'),
+         Output('scatter-plot', 'figure')],
+        FILTER_INPUTS,
+        **background.options(),
+    )(update_graphs_and_table)
+
+def default_inputs():
+    first_date, last_date = current().date_bounds
+    return first_date, last_date, None
+
+precompute.register_default(update_pie_chart, default_inputs)
+precompute.register_default(update_graphs_and_table, default_inputs)
+
+# Ось агрегата для браузера: коды значений уровня индекса в порядке подписей, как на серверных
+# графиках; исходные значения нужны для фильтра по списку выбора, подписи — для фигур
+def _axis(level):
+    labels = level.map(lambda value: data.label(level.name, value))
+    codes, uniques = pd.factorize(labels, sort=True, use_na_sentinel=False)
+    values = np.empty(len(uniques), dtype=object)
+    values[codes] = level
+    return codes, values.tolist(), uniques.tolist()
+
+# Агрегаты для браузера: число и сумма покупок по осям день × категория × метод оплаты
+# и шаблоны фигур страницы для входов по умолчанию
+def clientside_payload(snapshot):
+    sales = get_sales(snapshot)
+    days = sales.index.get_level_values('Day')
+    first_day = days.min() if len(days) else pd.Timestamp(0)
+    day_index = (days - first_day) // pd.Timedelta(days=1)
+    category_codes, categories, category_labels = _axis(sales.index.get_level_values('Product Category'))
+    payment_codes, payments, payment_labels = _axis(sales.index.get_level_values('Payment Method'))
+    shape = (int(day_index.max()) + 1 if len(days) else 0, len(categories), len(payments))
+    cells = np.ravel_multi_index((np.asarray(day_index), category_codes, payment_codes), shape)
+    size = int(np.prod(shape))
+
+    first_date, last_date = default_inputs()[:2]
+    pie_chart = update_pie_chart(first_date, last_date, None)
+    sales_bar_chart, profit_bar_chart, scatter_plot = update_graphs_and_table(first_date, last_date, None)
+    return {
+        'first_day': first_day.date().isoformat(),
+        'categories': categories,
+        'category_labels': category_labels,
+        'payments': payments,
+        'payment_labels': payment_labels,
+        'measures': {
+            'count': clientside.encode(np.bincount(cells, weights=sales['size'], minlength=size).reshape(shape)),
+            'sum': clientside.encode(np.bincount(cells, weights=sales['sum'], minlength=size).reshape(shape)),
+        },
+        'figures': {
+            'payment-method-pie-chart': clientside.figure_json(pie_chart),
+            'sales-bar-chart': clientside.figure_json(sales_bar_chart),
+            'profit-bar-chart': clientside.figure_json(profit_bar_chart),
+            'scatter-plot': clientside.figure_json(scatter_plot),
+        },
+    }
+
+clientside.register('purchase', clientside_payload)
@@ -0,0 +1,97 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import data
+import metrics
+
+# Независимые части коллбэка (графики и таблицы одной страницы, которые считаются по одному
+# снимку и не зависят друг от друга) выполняются одновременно в общем пуле процесса:
+# DASHBOARD_PARALLEL=thread — в потоках (NumPy и pandas отпускают GIL на больших массивах),
+# process — в процессах, созданных fork от процесса со снимком. По умолчанию (off) части
+# выполняются по очереди в потоке коллбэка
+MODE = os.environ.get('DASHBOARD_PARALLEL', 'off')
+WORKERS = int(os.environ.get('DASHBOARD_PARALLEL_WORKERS', os.cpu_count() or 1))
+
+_lock = threading.Lock()
+_threads = None
+# (версия снимка, пул процессов): процессы видят снимок, который был текущим при их создании
+_processes = None
+# Снимок процесса пула и признак потока пула: в них части выполняются по очереди,
+# чтобы части не ждали освобождения того же пула
+_snapshot = None
+_local = threading.local()
+
+
+# См. cache._reset_after_fork; потоки и процессы пулов в дочерний процесс не переходят
+def _reset_after_fork():
+    global _lock, _threads, _processes
+    _lock = threading.Lock()
+    _threads = None
+    _processes = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _init_process(snapshot):
+    global _snapshot
+    _snapshot = snapshot
+
+
+# Часть выполняется со снимком и именем коллбэка вызывающего потока; время части возвращается
+# вместе с результатом и записывается в метрику процессом, который её запустил
+def _call(snapshot, callback, func, args):
+    _local.worker = True
+    started = time.perf_counter()
+    try:
+        with data.pinned(snapshot if snapshot is not None else _snapshot), metrics.context(callback):
+            return func(*args), time.perf_counter() - started
+    finally:
+        _local.worker = False
+
+
+def _pool(snapshot):
+    global _threads, _processes
+    with _lock:
+        if MODE == 'process':
+            if _processes is None or _processes[0] != snapshot.version:
+                if _processes is not None:
+                    _processes[1].shutdown(wait=False)
+                pool = ProcessPoolExecutor(WORKERS, mp_context=multiprocessing.get_context('fork'),
+                                           initializer=_init_process, initargs=(snapshot,))
+                _processes = (snapshot.version, pool)
+            return _processes[1]
+        if _threads is None:
+            _threads = ThreadPoolExecutor(WORKERS, thread_name_prefix='callback-part')
+        return _threads
+
+
+# parts — {имя: (функция, аргументы...)}, результат — {имя: значение}. Первая часть выполняется
+# в вызывающем потоке, остальные — в пуле, поэтому самую долгую часть стоит ставить первой.
+# В процессе пула части должны быть функциями модулей, а их результаты — сериализуемыми pickle
+def run(parts):
+    callback = metrics.current_callback()
+    snapshot = data.current()
+    pooled = MODE in ('thread', 'process') and len(parts) > 1 and _snapshot is None and not getattr(_local, 'worker', False)
+
+    futures = {}
+    if pooled:
+        pool = _pool(snapshot)
+        for name, (func, *args) in list(parts.items())[1:]:
+            futures[name] = pool.submit(_call, snapshot if MODE == 'thread' else None, callback, func, args)
+
+    results, seconds = {}, {}
+    for name, (func, *args) in parts.items():
+        if name not in futures:
+            started = time.perf_counter()
+            results[name] = func(*args)
+            seconds[name] = time.perf_counter() - started
+    for name, future in futures.items():
+        results[name], seconds[name] = future.result()
+
+    for name in parts:
+        metrics.part_seconds.observe(seconds[name], callback or 'other', name)
+    return {name: results[name] for name in parts}
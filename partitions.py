@@ -0,0 +1,132 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import data
+from data import DATE_COLUMN
+
+# Месячные разделы (DASHBOARD_PARTITIONS=1): запрос с диапазоном дат открывает только разделы,
+# которые пересекаются с ним по min/max дат (см. data.month_partitions), остальные отсекаются
+# без чтения строк. В режиме out-of-core каждый раздел отображается через mmap отдельно
+ENABLED = os.environ.get('DASHBOARD_PARTITIONS', '0') == '1'
+
+# Бюджет памяти для горячих разделов: последние месяцы переиспользуются между запросами,
+# в режиме out-of-core — скопированными в память процесса; при нехватке места вытесняются
+# самые старые
+HOT_BYTES = int(os.environ.get('DASHBOARD_HOT_PARTITION_BYTES', 256 * 1024 * 1024))
+
+_lock = threading.Lock()
+
+
+# См. cache._reset_after_fork
+def _reset_after_fork():
+    global _lock
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class PartitionStore:
+    def __init__(self, partitions, load, hot_bytes=HOT_BYTES, copy=False):
+        self.partitions = partitions
+        self.hot_bytes = hot_bytes
+        self.resident_bytes = 0
+        self._load = load
+        # Копировать ли строки горячего раздела из mmap в память процесса
+        self._copy = copy
+        # Номер раздела → (строки в памяти, размер); разделы идут по возрастанию дат,
+        # поэтому меньший номер — более старый месяц
+        self._hot = {}
+        self._dates = [
+            tuple(np.datetime64(value) for value in partition['stats'][DATE_COLUMN]) if partition['key'] else None
+            for partition in partitions
+        ]
+
+    # Разделы, которые могут содержать строки из [start, end) с выбранным возрастом. Строки без
+    # даты, как и в filters.date_window, попадают только в окно без конечной даты
+    def select(self, start, end, age=None):
+        selected = []
+        for number, partition in enumerate(self.partitions):
+            bounds = self._dates[number]
+            if bounds is None:
+                if end is not None:
+                    continue
+            elif (start is not None and bounds[1] < start) or (end is not None and bounds[0] >= end):
+                continue
+            # Фильтр по возрасту проверяется так же, как в filters.apply_predicates: 0 и None — без фильтра
+            ages = partition['stats'].get('Age')
+            if age and ages and ages[0] is not None and not ages[0] <= age <= ages[1]:
+                continue
+            selected.append(number)
+        return selected
+
+    # Раздел остаётся горячим, только если он помещается в бюджет вместе с более новыми
+    # горячими разделами; ради него вытесняются более старые. Без копирования хранится
+    # сам загруженный срез, и его колонки по-прежнему лежат на общих страницах mmap
+    def _admit(self, number, frame):
+        size = int(frame.memory_usage(index=False, deep=False).sum())
+        with _lock:
+            newer = sum(entry[1] for other, entry in self._hot.items() if other > number)
+        if newer + size > self.hot_bytes:
+            return frame
+        if self._copy:
+            frame = frame.copy(deep=True)
+        with _lock:
+            entry = self._hot.get(number)
+            if entry is not None:
+                return entry[0]
+            for other in sorted(self._hot):
+                if self.resident_bytes + size <= self.hot_bytes or other > number:
+                    break
+                self.resident_bytes -= self._hot.pop(other)[1]
+            if self.resident_bytes + size > self.hot_bytes:
+                return frame
+            self._hot[number] = (frame, size)
+            self.resident_bytes += size
+        return frame
+
+    def frame(self, number):
+        entry = self._hot.get(number)
+        if entry is not None:
+            return entry[0]
+        partition = self.partitions[number]
+        return self._admit(number, self._load(partition))
+
+    # Строки окна дат по разделам: крайние разделы обрезаются бинарным поиском по их датам
+    def window(self, start, end, age=None):
+        for number in self.select(start, end, age):
+            frame = self.frame(number)
+            bounds = self._dates[number]
+            if bounds is None:
+                yield frame
+                continue
+            dates = frame[DATE_COLUMN].to_numpy()
+            lo = np.searchsorted(dates, start.to_datetime64(), side='left') if start is not None and bounds[0] < start else 0
+            hi = np.searchsorted(dates, end.to_datetime64(), side='left') if end is not None and bounds[1] >= end else len(frame)
+            yield frame if lo == 0 and hi == len(frame) else frame.iloc[lo:hi]
+
+
+# Разделы снимка: из метаданных кэша, а у снимка с дописанными строками — по его строкам.
+# Без out-of-core строки раздела — срез уже открытого фрейма (строковые колонки раскодированы
+# при загрузке), в out-of-core — отдельный mmap участка файлов колонок
+def _build(snapshot):
+    frame, source = snapshot.df, snapshot.source
+    if source is None:
+        numeric = {
+            name: frame[name].to_numpy() for name in frame.columns
+            if name != DATE_COLUMN and pd.api.types.is_numeric_dtype(frame[name])
+        }
+        partitions = data.month_partitions(frame[DATE_COLUMN].to_numpy(), numeric)
+    else:
+        partitions = source[1]['partitions']
+    if source is not None and data.OUT_OF_CORE:
+        return PartitionStore(
+            partitions, lambda partition: data.open_rows(source, partition['start'], partition['stop']), copy=True)
+    return PartitionStore(partitions, lambda partition: frame.iloc[partition['start']:partition['stop']])
+
+
+def get_store(snapshot):
+    return snapshot.aggregate('partitions', lambda frame: _build(snapshot))
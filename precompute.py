@@ -0,0 +1,54 @@
+import json
+import os
+import threading
+
+import plotly.io as pio
+
+import data
+
+# Прогрев можно отключить (DASHBOARD_WARMUP=0), например для быстрых перезапусков в разработке
+WARMUP = os.environ.get('DASHBOARD_WARMUP', '1') != '0'
+
+_invariants = {}
+_defaults = []
+_lock = threading.Lock()
+
+
+# См. cache._reset_after_fork
+def _reset_after_fork():
+    global _lock
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+# Фигуры, не зависящие от фильтров, строятся один раз на версию датасета и хранятся словарём
+# из JSON plotly; коллбэки отдают готовый словарь без повторной сборки через plotly express.
+# build получает снимок и строит фигуру по его агрегатам, поэтому после дописывания строк
+# фигура собирается заново без прохода по всем строкам
+def invariant_figure(name, build):
+    snapshot = data.current()
+    key = (name, snapshot.version)
+    figure = _invariants.get(key)
+    if figure is None:
+        figure = json.loads(pio.to_json(build(snapshot), validate=False))
+        with _lock:
+            for stale in [k for k in _invariants if k[0] == name and k != key]:
+                del _invariants[stale]
+            _invariants[key] = figure
+    return figure
+
+
+# Страницы регистрируют свои коллбэки с функцией, возвращающей входы по умолчанию
+# (весь диапазон текущего снимка, без фильтров); warm_up вызывает их при старте
+# и после обновления данных, и результаты попадают в кэш ещё до первого запроса
+def register_default(func, inputs):
+    _defaults.append((func, inputs))
+
+
+def warm_up():
+    if not WARMUP:
+        return
+    for func, inputs in _defaults:
+        func(*inputs())
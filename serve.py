@@ -0,0 +1,91 @@
+import argparse
+import gc
+import logging
+import os
+
+import cube
+import customers
+import data
+import distinct
+import ingest
+
+# Production-запуск: датасет, агрегаты и прогретые результаты готовятся в мастер-процессе
+# до fork, поэтому воркеры получают их через copy-on-write, а колонки из mmap-кэша
+# разделяются через page cache
+
+
+def prepare():
+    from app import server, startup
+
+    # Фоновые потоки загрузки и прогрева не переживают fork, поэтому мастер дожидается их
+    startup.join()
+    snapshot = data.current()
+    cube.get_cube(snapshot)
+    # В режиме out-of-core массив кодов на все строки не строится (см. customers.customer_codes)
+    if not data.OUT_OF_CORE:
+        customers.row_codes(snapshot)
+    if distinct.MODE != 'rows':
+        distinct.get_index(snapshot)
+    # Объекты, созданные до fork, исключаются из сборки мусора: иначе обход GC в воркерах
+    # трогает их заголовки и копирует общие страницы памяти
+    gc.freeze()
+    return server
+
+
+# Поток наблюдения за CSV не переживает fork, поэтому запускается в каждом воркере
+def post_fork(server, worker):
+    ingest.start_watcher()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Запуск панели под gunicorn с несколькими воркерами')
+    parser.add_argument('--bind', default=os.environ.get('DASHBOARD_BIND', '0.0.0.0:8050'))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('DASHBOARD_WORKERS', os.cpu_count() or 1)))
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('DASHBOARD_THREADS', 4)),
+                        help='потоков на воркер')
+    parser.add_argument('--max-requests', type=int, default=int(os.environ.get('DASHBOARD_MAX_REQUESTS', 1000)),
+                        help='воркер плавно перезапускается после стольких запросов; 0 — без перезапуска')
+    parser.add_argument('--max-requests-jitter', type=int, default=100)
+    parser.add_argument('--timeout', type=int, default=60)
+    parser.add_argument('--graceful-timeout', type=int, default=30)
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise SystemExit('Для production-запуска нужен gunicorn: pip install gunicorn')
+
+    class DashboardApplication(BaseApplication):
+        def __init__(self, application, options):
+            self.application = application
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
+
+    options = {
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': 'gthread' if args.threads > 1 else 'sync',
+        'max_requests': args.max_requests,
+        'max_requests_jitter': args.max_requests_jitter,
+        'timeout': args.timeout,
+        'graceful_timeout': args.graceful_timeout,
+        'preload_app': True,
+        'post_fork': post_fork,
+    }
+    DashboardApplication(prepare(), options).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+# Генератор синтетических данных в схеме ecommerce_customer_data_custom_ratios.csv.
+# Файл пишется порциями по CHUNK_ROWS строк, поэтому объём памяти генератора не зависит
+# от числа строк (от десятков тысяч до сотни миллионов). Одинаковый seed даёт одинаковый файл
+
+COLUMNS = [
+    'Customer ID', 'Purchase Date', 'Product Category', 'Product Price', 'Quantity',
+    'Total Purchase Amount', 'Payment Method', 'Customer Age', 'Returns', 'Customer Name',
+    'Age', 'Gender', 'Churn',
+]
+CATEGORIES = np.array(['Books', 'Clothing', 'Home', 'Electronics'], dtype=object)
+PAYMENT_METHODS = np.array(['Credit Card', 'PayPal', 'Cash', 'Crypto'], dtype=object)
+GENDERS = np.array(['Male', 'Female'], dtype=object)
+FIRST_NAMES = np.array([
+    'James', 'Mary', 'John', 'Patricia', 'Robert', 'Jennifer', 'Michael', 'Linda',
+    'William', 'Elizabeth', 'David', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica',
+], dtype=object)
+LAST_NAMES = np.array([
+    'Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis',
+    'Rodriguez', 'Martinez', 'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas',
+], dtype=object)
+
+CHUNK_ROWS = 1_000_000
+
+
+# Атрибуты клиента (возраст, пол, отток, имя) выводятся из его ID детерминированно,
+# поэтому совпадают во всех порциях и не требуют таблицы на все ID
+def _customer_attributes(ids, seed):
+    rng = np.random.default_rng([seed, 0])
+    salt = rng.integers(1, 2 ** 31)
+    mixed = (ids * 2654435761 + salt) % (2 ** 32)
+    age = 18 + mixed % 53
+    gender = GENDERS[(mixed >> 7) % 2]
+    churn = ((mixed >> 9) % 5 == 0).astype(np.int64)
+    first = FIRST_NAMES[(mixed >> 11) % len(FIRST_NAMES)]
+    last = LAST_NAMES[(mixed >> 15) % len(LAST_NAMES)]
+    names = pd.Series(first) + ' ' + pd.Series(last)
+    return age, gender, churn, names.to_numpy()
+
+
+def generate_chunk(rows, customers, start, end, seed, chunk_index):
+    rng = np.random.default_rng([seed, chunk_index + 1])
+    ids = rng.integers(1, customers + 1, rows)
+    age, gender, churn, names = _customer_attributes(ids, seed)
+    span = (end - start) // np.timedelta64(1, 's')
+    dates = start + rng.integers(0, span, rows).astype('timedelta64[s]')
+    price = rng.integers(10, 501, rows)
+    quantity = rng.integers(1, 6, rows)
+    returns = rng.choice(np.array([0.0, 1.0, np.nan]), rows, p=[0.4, 0.4, 0.2])
+    return pd.DataFrame({
+        'Customer ID': ids,
+        'Purchase Date': dates,
+        'Product Category': CATEGORIES[rng.integers(0, len(CATEGORIES), rows)],
+        'Product Price': price,
+        'Quantity': quantity,
+        'Total Purchase Amount': price * quantity,
+        'Payment Method': PAYMENT_METHODS[rng.integers(0, len(PAYMENT_METHODS), rows)],
+        'Customer Age': age,
+        'Returns': returns,
+        'Customer Name': names,
+        'Age': age,
+        'Gender': gender,
+        'Churn': churn,
+    }, columns=COLUMNS)
+
+
+def generate_csv(path, rows, seed=0, customers=None, start='2020-01-01', end='2023-09-13'):
+    customers = customers or max(rows // 5, 1)
+    start = np.datetime64(start, 's')
+    end = np.datetime64(end, 's')
+    written = 0
+    chunk_index = 0
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        while written < rows:
+            size = min(CHUNK_ROWS, rows - written)
+            chunk = generate_chunk(size, customers, start, end, seed, chunk_index)
+            chunk.to_csv(f, index=False, header=written == 0, date_format='%Y-%m-%d %H:%M:%S')
+            written += size
+            chunk_index += 1
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Генерация синтетического CSV в схеме датасета панели')
+    parser.add_argument('path')
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--customers', type=int, default=None, help='по умолчанию rows / 5')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate_csv(args.path, args.rows, seed=args.seed, customers=args.customers)
+
+
+if __name__ == '__main__':
+    main()
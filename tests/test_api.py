@@ -0,0 +1,37 @@
+import pytest
+
+from api import normalize
+
+
+# Эквивалентные запросы приводятся к одному виду и получают один ETag
+def test_equivalent_queries_normalize_alike():
+    first = normalize({'start_date': '2021-01-01 10:00', 'categories': ['Home', 'Books', 'Home'], 'age': '0'})
+    second = normalize({'start_date': '2021-01-01', 'categories': 'Books,Home', 'age': None})
+    assert first == second
+    assert first['age'] is None and first['categories'] == ['Books', 'Home']
+
+
+def test_integer_age():
+    assert normalize({'age': '30'})['age'] == 30
+    assert normalize({'age': 30.0})['age'] == 30
+
+
+@pytest.mark.parametrize('query', [
+    {'categories': [['Books']]},
+    {'categories': ['Books', 1]},
+    {'by': [None]},
+    {'measures': [{'name': 'count'}]},
+    {'age': 30.5},
+    {'age': True},
+    {'age': [30]},
+    {'start_date': ['2021-01-01']},
+    {'start_date': 5},
+    {'end_date': 20210101},
+    {'end_date': False},
+    {'end_date': 'yesterday'},
+    {'gender': 1},
+    {'unknown': 1},
+])
+def test_invalid_query_is_value_error(query):
+    with pytest.raises(ValueError):
+        normalize(query)
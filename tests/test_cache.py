@@ -0,0 +1,143 @@
+import pickle
+import threading
+import time
+
+import pytest
+
+from cache import ResultCache
+
+WAITERS = 4
+
+
+def size_of(value):
+    return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def value(n):
+    return b'x' * n
+
+
+# Бюджет на две записи: запись, к которой обращались последней, остаётся, вытесняется самая давняя
+def test_lru_eviction_by_bytes():
+    cache = ResultCache(max_bytes=size_of(value(100)) * 2)
+    cache.put('a', value(100))
+    cache.put('b', value(100))
+    assert cache.get('a')[0] == value(100)
+    cache.put('c', value(100))
+
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    assert cache.stats() == {
+        'hits': 3, 'misses': 1, 'evictions': 1, 'entries': 2,
+        'bytes': size_of(value(100)) * 2, 'max_bytes': size_of(value(100)) * 2,
+    }
+
+    # Запись больше бюджета не сохраняется и ничего не вытесняет
+    cache.put('d', value(1000))
+    assert cache.get('d') is None and cache.stats()['entries'] == 2
+
+    # Повторная запись по тому же ключу заменяет размер, а не добавляет его; большая запись
+    # вытесняет столько старых, сколько нужно
+    cache.put('a', value(10))
+    assert cache.bytes == size_of(value(10)) + size_of(value(100))
+    cache.put('e', value(150))
+    assert [key for key in ('a', 'c', 'e') if cache.get(key) is not None] == ['a', 'e']
+    assert cache.evictions == 2
+    assert cache.bytes == size_of(value(10)) + size_of(value(150))
+
+
+def test_counters_discard_and_clear():
+    cache = ResultCache()
+    calls = []
+    for _ in range(3):
+        assert cache.get_or_compute(('f', 'v1', 1), lambda: calls.append(1) or 'one') == 'one'
+    cache.get_or_compute(('f', 'v2', 1), lambda: 'two')
+    assert calls == [1]
+    assert (cache.hits, cache.misses, cache.evictions) == (2, 2, 0)
+
+    cache.discard(lambda key: key[1] != 'v2')
+    assert cache.get(('f', 'v1', 1)) is None and cache.get(('f', 'v2', 1))[0] == 'two'
+    assert cache.evictions == 1 and cache.stats()['entries'] == 1
+    cache.clear()
+    assert cache.stats()['entries'] == 0 and cache.bytes == 0
+
+
+def run_threads(targets):
+    threads = [threading.Thread(target=target) for target in targets]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def join(threads):
+    for thread in threads:
+        thread.join(timeout=10)
+        assert not thread.is_alive()
+
+
+# Поток-владелец считает значение, пока остальные потоки с тем же ключом промахнулись
+# и ждут; release отпускает расчёт, когда все они прошли проверку кэша
+def coalesced(cache, compute, waiter_compute):
+    started, release = threading.Event(), threading.Event()
+    results, errors = {}, {}
+
+    def owner_compute():
+        started.set()
+        assert release.wait(timeout=10)
+        return compute()
+
+    def call(name, func):
+        try:
+            results[name] = cache.get_or_compute('key', func)
+        except Exception as error:
+            errors[name] = error
+
+    owner = run_threads([lambda: call('owner', owner_compute)])
+    assert started.wait(timeout=10)
+    waiters = run_threads([lambda i=i: call(i, waiter_compute) for i in range(WAITERS)])
+    deadline = time.monotonic() + 10
+    while cache.misses < 1 + WAITERS:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+    release.set()
+    join(owner + waiters)
+    return results, errors
+
+
+def test_inflight_requests_compute_once():
+    cache = ResultCache()
+    calls = []
+    results, errors = coalesced(
+        cache, lambda: calls.append('owner') or 'value', lambda: calls.append('waiter') or 'other')
+
+    assert calls == ['owner'] and errors == {}
+    assert results == {'owner': 'value', **{i: 'value' for i in range(WAITERS)}}
+    assert cache.get('key')[0] == 'value'
+    assert cache._inflight == {}
+
+
+# Если расчёт владельца упал, ошибку получает только он, а ждавшие потоки считают значение
+# сами; упавший результат в кэш не попадает
+def test_waiters_recompute_after_failure():
+    cache = ResultCache()
+    calls = []
+
+    def fail():
+        calls.append('owner')
+        raise ValueError('boom')
+
+    lock = threading.Lock()
+
+    def waiter_compute():
+        with lock:
+            calls.append('waiter')
+        return 'recomputed'
+
+    results, errors = coalesced(cache, fail, waiter_compute)
+
+    assert isinstance(errors.pop('owner'), ValueError) and errors == {}
+    assert results == {i: 'recomputed' for i in range(WAITERS)}
+    assert sorted(calls) == ['owner'] + ['waiter'] * WAITERS
+    assert cache._inflight == {}
+    with pytest.raises(ValueError):
+        cache.get_or_compute('key', fail)
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from cube import build_cube, merge_cubes, totals_from_rows
+from data import DATE_COLUMN
+from filters import apply_predicates, date_window
+
+GENDERS = ['Male', 'Female']
+CATEGORIES = ['Books', 'Clothing', 'Electronics', 'Home']
+
+
+# Случайные строки в раскладке снимка: отсортированы по дате, строки без даты — в конце,
+# измерения — Categorical, у части строк пропущены пол и Returns
+def random_frame(seed, rows=2000, undated=5):
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2021-01-01T00:00:00', 's')
+    dates = np.sort(start + rng.integers(0, 400 * 86400, rows).astype('timedelta64[s]')).astype('datetime64[ns]')
+    dates = np.concatenate([dates, np.full(undated, np.datetime64('NaT'), dtype='datetime64[ns]')])
+    size = rows + undated
+    genders = rng.choice(GENDERS + [None], size, p=[0.45, 0.45, 0.1])
+    returns = rng.choice([0.0, 1.0, np.nan], size)
+    return pd.DataFrame({
+        DATE_COLUMN: dates,
+        'Gender': pd.Categorical(genders, categories=GENDERS),
+        'Age': rng.integers(18, 25, size),
+        'Product Category': pd.Categorical(rng.choice(CATEGORIES, size), categories=CATEGORIES),
+        'Total Purchase Amount': rng.integers(10, 5000, size),
+        'Churn': rng.integers(0, 2, size),
+        'Returns': returns,
+    })
+
+
+# Случайный запрос страницы: диапазон дат (в том числе выходящий за данные) и фильтры
+def random_query(rng):
+    first = pd.Timestamp('2020-12-01') + pd.Timedelta(days=int(rng.integers(0, 450)))
+    last = first + pd.Timedelta(days=int(rng.integers(0, 120)))
+    gender = rng.choice([None, 'Male', 'Female'])
+    age = rng.choice([None, 0, int(rng.integers(18, 25))])
+    categories = None if rng.random() < 0.3 else list(rng.choice(CATEGORIES, int(rng.integers(1, 4)), replace=False))
+    return first.strftime('%Y-%m-%d'), last.strftime('%Y-%m-%d'), gender, age, categories
+
+
+def rows_for(frame, start_date, end_date, gender, age, categories):
+    return apply_predicates(date_window(frame, start_date, end_date), gender=gender, age=age, categories=categories)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_totals_match_rows(seed):
+    frame = random_frame(seed)
+    cube = build_cube(frame)
+    rng = np.random.default_rng(seed + 100)
+    for _ in range(50):
+        query = random_query(rng)
+        expected = totals_from_rows(rows_for(frame, *query))
+        totals = cube.totals(*query)
+        assert totals.keys() == expected.keys()
+        for name, value in expected.items():
+            assert totals[name] == pytest.approx(value), (query, name)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_daily_matches_rows(seed):
+    frame = random_frame(seed)
+    cube = build_cube(frame)
+    rng = np.random.default_rng(seed + 200)
+    for _ in range(30):
+        query = random_query(rng)
+        rows = rows_for(frame, *query)
+        expected = rows.groupby(rows[DATE_COLUMN].dt.normalize())['Total Purchase Amount'].sum()
+        days, values = cube.daily('revenue', *query)
+        assert list(days) == list(expected.index), query
+        np.testing.assert_allclose(values, expected.to_numpy(dtype=np.float64))
+
+
+# Куб, собранный по частям (порции out-of-core, дописанные строки), совпадает с кубом по всем строкам
+def test_merged_cube_matches_whole():
+    frame = random_frame(7)
+    whole = build_cube(frame)
+    merged = merge_cubes(build_cube(frame.iloc[:1200]), build_cube(frame.iloc[1200:]))
+    rng = np.random.default_rng(7)
+    for _ in range(30):
+        query = random_query(rng)
+        expected = whole.totals(*query)
+        for name, value in merged.totals(*query).items():
+            assert value == pytest.approx(expected[name]), (query, name)
+
+
+def test_only_undated_rows():
+    frame = random_frame(0, rows=0, undated=3)
+    assert build_cube(frame).totals('2021-01-01', '2021-12-31')['count'] == 0
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import data
+from customers import CustomerTotals, top_k
+from data import DATE_COLUMN
+from filters import date_window
+
+
+# Покупки в раскладке снимка; суммы и возвраты — небольшие целые, поэтому у клиентов много
+# равных сумм, у части строк возвраты пропущены
+def random_snapshot(seed, rows=2000, customers=150):
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2022-01-01T00:00:00', 's')
+    dates = np.sort(start + rng.integers(0, 90 * 86400, rows).astype('timedelta64[s]')).astype('datetime64[ns]')
+    ids = rng.integers(5000, 5000 + customers, rows)
+    frame = pd.DataFrame({
+        DATE_COLUMN: dates,
+        'Customer ID': ids,
+        'Customer Name': [f'Customer {value}' for value in ids],
+        'Total Purchase Amount': rng.integers(1, 4, rows) * 100,
+        'Returns': rng.choice([0.0, 1.0, np.nan], rows),
+    })
+    return data.Snapshot(frame, 'test', 0)
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_top_k_matches_full_sort(seed):
+    rng = np.random.default_rng(seed)
+    size = int(rng.integers(0, 60))
+    values = rng.integers(0, 5, size).astype(np.float64)
+    keys = rng.permutation(size)
+    order = np.lexsort((keys, -values))
+    for k in (1, 3, 10, 100):
+        for offset in sorted({0, 2, max(size - 1, 0), size, size + 5}):
+            np.testing.assert_array_equal(top_k(values, keys, k, offset), order[offset:offset + k])
+
+
+# Топ по окну дат, накопленный по одной или нескольким порциям, совпадает с
+# groupby().sum().sort_values(); при равных суммах выше клиент с меньшим ID
+@pytest.mark.parametrize('seed', range(4))
+@pytest.mark.parametrize('parts', [1, 3])
+@pytest.mark.parametrize('start_date, end_date', [
+    ('2022-01-01', '2022-03-31'),
+    ('2022-02-10', '2022-02-12'),
+    ('2022-02-10', '2022-02-10'),
+    ('2023-01-01', '2023-02-01'),
+])
+def test_top_matches_groupby(seed, parts, start_date, end_date):
+    snapshot = random_snapshot(seed)
+    window = date_window(snapshot.df, start_date, end_date)
+    totals = CustomerTotals(snapshot, ['Total Purchase Amount', 'Returns'])
+    for part in np.array_split(np.arange(len(window)), parts):
+        totals.add(window.iloc[part[0]:part[-1] + 1] if len(part) else window.iloc[0:0])
+
+    for column in ('Total Purchase Amount', 'Returns'):
+        expected = window.groupby('Customer ID')[column].sum().sort_values(ascending=False, kind='stable')
+        size = len(expected)
+        for k, offset in [(5, 0), (5, 3), (1000, 0), (5, max(size - 2, 0)), (5, size), (5, size + 10)]:
+            top = totals.top(column, k=k, offset=offset)
+            selected = expected.iloc[offset:offset + k]
+            assert top['Customer ID'].tolist() == selected.index.tolist()
+            assert top[column].tolist() == pytest.approx(selected.astype(np.float64).tolist())
+            assert top['Customer Name'].tolist() == [f'Customer {value}' for value in selected.index]
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import distinct
+from data import DATE_COLUMN
+from distinct import build_index, merge_indexes
+from filters import apply_predicates, date_window
+
+GENDERS = ['Male', 'Female']
+CUSTOMERS = 300
+
+
+# Случайные покупки в раскладке снимка (по дате, строки без даты — в конце). Частые возрасты
+# дают ячейки с большой долей клиентов (битовые карты), редкие — с несколькими (массивы кодов)
+def random_frame(seed, rows=6000, undated=5):
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2022-01-01T00:00:00', 's')
+    dates = np.sort(start + rng.integers(0, 60 * 86400, rows).astype('timedelta64[s]')).astype('datetime64[ns]')
+    dates = np.concatenate([dates, np.full(undated, np.datetime64('NaT'), dtype='datetime64[ns]')])
+    size = rows + undated
+    return pd.DataFrame({
+        DATE_COLUMN: dates,
+        'Customer ID': rng.integers(1000, 1000 + CUSTOMERS, size),
+        'Gender': pd.Categorical(rng.choice(GENDERS + [None], size, p=[0.45, 0.45, 0.1]), categories=GENDERS),
+        'Age': rng.choice([30, 40, 50, 60, 70], size, p=[0.46, 0.46, 0.04, 0.02, 0.02]),
+    })
+
+
+def build(frame, customers=CUSTOMERS):
+    return build_index(frame, frame['Customer ID'].to_numpy() - 1000, customers, mode='exact')
+
+
+def random_query(rng):
+    first = pd.Timestamp('2021-12-20') + pd.Timedelta(days=int(rng.integers(0, 80)))
+    last = first + pd.Timedelta(days=int(rng.integers(0, 40)))
+    gender = rng.choice([None, 'Male', 'Female'])
+    age = rng.choice([None, 0, 30, 50, 70, 99])
+    return first.strftime('%Y-%m-%d'), last.strftime('%Y-%m-%d'), gender, age
+
+
+def check_counts(index, frame, seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(100):
+        start_date, end_date, gender, age = query = random_query(rng)
+        rows = apply_predicates(date_window(frame, start_date, end_date), gender=gender, age=age)
+        assert index.count(*query) == rows['Customer ID'].nunique(), query
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_exact_count_matches_nunique(seed):
+    frame = random_frame(seed)
+    index = build(frame)
+    sparse = np.diff(index.offsets) > 0
+    assert len(index.dense_positions) and sparse.any()
+    check_counts(index, frame, seed)
+
+
+# Индекс, слитый из порций (out-of-core) или из дописанных строк с новыми клиентами,
+# считает так же, как индекс по всем строкам
+@pytest.mark.parametrize('split', [0, 3000, 5990, 6005])
+def test_merged_index_matches_nunique(split):
+    frame = random_frame(11)
+    left, right = frame.iloc[:split], frame.iloc[split:]
+    known = left['Customer ID'].max() - 999 if len(left) else 0
+    index = merge_indexes(build(left, known), build(right))
+    assert index.customers == CUSTOMERS
+    check_counts(index, frame, split)
+
+
+def test_only_undated_rows():
+    frame = random_frame(0, rows=0, undated=3)
+    assert build(frame).count('2022-01-01', '2022-12-31') == 0
+
+
+# Свёртки по блокам дней и по дням: диапазоны с началом и концом внутри блоков и на их
+# границах считаются так же, в том числе после слияния порций; широкий диапазон без фильтра
+# по возрасту читается только из блоков
+@pytest.mark.parametrize('block_days', [1, 5, 32])
+@pytest.mark.parametrize('split', [0, 3000])
+def test_block_rollups_match_nunique(monkeypatch, block_days, split):
+    monkeypatch.setattr(distinct, 'BLOCK_DAYS', block_days)
+    frame = random_frame(block_days)
+    index = merge_indexes(build(frame.iloc[:split]), build(frame.iloc[split:]))
+    check_counts(index, frame, block_days + split)
+    for gender in (None, 'Male'):
+        pieces = index._pieces(None, None, gender, None)
+        assert [piece[0] for piece in pieces] == [index.rollups[bool(gender)][0]]
+        assert len(pieces[0][0].cells) <= (60 // block_days + 2) * (len(GENDERS) + 1 if gender else 1)
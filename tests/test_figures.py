@@ -0,0 +1,84 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+from plotly.io.json import to_json_plotly
+
+import figures
+from pages import clients, home, purchase
+
+CATEGORIES = ['Книги', 'Одежда', 'Дом', 'Электроника', np.nan, 'a', 'b']
+
+
+# Фигура из шаблона и фигура, построенная plotly, сравниваются в том виде, в каком Dash
+# отправляет их в браузер
+def assert_same_figure(monkeypatch, make):
+    monkeypatch.setattr(figures, 'ENABLED', True)
+    fast = make()
+    monkeypatch.setattr(figures, 'ENABLED', False)
+    slow = make()
+    assert isinstance(fast, dict) and not isinstance(slow, dict)
+    assert json.loads(to_json_plotly(fast)) == json.loads(to_json_plotly(slow.to_plotly_json()))
+
+
+# Случайный набор значений цвета: пустой, только пропуск, пропуск среди значений
+def color_values(seed):
+    rng = np.random.default_rng(seed)
+    if seed == 0:
+        return []
+    if seed == 1:
+        return [np.nan]
+    return list(rng.choice(np.array(CATEGORIES, dtype=object), int(rng.integers(1, len(CATEGORIES))), replace=False))
+
+
+@pytest.mark.parametrize('seed', range(8))
+def test_purchase_figures(monkeypatch, seed):
+    rng = np.random.default_rng(seed)
+    values = color_values(seed)
+    counts = rng.integers(0, 1000, len(values))
+    sums = np.where(rng.random(len(values)) < 0.2, np.nan, rng.random(len(values)) * 1e5)
+    categories = pd.Series(values, dtype=object)
+
+    sales = pd.DataFrame({'Product Category': categories, 'Count': counts})
+    assert_same_figure(monkeypatch, lambda: figures.grouped(
+        'test.sales', purchase.build_sales_bar_chart, sales, 'Product Category', 'Product Category', 'Count'))
+    profit = pd.DataFrame({'Product Category': categories, 'Total Purchase Amount': sums})
+    assert_same_figure(monkeypatch, lambda: figures.grouped(
+        'test.profit', purchase.build_profit_bar_chart, profit, 'Product Category', 'Product Category', 'Total Purchase Amount'))
+    scatter = pd.DataFrame({'Product Category': categories, 'Total Purchase Amount': sums, 'Purchase Count': counts})
+    assert_same_figure(monkeypatch, lambda: figures.grouped(
+        'test.scatter', purchase.build_scatter_plot, scatter,
+        'Product Category', 'Purchase Count', 'Total Purchase Amount', size='Purchase Count'))
+    payment = pd.DataFrame({'Payment Method': categories, 'Percentage': sums})
+    assert_same_figure(monkeypatch, lambda: figures.pie(
+        'test.pie', purchase.build_payment_pie_chart, payment, 'Payment Method', 'Percentage'))
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_churn_bar_chart(monkeypatch, seed):
+    rng = np.random.default_rng(seed)
+    rows = [(age, gender) for age in range(18, 40) for gender in ['Мужчина', 'Женщина', np.nan] if rng.random() < 0.3 * seed]
+    frame = pd.DataFrame({
+        'Age': pd.Series([age for age, _ in rows], dtype=np.int64),
+        'Gender': pd.Series([gender for _, gender in rows], dtype=object),
+        'Count': np.arange(len(rows), dtype=np.int64),
+    })
+    assert_same_figure(monkeypatch, lambda: figures.grouped(
+        'test.churn', clients.build_churn_bar_chart, frame, 'Gender', 'Age', 'Count'))
+
+
+@pytest.mark.parametrize('value, reference', [(0, None), (1.5, 2.0), (np.float64(3.25), np.float64(0.1)), (np.int64(7), None)])
+def test_indicators(monkeypatch, value, reference):
+    assert_same_figure(monkeypatch, lambda: home.delta_indicator(value, 'Выручка', reference, home.REVENUE_DELTA))
+    assert_same_figure(monkeypatch, lambda: home.delta_indicator(value, 'Отток клиентов (%)', reference, home.CHURN_DELTA))
+    assert_same_figure(monkeypatch, lambda: home.customers_indicator(np.int64(int(value))))
+
+
+@pytest.mark.parametrize('days', [0, 1, 40])
+def test_revenue_series(monkeypatch, days):
+    dates = pd.date_range('2023-01-01', periods=days)
+    revenue = np.where(np.arange(days) % 5 == 0, np.nan, np.arange(days) * 1.5)
+    points = [(dates.date, revenue)] + [(dates.date[::2], np.full(len(dates[::2]), np.nan))] * 6
+    assert_same_figure(monkeypatch, lambda: figures.series(
+        'test.revenue', home.build_revenue_chart, points, title={'text': home.REVENUE_TITLE}, uirevision='key'))
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from grouping import group
+
+ROWS = 500
+
+
+# Колонки разных видов ключей: Categorical с пропусками и невстреченными категориями, целые,
+# даты по дням (с пропусками и без), float и строки с пропусками; меры — float с NaN, целые и маска
+def random_frame(seed, rows=ROWS):
+    rng = np.random.default_rng(seed)
+    days = np.datetime64('2021-01-01') + rng.integers(0, 30, rows).astype('timedelta64[D]')
+    days_with_nat = days.astype('datetime64[ns]').copy()
+    days_with_nat[rng.random(rows) < 0.1] = np.datetime64('NaT')
+    amounts = rng.integers(1, 1000, rows).astype(np.float64)
+    amounts[rng.random(rows) < 0.1] = np.nan
+    returns = rng.choice([0.0, 1.0, np.nan], rows)
+    return pd.DataFrame({
+        'Gender': pd.Categorical(rng.choice(['Male', 'Female', None], rows), categories=['Female', 'Male', 'Other']),
+        'Age': rng.integers(18, 80, rows),
+        'Day': days.astype('datetime64[ns]'),
+        'DayWithNaT': days_with_nat,
+        'Returns': returns,
+        'Method': rng.choice(['Cash', 'Card', None], rows),
+        'Amount': amounts,
+        'Quantity': rng.integers(1, 6, rows),
+        'Churn': rng.integers(0, 2, rows).astype(bool),
+    })
+
+
+KEYS = [
+    ['Gender'],
+    ['Age'],
+    ['Day'],
+    ['DayWithNaT'],
+    ['Returns'],
+    ['Method'],
+    ['Age', 'Gender'],
+    ['Day', 'Gender', 'Returns'],
+    ['Method', 'DayWithNaT'],
+]
+
+
+# Пропуск в ключе MultiIndex pandas хранит в уровне, а ядро — кодом -1, поэтому сравниваются
+# колонки ключей после reset_index
+def assert_same(result, expected):
+    pd.testing.assert_frame_equal(result.reset_index(), expected.reset_index())
+
+
+def both(frame, by, dropna):
+    measures = {'Amount': 'Amount', 'Quantity': 'Quantity', 'churned': frame['Churn'].to_numpy()}
+    return (group(frame, by, measures, dropna=dropna, engine='bincount'),
+            group(frame, by, measures, dropna=dropna, engine='pandas'))
+
+
+@pytest.mark.parametrize('by', KEYS, ids='-'.join)
+@pytest.mark.parametrize('dropna', [True, False])
+@pytest.mark.parametrize('seed', range(3))
+def test_matches_pandas(by, dropna, seed):
+    result, expected = both(random_frame(seed), by, dropna)
+    assert_same(result, expected)
+    # Только встреченные сочетания: у невстреченной категории Other строк нет
+    assert (result['size'] > 0).all()
+
+
+@pytest.mark.parametrize('by', KEYS, ids='-'.join)
+def test_window_of_rows(by):
+    # Отфильтрованное окно: индекс строк не с нуля и не подряд
+    frame = random_frame(5)
+    window = frame.iloc[100:400][frame['Age'].iloc[100:400].to_numpy() > 40]
+    result, expected = both(window, by, False)
+    assert_same(result, expected)
+
+
+@pytest.mark.parametrize('by', KEYS, ids='-'.join)
+def test_empty_frame(by):
+    result, expected = both(random_frame(0).iloc[:0], by, True)
+    assert_same(result, expected)
+    assert len(result) == 0
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import cube
+import data
+from data import DATE_COLUMN
+from pages import home
+
+
+def random_snapshot(seed, rows=3000):
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2021-01-01T00:00:00', 's')
+    dates = np.sort(start + rng.integers(0, 200 * 86400, rows).astype('timedelta64[s]')).astype('datetime64[ns]')
+    frame = pd.DataFrame({
+        DATE_COLUMN: dates,
+        'Gender': pd.Categorical(rng.choice(['Male', 'Female'], rows), categories=['Female', 'Male']),
+        'Age': rng.integers(20, 24, rows),
+        'Product Category': pd.Categorical(rng.choice(['Books', 'Home'], rows), categories=['Books', 'Home']),
+        'Total Purchase Amount': rng.integers(10, 5000, rows),
+        'Churn': rng.integers(0, 2, rows),
+        'Returns': rng.choice([0.0, 1.0], rows),
+    })
+    return data.Snapshot(frame, 'test', 0)
+
+
+# Скользящие средние по кубу и по строкам совпадают, в том числе на пустых, перевёрнутых,
+# однодневных диапазонах и диапазонах, выходящих за данные
+@pytest.mark.parametrize('start_date, end_date', [
+    (None, None),
+    ('2021-03-01', '2021-03-01'),
+    ('2021-03-01', '2021-05-15'),
+    ('2022-01-01', '2021-01-01'),
+    ('2020-06-01', '2021-01-20'),
+    ('2021-07-01', '2030-01-01'),
+    ('2025-01-01', '2025-02-01'),
+    ('2019-01-01', '2019-02-01'),
+])
+@pytest.mark.parametrize('gender, age', [(None, None), ('Female', 21)])
+def test_rolling_averages_match_rows(monkeypatch, start_date, end_date, gender, age):
+    snapshot = random_snapshot(3)
+    results = {}
+    for enabled in (True, False):
+        monkeypatch.setattr(cube, 'ENABLED', enabled)
+        results[enabled] = home.rolling_averages(snapshot, start_date, end_date, gender, age)
+    (cube_days, cube_revenue, cube_churn), (row_days, row_revenue, row_churn) = results[True], results[False]
+    assert list(cube_days) == list(row_days)
+    for window in home.ROLLING_WINDOWS:
+        np.testing.assert_allclose(cube_revenue[window], row_revenue[window])
+        np.testing.assert_allclose(cube_churn[window], row_churn[window])
@@ -0,0 +1,172 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import customers
+import data
+import ingest
+import precompute
+import synthetic
+from data import DATE_COLUMN
+from pages import clients, purchase
+
+
+# Порция строк CSV за [start, end) с теми же клиентами: часть строк с новой категорией
+# и новыми именами, часть — без даты
+def rows_between(start, end, seed, rows=300, undated=0):
+    chunk = synthetic.generate_chunk(rows, 80, np.datetime64(start, 's'), np.datetime64(end, 's'), 0, seed)
+    chunk.loc[::25, 'Product Category'] = 'Toys'
+    chunk.loc[::40, 'Customer Name'] = [f'Name {seed}-{i}' for i in range(len(chunk.loc[::40]))]
+    if undated:
+        chunk.loc[chunk.index[-undated:], 'Purchase Date'] = None
+    return chunk
+
+
+def write_rows(path, chunk, header=False):
+    with open(path, 'a', encoding='utf-8', newline='') as f:
+        chunk.to_csv(f, index=False, header=header, date_format='%Y-%m-%d %H:%M:%S')
+
+
+def append(snapshot, csv_path):
+    rows, offset = ingest.read_appended(csv_path, snapshot)
+    return snapshot.extend(rows, offset, data.tail_hash(csv_path, offset))
+
+
+# Снимок тех же строк, собранный по всему файлу с нуля (кэш в отдельном каталоге)
+def full_reload(csv_path, tmp_path):
+    path = str(tmp_path / 'full.csv')
+    shutil.copyfile(csv_path, path)
+    return data.load_snapshot(path)
+
+
+# Строки снимков сравниваются по значениям: новые значения измерений при дописывании на месте
+# стоят в конце словаря, а после полной сборки — по алфавиту
+def values(snapshot):
+    frame = snapshot.df
+    return frame.astype({name: object for name in frame.columns if isinstance(frame[name].dtype, pd.CategoricalDtype)})
+
+
+# Агрегаты всего снимка, которые переносятся в снимок с дописанными строками
+def aggregates(snapshot):
+    totals = customers.get_totals(snapshot)
+    dimension = customers.get_dimension(snapshot)
+    codes, amounts = totals.totals('Total Purchase Amount')
+    return {
+        'sales': purchase.get_sales(snapshot).sort_index(),
+        'age_gender': clients.age_gender_sizes(snapshot).sort_index(),
+        'gender': clients.gender_sizes(snapshot).sort_index(),
+        'totals': pd.Series(amounts, index=dimension.ids[codes]).sort_index(),
+    }
+
+
+def assert_same(extended, full):
+    pd.testing.assert_frame_equal(values(extended), values(full))
+    assert extended.date_bounds == full.date_bounds
+    meta, full_meta = extended.source[1], full.source[1]
+    for key in ('rows', 'first_date', 'last_date', 'dimensions', 'partitions'):
+        assert meta[key] == full_meta[key], key
+    expected = aggregates(full)
+    for name, value in aggregates(extended).items():
+        if isinstance(value, pd.DataFrame):
+            pd.testing.assert_frame_equal(value, expected[name], check_index_type=False)
+        else:
+            pd.testing.assert_series_equal(value, expected[name], check_index_type=False, check_names=False)
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    path = str(tmp_path / 'data.csv')
+    write_rows(path, rows_between('2021-01-01', '2021-03-01', seed=1), header=True)
+    return path
+
+
+# Строки после всех строк снимка дописываются в файлы колонок на месте; ранее открытый
+# снимок при этом не меняется
+@pytest.mark.parametrize('undated', [0, 7])
+def test_append_in_place_matches_full_reload(csv_path, tmp_path, undated):
+    snapshot = data.load_snapshot(csv_path)
+    before = values(snapshot).copy()
+    aggregates(snapshot)
+    write_rows(csv_path, rows_between('2021-03-01', '2021-04-15', seed=2, undated=undated))
+    extended = append(snapshot, csv_path)
+
+    assert extended.source[1]['directory'] == snapshot.version
+    assert_same(extended, full_reload(csv_path, tmp_path))
+    pd.testing.assert_frame_equal(values(snapshot), before)
+
+
+# Строки с датами среди уже загруженных и строки после строк без даты вставляются через копию
+# колонок в новый каталог, а следующие за ними — снова на месте, в файлы этого каталога
+def test_append_between_rows_matches_full_reload(csv_path, tmp_path):
+    snapshot = data.load_snapshot(csv_path)
+    aggregates(snapshot)
+    write_rows(csv_path, rows_between('2021-02-20', '2021-03-10', seed=3))
+    snapshot = append(snapshot, csv_path)
+    copied = snapshot.version
+    assert snapshot.source[1]['directory'] == copied
+    write_rows(csv_path, rows_between('2021-03-10', '2021-04-01', seed=4, undated=3))
+    snapshot = append(snapshot, csv_path)
+    assert snapshot.source[1]['directory'] == copied
+    write_rows(csv_path, rows_between('2021-04-01', '2021-05-01', seed=5))
+    snapshot = append(snapshot, csv_path)
+    assert snapshot.source[1]['directory'] == snapshot.version
+    assert_same(snapshot, full_reload(csv_path, tmp_path))
+
+
+# Несколько дописываний на месте подряд, затем второй воркер со снимком исходной версии
+# читает те же строки и получает готовую версию, не дописывая их повторно
+def test_appends_are_shared_between_workers(csv_path, tmp_path):
+    first = data.load_snapshot(csv_path)
+    second = data.load_snapshot(csv_path)
+    aggregates(first)
+    for seed, (start, end) in enumerate([('2021-03-01', '2021-03-20'), ('2021-03-20', '2021-04-02')], start=6):
+        write_rows(csv_path, rows_between(start, end, seed=seed))
+        first = append(first, csv_path)
+    second = append(second, csv_path)
+
+    assert second.version == first.version
+    full = full_reload(csv_path, tmp_path)
+    assert_same(first, full)
+    assert_same(second, full)
+    root = data._cache_root(csv_path)
+    assert sorted(entry for entry in os.listdir(root) if '+' in entry) == [f'{first.version}.json']
+
+
+# Опрос файла текущего снимка без публикации и прогрева
+def poll(monkeypatch, snapshot, csv_path):
+    published = []
+    monkeypatch.setattr(data, 'current', lambda: snapshot)
+    monkeypatch.setattr(data, 'publish', published.append)
+    monkeypatch.setattr(precompute, 'WARMUP', False)
+    result = ingest.poll(csv_path)
+    assert published == ([] if result is snapshot else [result])
+    return result
+
+
+def test_poll_appends_rows(monkeypatch, csv_path, tmp_path):
+    snapshot = data.load_snapshot(csv_path)
+    assert poll(monkeypatch, snapshot, csv_path) is snapshot
+    write_rows(csv_path, rows_between('2021-03-01', '2021-04-01', seed=10))
+    updated = poll(monkeypatch, snapshot, csv_path)
+    assert updated.version.startswith(f'{snapshot.version}+')
+    assert_same(updated, full_reload(csv_path, tmp_path))
+
+
+# Файл, в котором изменились уже прочитанные байты, загружается заново, даже если он стал длиннее
+@pytest.mark.parametrize('position', [0.5, 0.999])
+def test_poll_reloads_rewritten_file(monkeypatch, csv_path, tmp_path, position):
+    snapshot = data.load_snapshot(csv_path)
+    with open(csv_path, 'rb') as f:
+        content = bytearray(f.read())
+    at = content.index(b',', int(len(content) * position)) - 1
+    content[at:at + 1] = b'7' if content[at:at + 1] != b'7' else b'8'
+    with open(csv_path, 'wb') as f:
+        f.write(content)
+    write_rows(csv_path, rows_between('2021-03-01', '2021-04-01', seed=11))
+
+    updated = poll(monkeypatch, snapshot, csv_path)
+    assert '+' not in updated.version and updated.version != snapshot.version
+    assert_same(updated, full_reload(csv_path, tmp_path))
@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import data
+from data import DATE_COLUMN
+from filters import date_window, day_bounds
+from partitions import PartitionStore
+
+MONTHS = ['2021-01', '2021-02', '2021-03', '2021-04']
+
+
+# По rows строк в каждом месяце, первая и последняя — ровно на границах месяца,
+# в конце — строки без даты. Возраст в каждом месяце свой, чтобы разделы отсекались и по нему
+def month_frame(rows=100, undated=3):
+    rng = np.random.default_rng(0)
+    dates, ages = [], []
+    for number, month in enumerate(MONTHS):
+        first = np.datetime64(month, 's')
+        last = (np.datetime64(month, 'M') + 1).astype('datetime64[s]') - 1
+        inner = first + rng.integers(0, (last - first).astype(np.int64), rows - 2).astype('timedelta64[s]')
+        dates.append(np.sort(np.concatenate([[first], inner, [last]])))
+        ages.append(rng.integers(20 + 10 * number, 30 + 10 * number, rows))
+    dates = np.concatenate(dates + [np.full(undated, np.datetime64('NaT'), dtype='datetime64[s]')])
+    return pd.DataFrame({
+        DATE_COLUMN: dates.astype('datetime64[ns]'),
+        'Age': np.concatenate(ages + [np.full(undated, 25)]),
+        'Total Purchase Amount': rng.integers(10, 5000, len(dates)),
+    })
+
+
+def store_for(frame, hot_bytes=1 << 30, copy=False):
+    numeric = {name: frame[name].to_numpy() for name in ('Age', 'Total Purchase Amount')}
+    partitions = data.month_partitions(frame[DATE_COLUMN].to_numpy(), numeric)
+    return PartitionStore(
+        partitions, lambda partition: frame.iloc[partition['start']:partition['stop']], hot_bytes=hot_bytes, copy=copy)
+
+
+def window_rows(store, start_date, end_date, age=None):
+    start, end = day_bounds(start_date, end_date)
+    parts = list(store.window(start, end, age))
+    return pd.concat(parts) if parts else None
+
+
+# Окна, которые начинаются и заканчиваются на границах месяцев и рядом с ними, совпадают
+# со срезом по датам, а отбираются только месяцы, пересекающиеся с окном
+@pytest.mark.parametrize('start_date, end_date, months', [
+    ('2021-01-01', '2021-01-31', [0]),
+    ('2021-01-31', '2021-02-01', [0, 1]),
+    ('2021-02-01', '2021-02-28', [1]),
+    ('2021-02-28', '2021-03-01', [1, 2]),
+    ('2021-03-15', '2021-04-30', [2, 3]),
+    ('2020-12-01', '2020-12-31', []),
+    ('2021-05-01', '2021-06-01', []),
+    ('2020-01-01', '2030-01-01', [0, 1, 2, 3]),
+    (None, '2021-01-31', [0]),
+    ('2021-04-30', None, [3, 4]),
+    (None, None, [0, 1, 2, 3, 4]),
+])
+def test_window_matches_date_window(start_date, end_date, months):
+    frame = month_frame()
+    store = store_for(frame)
+    start, end = day_bounds(start_date, end_date)
+    assert store.select(start, end) == months
+    expected = date_window(frame, start_date, end_date)
+    rows = window_rows(store, start_date, end_date)
+    if not months:
+        assert rows is None and expected.empty
+    else:
+        pd.testing.assert_frame_equal(rows, expected)
+
+
+# Разделы, в которых нет строк с выбранным возрастом, отсекаются по min/max; 0 — без фильтра
+@pytest.mark.parametrize('age, months', [
+    (25, [0]), (45, [2]), (55, [3]), (65, []), (0, [0, 1, 2, 3]), (None, [0, 1, 2, 3]),
+])
+def test_select_prunes_by_age(age, months):
+    store = store_for(month_frame())
+    assert store.select(*day_bounds('2021-01-01', '2021-04-30'), age) == months
+
+
+# Бюджет на три раздела без одного байта вмещает два: при обращении к более новому
+# месяцу вытесняется самый старый, а более старый месяц не вытесняет более новые
+@pytest.mark.parametrize('copy', [False, True])
+def test_hot_budget_evicts_oldest(copy):
+    frame = month_frame()
+    size = int(frame.iloc[:100].memory_usage(index=False).sum())
+    store = store_for(frame, hot_bytes=3 * size - 1, copy=copy)
+    for number, hot in [(0, [0]), (1, [0, 1]), (2, [1, 2]), (0, [1, 2]), (3, [2, 3]), (3, [2, 3])]:
+        rows = store.frame(number)
+        pd.testing.assert_frame_equal(rows, frame.iloc[100 * number:100 * (number + 1)])
+        assert sorted(store._hot) == hot
+        assert store.resident_bytes == size * len(hot)
+
+    # Горячий раздел — тот же объект при повторных обращениях; копия делается только с copy=True
+    rows = store.frame(3)
+    assert store.frame(3) is rows
+    assert np.shares_memory(rows['Total Purchase Amount'].to_numpy(), frame['Total Purchase Amount'].to_numpy()) != copy
+
+
+def test_partition_larger_than_budget_is_not_kept():
+    frame = month_frame()
+    store = store_for(frame, hot_bytes=10)
+    pd.testing.assert_frame_equal(store.frame(1), frame.iloc[100:200])
+    assert store._hot == {} and store.resident_bytes == 0
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import timeseries
+
+
+def daily_series(seed, days):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2020-01-01', periods=days, freq='D')
+    values = rng.gamma(2.0, 1000.0, days)
+    # Одиночные пики и провалы, которые прореживание не должно сгладить
+    values[rng.integers(1, days - 1, 3)] *= 20
+    values[rng.integers(1, days - 1, 3)] = 0
+    return dates, values
+
+
+@pytest.mark.parametrize('seed', range(10))
+@pytest.mark.parametrize('days, threshold', [(1100, 500), (5000, 100), (37, 10)])
+def test_lttb_keeps_first_last_and_extremes(seed, days, threshold):
+    dates, values = daily_series(seed, days)
+    x, y = timeseries.lttb(dates, values, threshold)
+    assert threshold <= len(y) <= threshold + 2
+    assert x[0] == dates[0] and x[-1] == dates[-1]
+    assert y.max() == values.max() and y.min() == values.min()
+    assert x.is_monotonic_increasing and x.is_unique
+    # Точки берутся из ряда как есть
+    np.testing.assert_array_equal(values[dates.get_indexer(x)], y)
+
+
+def test_lttb_keeps_short_series():
+    dates, values = daily_series(0, 50)
+    x, y = timeseries.lttb(dates, values, 500)
+    assert list(x) == list(dates)
+    np.testing.assert_array_equal(y, values)
+
+
+@pytest.mark.parametrize('n, threshold', [(0, 500), (10, 500), (1100, 500), (501, 500), (100000, 7)])
+def test_even_positions(n, threshold):
+    positions = timeseries.even_positions(n, threshold)
+    assert len(positions) == min(n, threshold)
+    if n:
+        assert positions[0] == 0 and positions[-1] == n - 1
+        assert np.all(np.diff(positions) > 0)
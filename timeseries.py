@@ -0,0 +1,84 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from filters import day_bounds
+
+# Целевое число точек на графике после прореживания
+TARGET_POINTS = int(os.environ.get('DASHBOARD_SERIES_POINTS', 500))
+
+# Скользящие суммы за window дней, заканчивающиеся в каждом из последних days дней ряда.
+# cumulative — префиксные суммы (cumulative[0] — до первого взятого дня), поэтому каждое окно —
+# разность двух элементов, и стоимость не зависит от длины окна и числа строк. Окна, которые
+# начинаются раньше первого взятого дня, получают NaN
+def rolling_sums(cumulative, days, window):
+    cumulative = np.asarray(cumulative, dtype=np.float64)
+    ends = np.arange(len(cumulative) - days, len(cumulative))
+    starts = ends - window
+    sums = cumulative[ends] - cumulative[np.maximum(starts, 0)]
+    sums[starts < 0] = np.nan
+    return sums
+
+
+# Номера threshold дней ряда из n с равным шагом, первый и последний — всегда. Скользящие
+# средние гладкие, поэтому для них такого прореживания достаточно
+def even_positions(n, threshold=TARGET_POINTS):
+    if n <= threshold or threshold < 2:
+        return np.arange(n)
+    return np.arange(threshold) * (n - 1) // (threshold - 1)
+
+
+# Largest-Triangle-Three-Buckets: оставляет threshold точек исходного ряда, выбирая в каждой
+# корзине точку с наибольшей площадью треугольника. Наибольшее и наименьшее значения ряда
+# добавляются к выбранным, даже если LTTB их не взял, поэтому точек может быть на две больше
+def lttb(x, y, threshold=TARGET_POINTS):
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return x, y
+    xs = np.asarray(pd.DatetimeIndex(x).asi8, dtype=np.float64)
+    ys = np.asarray(y, dtype=np.float64)
+    every = (n - 2) / (threshold - 2)
+    selected = np.zeros(threshold, dtype=np.int64)
+    a = 0
+    for i in range(threshold - 2):
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        avg_x = xs[avg_start:avg_end].mean()
+        avg_y = ys[avg_start:avg_end].mean()
+        range_start = int(i * every) + 1
+        range_end = int((i + 1) * every) + 1
+        area = np.abs(
+            (xs[a] - avg_x) * (ys[range_start:range_end] - ys[a])
+            - (xs[a] - xs[range_start:range_end]) * (avg_y - ys[a])
+        )
+        a = range_start + int(area.argmax())
+        selected[i + 1] = a
+    selected[-1] = n - 1
+    selected = np.union1d(selected, [ys.argmax(), ys.argmin()])
+    return x[selected], np.asarray(y)[selected]
+
+
+# Видимый по оси X интервал из relayoutData графика; None — показан весь ряд
+def visible_window(relayout_data):
+    if not relayout_data:
+        return None, None
+    if 'xaxis.range[0]' in relayout_data:
+        low, high = relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']
+    elif 'xaxis.range' in relayout_data:
+        low, high = relayout_data['xaxis.range']
+    else:
+        return None, None
+    return pd.Timestamp(low).date().isoformat(), pd.Timestamp(high).date().isoformat()
+
+
+# Пересечение диапазона фильтра с видимым окном графика
+def clip_range(start_date, end_date, window_start, window_end):
+    start, end = day_bounds(start_date, end_date)
+    window_start, window_end = day_bounds(window_start, window_end)
+    if window_start is not None:
+        start = window_start if start is None else max(start, window_start)
+    if window_end is not None:
+        end = window_end if end is None else min(end, window_end)
+    last_day = end - pd.Timedelta(days=1) if end is not None else None
+    return start, last_day